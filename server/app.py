@@ -1,12 +1,39 @@
 import os
 import json
-from flask import Flask, request, jsonify, send_from_directory
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from flask import Flask, Response, request, jsonify, send_from_directory
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 from youtube_transcript_api._api import YouTubeTranscriptApi
 from youtube_transcript_api._errors import TranscriptsDisabled, NoTranscriptFound, VideoUnavailable
 from dotenv import load_dotenv
 import requests  # Import the requests library
 import xml.etree.ElementTree as ET
+from transcript_cache import TranscriptCache
+from result_cache import ResultCache, content_hash
+from chunked_summarizer import MapReduceSummarizer, estimate_tokens
+from jobs import JobManager, JobQueueFullError
+from single_flight import SingleFlight
+from model_limiter import ModelConcurrencyLimiter, parse_model_limits, parse_model_settings
+from model_residency import ModelResidencyManager
+from model_registry import ModelRegistry
+from model_router import ModelRouter, PREFERRED
+from image_preprocessor import ImagePreprocessor, ImageRejectedError, image_hash
+from image_uploads import ImageUploadStore, ImageUploadError, ImageUploadNotFoundError
+from transcript import Transcript, format_timestamp
+from transcript_normalizer import TranscriptNormalizer
+from extractive_compressor import ExtractiveCompressor
+from video_index import HashingEmbedder, OllamaEmbedder, VideoIndexStore
+from search_index import DOCUMENT_KINDS, SearchIndex
+from playlist_resolver import resolve_playlist, PlaylistResolutionError
+from chapters import ChapterResolver, parse_timestamp
+from chat_sessions import ChatSessionStore, ChatSessionNotFoundError
+from conversation_context import ConversationContextManager
+from llm_client import CircuitBreaker, OllamaClient, OpenAIClient, ollama_stream_metadata
 
 # Load environment variables from .env file
 load_dotenv()
@@ -14,22 +41,117 @@ load_dotenv()
 app = Flask(__name__, static_folder='../client', static_url_path='')
 CORS(app)  # Enable CORS for all routes
 
+# --- Caches ---
+
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "cache"))
+
+transcript_cache = TranscriptCache(
+    os.path.join(CACHE_DIR, "transcripts.sqlite3"),
+    max_bytes=int(os.getenv("TRANSCRIPT_CACHE_MAX_BYTES", 100 * 1024 * 1024)),
+    max_entries=int(os.getenv("TRANSCRIPT_CACHE_MAX_ENTRIES", 5000)),
+    ttl_seconds=int(os.getenv("TRANSCRIPT_CACHE_TTL_SECONDS", 7 * 24 * 3600)))
+
+result_cache = ResultCache(
+    os.path.join(CACHE_DIR, "results.sqlite3"),
+    max_bytes=int(os.getenv("RESULT_CACHE_MAX_BYTES", 50 * 1024 * 1024)),
+    max_entries=int(os.getenv("RESULT_CACHE_MAX_ENTRIES", 10000)),
+    ttl_seconds=int(os.getenv("RESULT_CACHE_TTL_SECONDS", 30 * 24 * 3600)))
+
+# Full-text index of every transcript, summary and explanation the server has processed
+search_index = SearchIndex(
+    os.path.join(CACHE_DIR, "search.sqlite3"),
+    candidates_per_kind=int(os.getenv("SEARCH_CANDIDATES_PER_KIND", 1000)))
+
+job_manager = JobManager(
+    max_workers=int(os.getenv("JOB_WORKERS", 2)),
+    max_pending=int(os.getenv("JOB_QUEUE_LIMIT", 100)),
+    retention_seconds=int(os.getenv("JOB_RETENTION_SECONDS", 3600)))
+
+# --- LLM Clients ---
+
+# All model calls share these pooled clients, retry policy and circuit breakers
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+
+ollama_client = OllamaClient(
+    base_url=OLLAMA_BASE_URL,
+    pool_size=int(os.getenv("OLLAMA_POOL_SIZE", 20)),
+    max_retries=int(os.getenv("LLM_MAX_RETRIES", 2)),
+    backoff_base=float(os.getenv("LLM_RETRY_BACKOFF_SECONDS", 0.5)),
+    breaker=CircuitBreaker(
+        "ollama",
+        failure_threshold=int(os.getenv("CIRCUIT_BREAKER_THRESHOLD", 5)),
+        reset_timeout=int(os.getenv("CIRCUIT_BREAKER_RESET_SECONDS", 30))))
+
+openai_client = OpenAIClient(
+    os.getenv("OPENAI_API_KEY"),
+    timeout=int(os.getenv("OPENAI_TIMEOUT_SECONDS", 120)),
+    max_retries=int(os.getenv("LLM_MAX_RETRIES", 2)),
+    breaker=CircuitBreaker(
+        "openai",
+        failure_threshold=int(os.getenv("CIRCUIT_BREAKER_THRESHOLD", 5)),
+        reset_timeout=int(os.getenv("CIRCUIT_BREAKER_RESET_SECONDS", 30))))
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+OPENAI_VISION_MODEL = os.getenv("OPENAI_VISION_MODEL", "gpt-4o")
+
+# Installed Ollama models, listed once and refreshed in the background
+model_registry = ModelRegistry(
+    ollama_client, ttl_seconds=int(os.getenv("MODEL_REGISTRY_TTL_SECONDS", 300)))
+
+# Images are downscaled to each vision model's input resolution and cached by content hash
+image_preprocessor = ImagePreprocessor(
+    default_max_side=int(os.getenv("IMAGE_MAX_SIDE", 672)),
+    max_sides=parse_model_limits(os.getenv(
+        "IMAGE_MAX_SIDES", f"{OPENAI_VISION_MODEL}=2048")),
+    quality=int(os.getenv("IMAGE_JPEG_QUALITY", 85)),
+    cache_max_bytes=int(os.getenv("IMAGE_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+    cache_max_entries=int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", 256)))
+
+# Binary image uploads, referenced by ID from chat messages instead of base64 JSON
+image_uploads = ImageUploadStore(
+    spool_memory_bytes=int(os.getenv("IMAGE_UPLOAD_SPOOL_BYTES", 1024 * 1024)),
+    max_image_bytes=int(os.getenv("IMAGE_UPLOAD_MAX_BYTES", 20 * 1024 * 1024)),
+    max_total_bytes=int(os.getenv("IMAGE_UPLOAD_STORE_MAX_BYTES", 256 * 1024 * 1024)),
+    ttl_seconds=int(os.getenv("IMAGE_UPLOAD_TTL_SECONDS", 1800)))
+IMAGE_UPLOAD_MAX_REQUEST_BYTES = int(os.getenv("IMAGE_UPLOAD_MAX_REQUEST_BYTES", 64 * 1024 * 1024))
+# Also enforced while reading bodies without an honest Content-Length (chunked uploads)
+app.config['MAX_CONTENT_LENGTH'] = IMAGE_UPLOAD_MAX_REQUEST_BYTES
+
+# Per-video retrieval indexes for video-scoped chat; the hashing embedder is used when no embedding model is installed
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "nomic-embed-text")
+video_indexes = VideoIndexStore(
+    os.path.join(CACHE_DIR, "video_indexes.sqlite3"),
+    [OllamaEmbedder(ollama_client, EMBEDDING_MODEL,
+                    is_installed=lambda model: model_registry.pick([model]) is not None),
+     HashingEmbedder()],
+    chunk_tokens=int(os.getenv("VIDEO_CHUNK_TOKENS", 200)),
+    max_entries=int(os.getenv("VIDEO_INDEX_MAX_ENTRIES", 1000)))
+
+# Chapters scope summaries to part of a video; videos without chapters get fixed-length windows
+chapter_resolver = ChapterResolver(
+    window_seconds=int(os.getenv("CHAPTER_WINDOW_SECONDS", 300)))
+
+# Identical concurrent transcript downloads and generations are coalesced
+transcript_flights = SingleFlight("transcript")
+generation_flights = SingleFlight("generation")
+
+# Per-model limit on concurrent generations for batch processing
+model_limiter = ModelConcurrencyLimiter(
+    default_limit=int(os.getenv("BATCH_MODEL_CONCURRENCY_DEFAULT", 1)),
+    limits=parse_model_limits(os.getenv("BATCH_MODEL_CONCURRENCY")))
+
+BATCH_FETCH_WORKERS = int(os.getenv("BATCH_FETCH_WORKERS", 8))
+BATCH_MAX_VIDEOS = int(os.getenv("BATCH_MAX_VIDEOS", 500))
+
 # --- LLM Interaction Functions ---
 
 
-def summarize_with_local_llm(transcript_text, is_detailed_explanation=False):
-    """
-    Summarizes or explains text using a locally running Ollama model.
-    Uses different models: llama3.1:8b for explanations, gemma3:latest for summaries.
-    """
-    action_type = "explain in detail like a teacher" if is_detailed_explanation else "summarize concisely"
-    print(f"Attempting to {action_type} with local Ollama LLM...")
-    ollama_api_url = "http://localhost:11434/api/generate"  # Your Ollama API endpoint
+# Models and prompt templates used for transcript processing. The result cache
+# key includes both, so editing either invalidates previously cached outputs.
+SUMMARY_MODEL = "gemma3:latest"  # Lighter model for summaries
+EXPLANATION_MODEL = "llama3.1:8b"  # Better model for detailed explanations
 
-    # Use different models for different tasks
-    if is_detailed_explanation:
-        model_name = "llama3.1:8b"  # Better model for detailed explanations
-        prompt = f"""Act as an expert teacher and provide a comprehensive, detailed explanation of the following video transcript. Structure your response with these 7 sections:
+EXPLANATION_PROMPT_TEMPLATE = """Act as an expert teacher and provide a comprehensive, detailed explanation of the following video transcript. Structure your response with these 7 sections:
 
 1. **Overview & Main Topic** - What is this video fundamentally about?
 2. **Key Concepts Explained** - Break down the most important ideas presented
@@ -39,34 +161,388 @@ def summarize_with_local_llm(transcript_text, is_detailed_explanation=False):
 6. **Connections & Implications** - How does this relate to broader topics or what are the consequences?
 7. **Summary & Takeaways** - What should someone remember from this content?
 
-Aim for 800-1200 words total. Be thorough, educational, and clear in your explanations.
+Aim for 800-1200 words total. Be thorough, educational, and clear in your explanations. The transcript is marked with [m:ss] timestamps; cite the timestamp of the moment each key point comes from, like [12:34].
 
 Transcript to explain:
 {transcript_text}"""
-    else:
-        model_name = "gemma3:latest"  # Lighter model for summaries
-        prompt = f"""Provide a concise, well-structured summary of the following video transcript. Keep it between 200-400 words maximum. Focus on:
+
+SUMMARY_PROMPT_TEMPLATE = """Provide a concise, well-structured summary of the following video transcript. Keep it between 200-400 words maximum. Focus on:
 
 - Main topic and purpose
 - Key points covered
 - Important conclusions or takeaways
 - Essential details viewers should know
 
-Be clear, direct, and avoid unnecessary elaboration.
+Be clear, direct, and avoid unnecessary elaboration. The transcript is marked with [m:ss] timestamps; cite the timestamp of each key point, like [12:34].
 
 Transcript to summarize:
 {transcript_text}"""
 
+# Transcripts are sent to the model with a [m:ss] marker about this often, so results can cite timestamps
+TRANSCRIPT_TIMESTAMP_INTERVAL = int(os.getenv("TRANSCRIPT_TIMESTAMP_INTERVAL", 30))
+
+# Captions are cleaned before use: non-speech tags, rolling-caption repeats and fillers go, sentence breaks come back
+TRANSCRIPT_NORMALIZATION = os.getenv("TRANSCRIPT_NORMALIZATION", "true").lower() != "false"
+transcript_normalizer = TranscriptNormalizer(
+    pause_seconds=float(os.getenv("TRANSCRIPT_PAUSE_SECONDS", 1.0)))
+
+
+CHAT_MODEL = "llama3.1:8b"  # Upgraded chat model for better quality
+CHAT_SYSTEM_PROMPT = "You are ConvoScribe, a helpful AI assistant. You have context awareness and can reference previous parts of our conversation.\n\n"
+
+# Vision models in order of preference; the first one installed in Ollama is used
+VISION_MODELS = os.getenv(
+    "VISION_MODELS", "llava:latest,llava:13b,llava:7b,llava-llama3:latest").split(",")
+VISION_SYSTEM_PROMPT = "You are ConvoScribe, a helpful AI assistant with vision capabilities. You can see and analyze images. You have context awareness and can reference previous parts of our conversation.\n\n"
+DEFAULT_IMAGE_QUESTION = "What do you see in this image? Please describe it in detail."
+DEFAULT_IMAGES_QUESTION = "What do you see in these images? Please describe them in detail."
+
+# With several images, each is described by the vision model and the text model answers over the descriptions
+MAX_CHAT_IMAGES = int(os.getenv("MAX_CHAT_IMAGES", 20))
+IMAGE_DESCRIPTION_PROMPT = "Describe this image in detail. Transcribe all visible text exactly, including titles, bullet points, labels, numbers and code."
+IMAGE_DESCRIPTION_PROMPT_HASH = content_hash(IMAGE_DESCRIPTION_PROMPT)
+MULTI_IMAGE_SYSTEM_PROMPT = "You are ConvoScribe, a helpful AI assistant. The user has shared images, which were described for you below; answer from those descriptions as if you could see the images. You have context awareness and can reference previous parts of our conversation.\n\n"
+MULTI_IMAGE_MESSAGE_TEMPLATE = """The user shared {count} images. Descriptions, in order:
+
+{descriptions}
+
+{question}"""
+
+# Follow-up questions about session images are answered by the text model from their descriptions
+IMAGE_FOLLOWUP_SYSTEM_PROMPT = """You are ConvoScribe, a helpful AI assistant. The user has shared images in this conversation. You cannot see them, but detailed descriptions of them are below; answer from those descriptions as if you could see the images. If answering requires a visual detail that the descriptions do not cover, reply with exactly NEEDS_IMAGE and nothing else. You have context awareness and can reference previous parts of our conversation.
+
+{descriptions}
+
+"""
+NEEDS_IMAGE_MARKER = "NEEDS_IMAGE"
+
+# Per-model limit on concurrent image descriptions, so a slide deck cannot flood the vision model
+vision_limiter = ModelConcurrencyLimiter(
+    default_limit=int(os.getenv("VISION_MODEL_CONCURRENCY_DEFAULT", 2)),
+    limits=parse_model_limits(os.getenv("VISION_MODEL_CONCURRENCY")))
+image_description_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("IMAGE_DESCRIPTION_WORKERS", 4)), thread_name_prefix="image-describe")
+
+# Video-scoped chat answers from the transcript chunks most relevant to each question
+VIDEO_CHAT_TOP_K = int(os.getenv("VIDEO_CHAT_TOP_K", 5))
+VIDEO_CHAT_SYSTEM_PROMPT = "You are ConvoScribe, a helpful AI assistant. You answer questions about a YouTube video using the transcript excerpts given with each question. Each excerpt starts with its timestamp; cite the timestamps you used, like [12:34]. If the excerpts do not contain the answer, say so. You have context awareness and can reference previous parts of our conversation.\n\n"
+VIDEO_QUESTION_TEMPLATE = """Transcript excerpts:
+{excerpts}
+
+Question: {question}"""
+
+# Installed text models tried, in order, when a configured one is missing from Ollama
+TEXT_MODEL_FALLBACKS = os.getenv(
+    "TEXT_MODEL_FALLBACKS", "llama3.1:8b,gemma3:latest").split(",")
+
+
+def available_model(preferred):
+    """Returns `preferred` if Ollama has it installed, else the first installed fallback text model."""
+    return model_registry.pick([preferred] + TEXT_MODEL_FALLBACKS) or preferred
+
+
+def chat_model():
+    return preferred_model("chat")
+
+
+def route_candidates(task):
+    """The installed models on a task's route, in order; all of them while the installed list is unknown."""
+    route = model_router.routes[task]
+    if model_registry.installed() is None:
+        return route
+    installed = [model for model in route if model_registry.is_installed(model)]
+    return installed or [available_model(route[0])]
+
+
+def preferred_model(task):
+    return route_candidates(task)[0]
+
+
+def route_model(task, input_tokens, input_limit=None):
+    """Picks the model for one request of `task` with the model router; returns its decision."""
+    decision = model_router.route(task, input_tokens, route_candidates(task), input_limit)
+    if decision["reason"] != PREFERRED:
+        skipped = ", ".join(
+            f"{entry['model']} ({entry['rule']}, about {entry['estimated_seconds']}s)" for entry in decision["skipped"])
+        print(f"Routed {task} with {input_tokens} input tokens to {decision['model']} "
+              f"({decision['reason']}); skipped {skipped or 'none'}", flush=True)
+    return decision
+
+
+CHAT_HISTORY_SUMMARY_PROMPT_TEMPLATE = """You maintain a running summary of a conversation between a user and an AI assistant. Update the summary with the new messages below. Keep names, facts, decisions, open questions and anything the user asked to remember. Write at most 200 words of plain prose, with no preamble.
+
+Current summary:
+{previous_summary}
+
+New messages:
+{messages}"""
+
+
+def render_chat_message(message_type, content):
+    """Renders one history message as a prompt line."""
+    role = "User" if message_type == 'user' else "Assistant"
+    return f"{role}: {content}\n"
+
+
+def build_chat_turn(user_message):
+    return f"User: {user_message}\nAssistant:"
+
+
+def build_chat_prompt(user_message, rendered_history="", system_prompt=CHAT_SYSTEM_PROMPT):
+    """Builds the chat prompt from already-rendered history lines and the new message."""
+    return f"{system_prompt}{rendered_history}{build_chat_turn(user_message)}"
+
+
+def build_conversation_prompt(conversation_history, current_message, model_name=None, system_prompt=CHAT_SYSTEM_PROMPT):
+    """
+    Build a conversation prompt from a client-supplied history.
+    Used by clients that send the whole conversation instead of a session ID;
+    keeps the most recent messages that fit in the model's token budget.
+    """
+    messages = []
+    for msg in conversation_history:
+        content = msg.get('content', '').strip()
+        # Skip image data but keep text
+        if content and not content.startswith('data:image'):
+            rendered = render_chat_message(msg.get('type'), content)
+            messages.append({"rendered": rendered, "tokens": estimate_tokens(rendered)})
+
+    history = chat_context.render_history(
+        messages, model_name or chat_model(), system_prompt + build_chat_turn(current_message))
+    return build_chat_prompt(current_message, history, system_prompt)
+
+
+def build_session_prompt(session, user_message, model_name=None, system_prompt=CHAT_SYSTEM_PROMPT):
+    """Builds the full chat prompt from a session's rolling summary and the recent messages that fit."""
+    history = chat_context.render_session_history(
+        session, model_name or chat_model(), system_prompt + build_chat_turn(user_message))
+    return build_chat_prompt(user_message, history, system_prompt)
+
+
+def summarize_chat_history(previous_summary, rendered_messages):
+    """Folds older chat messages into the rolling summary with the lighter summary model."""
+    prompt = CHAT_HISTORY_SUMMARY_PROMPT_TEMPLATE.format(
+        previous_summary=previous_summary or "(none yet)", messages=rendered_messages)
+    return generate_with_ollama(available_model(SUMMARY_MODEL), prompt, timeout=120)
+
+
+chat_sessions = ChatSessionStore(
+    render_chat_message,
+    idle_ttl_seconds=int(os.getenv("CHAT_SESSION_TTL_SECONDS", 1800)),
+    max_sessions=int(os.getenv("CHAT_SESSION_MAX", 1000)),
+    max_session_images=int(os.getenv("CHAT_SESSION_MAX_IMAGES", 8)))
+
+# Context window per chat model, in tokens ("model=tokens,..."); history fills what the prompt and reply leave
+chat_context = ConversationContextManager(
+    summarize_chat_history,
+    default_budget=int(os.getenv("CHAT_CONTEXT_TOKENS_DEFAULT", 4096)),
+    budgets=parse_model_limits(os.getenv("CHAT_CONTEXT_TOKENS")),
+    reply_reserve=int(os.getenv("CHAT_REPLY_RESERVE_TOKENS", 1024)))
+
+# Continue sessions from Ollama's returned context instead of re-sending the history
+CHAT_REUSE_CONTEXT = os.getenv("CHAT_REUSE_CONTEXT", "true").lower() != "false"
+
+
+def build_chat_payload(prompt, context=None):
+    if context:
+        # A returned context only continues the model that produced it
+        model_name = chat_model()
+    else:
+        # The history was fitted to the preferred model; smaller windows rule a model out
+        model_name = route_model(
+            "chat", estimate_tokens(prompt),
+            input_limit=lambda model: chat_context.budget_for(model) - chat_context.reply_reserve)["model"]
+    payload = {
+        "model": model_name,
+        "prompt": prompt,
+        "stream": False,
+        "keep_alive": model_residency.keep_alive_for(model_name),
+        # Match Ollama's context window to the budget the history was fitted to
+        "options": {"num_ctx": chat_context.budget_for(model_name)}
+    }
+    if context:
+        payload["context"] = context
+    return payload
+
+
+def reusable_chat_context(session, user_message, system_prompt=CHAT_SYSTEM_PROMPT):
+    """Returns the session's Ollama context if the next turn can continue from it, else None."""
+    if not CHAT_REUSE_CONTEXT or not session.context:
+        return None
+    model_name = chat_model()
+    if session.context_model != model_name:
+        return None
+    # A context built under another system prompt (e.g. a video question after plain chat) would drop this one
+    if session.context_system_prompt != system_prompt:
+        return None
+    if not chat_context.fits(model_name, len(session.context), build_chat_turn(user_message)):
+        print(
+            f"Chat session {session.id} context reached {len(session.context)} tokens; rebuilding prompt from summary and history", flush=True)
+        return None
+    return session.context
+
+
+def record_chat_turn(session, user_message, reply, response_data, context_reused, system_prompt=CHAT_SYSTEM_PROMPT):
+    session.add_turn(user_message, reply,
+                     context=response_data.get("context"), model=response_data.get("model", chat_model()),
+                     system_prompt=system_prompt)
+    chat_sessions.record_prompt_eval(context_reused, response_data)
+
+
+def get_model_and_prompt_template(is_detailed_explanation):
+    """Returns the (preferred model_name, prompt_template) pair for a summary or explanation."""
+    if is_detailed_explanation:
+        return preferred_model("explanation"), EXPLANATION_PROMPT_TEMPLATE
+    return preferred_model("summary"), SUMMARY_PROMPT_TEMPLATE
+
+
+# Models preloaded at startup and kept resident; keep_alive accepts Ollama durations ("30m", "-1" = forever)
+model_residency = ModelResidencyManager(
+    ollama_client,
+    models=os.getenv("WARM_MODELS", ",".join(
+        [CHAT_MODEL, SUMMARY_MODEL, EXPLANATION_MODEL])).split(","),
+    keep_alive_default=os.getenv("MODEL_KEEP_ALIVE_DEFAULT", "30m"),
+    keep_alive=parse_model_settings(os.getenv("MODEL_KEEP_ALIVE")),
+    check_interval=int(os.getenv("MODEL_RESIDENCY_CHECK_SECONDS", 60)),
+    warmup_timeout=int(os.getenv("MODEL_WARMUP_TIMEOUT_SECONDS", 300)),
+    rewarm=os.getenv("MODEL_REWARM", "true").lower() != "false")
+# How long a request waits for a cold model to load before it is sent anyway
+MODEL_WARMUP_WAIT_SECONDS = int(os.getenv("MODEL_WARMUP_WAIT_SECONDS", 120))
+
+# Each task is routed to the first model on its list that fits the prompt, has room in its queue
+# and is expected to answer within the task's SLO; under load, requests degrade to smaller models
+MODEL_ROUTES = {
+    "summary": os.getenv("SUMMARY_MODEL_ROUTE", SUMMARY_MODEL).split(","),
+    "explanation": os.getenv("EXPLANATION_MODEL_ROUTE", f"{EXPLANATION_MODEL},{SUMMARY_MODEL}").split(","),
+    "chat": os.getenv("CHAT_MODEL_ROUTE", f"{CHAT_MODEL},{SUMMARY_MODEL}").split(","),
+    "chunk": os.getenv("CHUNK_MODEL_ROUTE", SUMMARY_MODEL).split(","),
+}
+# Typical reply lengths in tokens until replies have been measured
+ROUTE_OUTPUT_TOKENS = {"summary": 550, "explanation": 1500, "chat": 300, "chunk": 250}
+model_router = ModelRouter(
+    MODEL_ROUTES,
+    slo_seconds={task: float(seconds) for task, seconds in parse_model_settings(os.getenv(
+        "MODEL_ROUTE_SLO_SECONDS", "summary=120,explanation=240,chat=60,chunk=90")).items()},
+    output_tokens=ROUTE_OUTPUT_TOKENS,
+    max_queue_default=int(os.getenv("MODEL_ROUTE_MAX_QUEUE_DEFAULT", 4)),
+    max_queue=parse_model_limits(os.getenv("MODEL_ROUTE_MAX_QUEUE")),
+    input_limits=parse_model_limits(os.getenv("MODEL_ROUTE_MAX_INPUT_TOKENS")),
+    is_warm=lambda model: model_residency.is_warm(model))
+
+
+# Long transcripts are split into chunks of at most this many tokens and summarized
+# with map-reduce; notes for each chunk come from the "chunk" route (the lighter summary model).
+CHUNK_TOKEN_BUDGET = int(os.getenv("CHUNK_TOKEN_BUDGET", 3000))
+CHUNK_WORKERS = int(os.getenv("CHUNK_WORKERS", 2))
+
+CHUNK_DETAIL_SUMMARY = "Keep it to 80-150 words covering only the key points."
+CHUNK_DETAIL_EXPLANATION = "Keep it to 200-350 words and preserve concepts, definitions, steps, examples and important details."
+
+CHUNK_PROMPT_TEMPLATE = """The following is part {index} of {total} of a long video transcript. Write notes on this part only, in plain prose, keeping the [m:ss] timestamp of each point you note. {detail}
+
+Transcript part:
+{chunk_text}"""
+
+REDUCE_NOTES_HEADER = "(The transcript was too long to process at once; below are notes on each consecutive part, in order.)\n\n"
+
+chunked_summarizer = MapReduceSummarizer(
+    chunk_tokens=CHUNK_TOKEN_BUDGET, max_workers=CHUNK_WORKERS)
+
+# A time range spanning several chapters is summarized from each chapter's own cached result
+RANGE_NOTES_HEADER = "(Below are the summaries of each consecutive part of the requested section of the video, in order.)\n\n"
+# Uncovered edges of a range shorter than this are passed on as transcript instead of being summarized
+RANGE_MIN_SUMMARY_SECONDS = int(os.getenv("RANGE_MIN_SUMMARY_SECONDS", 60))
+chapter_summary_executor = ThreadPoolExecutor(
+    max_workers=CHUNK_WORKERS, thread_name_prefix="chapter-summarizer")
+
+# Transcripts far over the chunk budget can first be cut down to their key sentences.
+# Presets trade speed for quality: the budget is a multiple of EXTRACTIVE_COMPRESSION_TOKENS,
+# and a larger one leaves more for map-reduce to read.
+EXTRACTIVE_COMPRESSION = os.getenv("EXTRACTIVE_COMPRESSION", "off").lower()
+EXTRACTIVE_COMPRESSION_TOKENS = int(os.getenv("EXTRACTIVE_COMPRESSION_TOKENS", CHUNK_TOKEN_BUDGET))
+COMPRESSION_PRESETS = {
+    "fast": {"method": "tfidf", "budgets": 1, "redundancy_threshold": None},
+    "balanced": {"method": "textrank", "budgets": 2, "redundancy_threshold": 0.8},
+    "thorough": {"method": "textrank", "budgets": 4, "redundancy_threshold": 0.7},
+}
+extractive_compressor = ExtractiveCompressor()
+
+
+def get_result_cache_key(transcript_text, is_detailed_explanation, model_name=None):
+    """
+    Builds the (transcript hash, mode, model, prompt hash) key for the result
+    cache. The model is the preferred one unless `model_name` is given.
+    """
+    action = "explanation" if is_detailed_explanation else "summary"
+    preferred, prompt_template = get_model_and_prompt_template(
+        is_detailed_explanation)
+    model_name = model_name or preferred
+    # Chunk prompts shape the output of long transcripts, so they are part of the key too
+    prompt_hash = content_hash(
+        prompt_template + CHUNK_PROMPT_TEMPLATE + REDUCE_NOTES_HEADER)
+    return (content_hash(transcript_text), action, model_name, prompt_hash)
+
+
+def invalidate_stale_results():
+    """Drops cached results produced by a model or prompt that is no longer configured."""
+    # Compares against the configured routes, not fallbacks picked while a model is missing
+    for is_detailed_explanation in (False, True):
+        _, action, _, prompt_hash = get_result_cache_key(
+            "", is_detailed_explanation)
+        removed = result_cache.invalidate_stale(action, MODEL_ROUTES[action], prompt_hash)
+        if removed:
+            print(f"Invalidated {removed} stale cached {action} results.")
+
+
+_background_services_lock = threading.Lock()
+_background_services_started = False
+
+
+def start_background_services():
+    """
+    Invalidates stale cached results and starts the model registry and
+    residency threads, once per process. Called on the first request, so it
+    runs in each WSGI worker after any fork, and from the ASGI app's startup.
+    """
+    global _background_services_started
+    with _background_services_lock:
+        if _background_services_started:
+            return
+        _background_services_started = True
+    invalidate_stale_results()
+    model_registry.start()
+    model_residency.start()
+
+
+@app.before_request
+def ensure_background_services():
+    if not _background_services_started:
+        start_background_services()
+
+
+def generate_with_ollama(model_name, prompt, timeout=300, images=None, task=None):
+    """
+    Runs a single non-streaming generation against the local Ollama API.
+    Returns the stripped response text, or None if the call failed.
+    `timeout` is the deadline for the whole call, including retries.
+    `images` are base64 strings (without a data URL prefix) for vision models.
+    The measured speed feeds the model router; `task` names the routed task.
+    """
     payload = {
         "model": model_name,
         "prompt": prompt,
-        "stream": False  # We want the full response, not a stream
+        "stream": False,  # We want the full response, not a stream
+        "keep_alive": model_residency.keep_alive_for(model_name)
     }
+    if images:
+        payload["images"] = images
+    model_residency.ensure_warm(model_name, MODEL_WARMUP_WAIT_SECONDS)
 
     try:
-        response = requests.post(
-            # Increased timeout for potentially longer explanations
-            ollama_api_url, json=payload, timeout=300)
+        # Increased timeout for potentially longer explanations
+        with model_router.track(model_name):
+            response = ollama_client.post(
+                "/api/generate", payload, deadline=timeout)
 
         print(f"Ollama API response status code: {response.status_code}")
         # Print first 500 chars
@@ -83,6 +559,7 @@ Transcript to summarize:
             return None
 
         content = response_data.get("response")
+        model_router.observe(model_name, response_data, task)
 
         if content:
             print(f"Successfully got content from {model_name}.")
@@ -97,7 +574,7 @@ Transcript to summarize:
         return None
     except requests.exceptions.ConnectionError as e:
         print(
-            f"Ollama API connection error. Is Ollama running at {ollama_api_url}? Error: {e}")
+            f"Ollama API connection error. Is Ollama running at {ollama_client.base_url}? Error: {e}")
         return None
     except requests.exceptions.RequestException as e:  # Catches other requests-related errors like HTTPError
         print(f"Ollama API request failed: {e}")
@@ -110,42 +587,618 @@ Transcript to summarize:
         return None
 
 
+def stream_with_ollama(model_name, prompt, timeout=300, images=None, task=None):
+    """
+    Streams a generation from the local Ollama API. Yields {"chunk": text} for
+    each token batch and finally a metadata dict with the model, token counts
+    and durations. Request errors are raised to the caller.
+    """
+    payload = {
+        "model": model_name,
+        "prompt": prompt,
+        "stream": True,
+        "keep_alive": model_residency.keep_alive_for(model_name)
+    }
+    if images:
+        payload["images"] = images
+    model_residency.ensure_warm(model_name, MODEL_WARMUP_WAIT_SECONDS)
+
+    with model_router.track(model_name):
+        for chunk_data in ollama_client.stream_lines("/api/generate", payload, deadline=timeout):
+            if chunk_data.get('response'):
+                yield {"chunk": chunk_data['response']}
+
+            if chunk_data.get('done', False):
+                model_router.observe(model_name, chunk_data, task)
+                yield ollama_stream_metadata(chunk_data, model_name)
+                return
+
+
+def route_transcript(transcript_text, is_detailed_explanation):
+    """Routes a summary or explanation; returns the model router's decision."""
+    _, prompt_template = get_model_and_prompt_template(is_detailed_explanation)
+    # Long transcripts reach the final prompt as notes of about one chunk
+    input_tokens = estimate_tokens(prompt_template) + min(
+        estimate_tokens(transcript_text), CHUNK_TOKEN_BUDGET)
+    return route_model("explanation" if is_detailed_explanation else "summary", input_tokens)
+
+
+def build_local_llm_prompt(transcript_text, is_detailed_explanation=False, progress=None, model_name=None):
+    """
+    Returns the (model_name, prompt) pair for a summary or explanation.
+    The model is `model_name`, or else the one route_transcript picks.
+    Transcripts over the chunk token budget are first condensed with map-reduce;
+    the prompt is None if that step failed.
+    """
+    _, prompt_template = get_model_and_prompt_template(is_detailed_explanation)
+    if model_name is None:
+        model_name = route_transcript(transcript_text, is_detailed_explanation)["model"]
+
+    if chunked_summarizer.needs_chunking(transcript_text):
+        transcript_text = condense_transcript(
+            transcript_text, is_detailed_explanation, progress=progress)
+        if transcript_text is None:
+            return model_name, None
+
+    return model_name, prompt_template.format(transcript_text=transcript_text)
+
+
+def condense_transcript(transcript_text, is_detailed_explanation=False, progress=None):
+    """
+    Map step for long transcripts: each chunk is condensed into notes by the
+    lighter summary model. Returns the combined notes, ready to be placed in the
+    usual summary or 7-section explanation prompt, or None on failure.
+    """
+    detail = CHUNK_DETAIL_EXPLANATION if is_detailed_explanation else CHUNK_DETAIL_SUMMARY
+
+    def map_chunk(chunk, index, total):
+        prompt = CHUNK_PROMPT_TEMPLATE.format(
+            index=index + 1, total=total, detail=detail, chunk_text=chunk)
+        model_name = route_model("chunk", estimate_tokens(prompt))["model"]
+        return generate_with_ollama(model_name, prompt, task="chunk")
+
+    def on_chunk_done(completed, total, level):
+        if progress:
+            progress("condensing", {
+                     "completed_chunks": completed, "total_chunks": total, "level": level})
+
+    partials, report = chunked_summarizer.condense(
+        transcript_text, map_chunk, on_chunk_done=on_chunk_done)
+
+    chunk_times = ", ".join(
+        f"L{timing['level']}#{timing['chunk']}={timing['seconds']}s" for timing in report["chunks"])
+    print(
+        f"Condensed {len(report['chunks'])} chunks over {report['levels']} level(s) "
+        f"in {report['total_seconds']}s: {chunk_times}")
+
+    if partials is None:
+        return None
+    notes = "\n\n".join(
+        f"[Part {index + 1} of {len(partials)}]\n{partial}" for index, partial in enumerate(partials))
+    return REDUCE_NOTES_HEADER + notes
+
+
+def summarize_with_local_llm(transcript_text, is_detailed_explanation=False, progress=None, model_name=None):
+    """
+    Summarizes or explains text using a locally running Ollama model.
+    The model is `model_name`, or the one the model router picks for the
+    explanation or summary route.
+    Transcripts over the chunk token budget go through map-reduce summarization.
+    """
+    action_type = "explain in detail like a teacher" if is_detailed_explanation else "summarize concisely"
+    print(f"Attempting to {action_type} with local Ollama LLM...")
+
+    model_name, prompt = build_local_llm_prompt(
+        transcript_text, is_detailed_explanation, progress=progress, model_name=model_name)
+    if prompt is None:
+        return None
+
+    if progress:
+        progress("generating", {"model": model_name})
+    return generate_with_ollama(
+        model_name, prompt, task="explanation" if is_detailed_explanation else "summary")
+
+
 def summarize_with_api_llm(transcript_text, is_detailed_explanation=False):
-    """Placeholder for summarizing or explaining text using a cloud-based LLM API."""
+    """Summarizes or explains text using the OpenAI API as a fallback for the local LLM."""
     action_type = "explain in detail" if is_detailed_explanation else "summarize"
     print(f"Attempting to {action_type} with API LLM...")
-    api_key = os.getenv("OPENAI_API_KEY")  # Example for OpenAI
 
-    if not api_key:
+    if not openai_client.configured:
         print("API key or endpoint for LLM not found in .env file.")
         return None
 
-    # Example for OpenAI API (requires 'openai' library: pip install openai)
-    # from openai import OpenAI
-    # client = OpenAI(api_key=api_key)
-    # try:
-    #     system_prompt = "You are a helpful assistant that summarizes video transcripts concisely."
-    #     user_prompt = f"Please summarize the following transcript:\n\n{transcript_text}"
-    #     if is_detailed_explanation:
-    #         system_prompt = "You are a knowledgeable teacher. Explain the following transcript line by line, providing examples and detailed explanations for concepts discussed. Be thorough and clear."
-    #         user_prompt = f"Please explain the following transcript in detail:\n\n{transcript_text}"
-
-    #     response = client.chat.completions.create(
-    #         model="gpt-3.5-turbo", # Or your preferred model
-    #         messages=[
-    #             {"role": "system", "content": system_prompt},
-    #             {"role": "user", "content": user_prompt}
-    #         ]
-    #     )
-    #     content = response.choices[0].message.content
-    #     return content
-    # except Exception as e:
-    #     print(f"OpenAI API call failed: {e}")
-    #     return None
-
-    print(f"API LLM {action_type} not implemented yet.")
+    system_prompt = "You are a helpful assistant that summarizes video transcripts concisely."
+    if is_detailed_explanation:
+        system_prompt = "You are a knowledgeable teacher who explains video transcripts in depth."
+    _, prompt_template = get_model_and_prompt_template(is_detailed_explanation)
+
+    try:
+        content = openai_client.chat(
+            OPENAI_MODEL,
+            [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": prompt_template.format(
+                    transcript_text=transcript_text)}
+            ])
+    except Exception as e:
+        print(f"OpenAI API call failed: {e}")
+        return None
+
+    if content:
+        print(f"Successfully got content from {OPENAI_MODEL}.")
+        return content.strip()
     return None
 
+# --- Transcript Functions ---
+
+
+def fetch_transcript(video_id, language="en"):
+    """
+    Returns the Transcript for a video, serving repeats from the disk cache.
+    Only a successful fetch is cached, so the fallback path runs at most once per miss.
+    """
+    transcript = transcript_cache.get(video_id, language)
+    if transcript is not None:
+        print(f"Transcript cache hit for video ID: {video_id}")
+        return transcript
+
+    def download():
+        print(f"Fetching transcript for video ID: {video_id}")
+
+        # Try to get transcript with better error handling
+        try:
+            transcript_list = YouTubeTranscriptApi.get_transcript(
+                video_id, languages=[language])
+        except Exception as transcript_error:
+            print(f"Transcript fetch error: {transcript_error}")
+            # Try alternative language codes if English fails
+            try:
+                transcript_list = YouTubeTranscriptApi.get_transcript(
+                    video_id, languages=[f'{language}-US', f'{language}-GB', language])
+            except Exception as lang_error:
+                print(
+                    f"Alternative language transcript fetch error: {lang_error}")
+                raise transcript_error  # Re-raise the original error
+
+        transcript = Transcript.from_segments(transcript_list)
+        transcript_cache.put(video_id, language, transcript)
+        return transcript
+
+    # Concurrent misses for the same video share a single download
+    transcript, _ = transcript_flights.do((video_id, language), download)
+    return transcript
+
+
+class TranscriptProcessingError(Exception):
+    """A transcript processing failure with a user-facing message and HTTP status."""
+
+    def __init__(self, message, status_code=500):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+def extract_video_id(youtube_url):
+    """Returns the video ID from a watch or youtu.be URL, or None if there is none."""
+    video_id = None
+    if "v=" in youtube_url:
+        video_id = youtube_url.split("v=")[1].split("&")[0]
+    elif "youtu.be/" in youtube_url:
+        video_id = youtube_url.split("youtu.be/")[1].split("?")[0]
+    return video_id
+
+
+def load_transcript(youtube_url):
+    """
+    Resolves a YouTube URL to (video_id, transcript), where transcript is a Transcript.
+    Raises TranscriptProcessingError with the matching HTTP status on failure.
+    """
+    video_id = extract_video_id(youtube_url)
+    if not video_id:
+        raise TranscriptProcessingError("Invalid YouTube URL format", 400)
+
+    try:
+        transcript = fetch_transcript(video_id)
+    except NoTranscriptFound:
+        raise TranscriptProcessingError(
+            "No transcript found for this video. It might be disabled or not available in English.", 404)
+    except TranscriptsDisabled:
+        raise TranscriptProcessingError(
+            "Transcripts are disabled for this video.", 403)
+    except VideoUnavailable:
+        raise TranscriptProcessingError(
+            "This video is unavailable or private.", 404)
+    except ET.ParseError as xml_error:
+        print(f"XML parsing error: {xml_error}")
+        raise TranscriptProcessingError(
+            "Failed to parse transcript data. The video transcript format may be corrupted.", 500)
+
+    # The cache keeps the captions as fetched, so normalization changes apply to cached videos too
+    if TRANSCRIPT_NORMALIZATION:
+        transcript = transcript_normalizer.normalize(video_id, transcript)
+    search_index.add_transcript(video_id, transcript)
+    return video_id, transcript
+
+
+def load_transcript_text(youtube_url, compression=None):
+    """
+    Resolves a YouTube URL to (video_id, transcript_text), the prompt text with
+    [m:ss] markers every TRANSCRIPT_TIMESTAMP_INTERVAL seconds.
+    `compression` is a COMPRESSION_PRESETS name, or None to keep every sentence.
+    Raises TranscriptProcessingError with the matching HTTP status on failure.
+    """
+    video_id, transcript = load_transcript(youtube_url)
+    if not transcript.text.strip():
+        raise TranscriptProcessingError("Fetched transcript is empty.", 500)
+    transcript_text = prompt_text(video_id, transcript, compression)
+
+    print(
+        f"Transcript fetched successfully. Length: {len(transcript_text)} chars.")
+    return video_id, transcript_text
+
+
+def parse_compression(data):
+    """
+    Reads the optional "compression" field of a summarize or explain request:
+    "off" or a COMPRESSION_PRESETS name, defaulting to EXTRACTIVE_COMPRESSION.
+    Returns None when off. Raises TranscriptProcessingError (400) if invalid.
+    """
+    compression = data.get("compression", EXTRACTIVE_COMPRESSION)
+    if compression == "off":
+        return None
+    if compression not in COMPRESSION_PRESETS:
+        raise TranscriptProcessingError(
+            f"'compression' must be one of: off, {', '.join(COMPRESSION_PRESETS)}", 400)
+    return compression
+
+
+def prompt_text(video_id, transcript, compression=None):
+    """
+    The prompt text of a Transcript, with timestamp markers. With a
+    `compression` preset, a transcript over that preset's token budget is
+    replaced by a digest of its highest-ranked sentences.
+    """
+    transcript_text = transcript.timestamped_text(TRANSCRIPT_TIMESTAMP_INTERVAL)
+    if compression is None:
+        return transcript_text
+    preset = COMPRESSION_PRESETS[compression]
+    max_tokens = preset["budgets"] * EXTRACTIVE_COMPRESSION_TOKENS
+    if estimate_tokens(transcript_text) <= max_tokens:
+        return transcript_text
+
+    digest, report = extractive_compressor.compress(
+        transcript, max_tokens, preset["method"], preset["redundancy_threshold"],
+        TRANSCRIPT_TIMESTAMP_INTERVAL)
+    print(f"Compressed transcript of video {video_id} ({compression}): {report['tokens_before']} -> "
+          f"{report['tokens_after']} tokens, {report['kept_sentences']} of {report['sentences']} "
+          f"sentences in {report['milliseconds']}ms")
+    return digest
+
+
+def generate_transcript_result(video_id, transcript_text, is_detailed_explanation, progress=None, scope=None, limiter=None):
+    """
+    Returns the summary or explanation for a transcript, checking the result
+    cache before calling any LLM. Returns None if all methods failed.
+    `progress`, if given, is called with (stage, details) as work advances.
+    `scope` is the (start, end) of the part of the video the text covers, or
+    None for the whole video. With a ModelConcurrencyLimiter as `limiter`,
+    local generation holds a slot for the model the router picked.
+    """
+    action = "explanation" if is_detailed_explanation else "summary"
+
+    # Serve repeat requests for the same transcript, model and prompt from the cache
+    cache_key = get_result_cache_key(transcript_text, is_detailed_explanation)
+    content = result_cache.get(*cache_key)
+    if content is not None:
+        print(f"Result cache hit for {action} of video ID: {video_id}")
+        index_result(video_id, action, content, scope)
+        return content
+
+    def generate():
+        # Under load the router may pick a smaller model, whose result may already be cached
+        model_name = route_transcript(transcript_text, is_detailed_explanation)["model"]
+        routed_key = get_result_cache_key(transcript_text, is_detailed_explanation, model_name)
+        if routed_key != cache_key:
+            content = result_cache.get(*routed_key)
+            if content is not None:
+                print(f"Result cache hit for {action} by {model_name} of video ID: {video_id}")
+                return content
+
+        # Try local LLM first
+        with limiter.slot(model_name) if limiter is not None else nullcontext():
+            content = summarize_with_local_llm(
+                transcript_text, is_detailed_explanation, progress=progress, model_name=model_name)
+        if content is not None:
+            result_cache.put(*routed_key, content)
+
+        # Fallback to API LLM if local LLM fails or is not implemented
+        if content is None:
+            print(
+                f"Local LLM failed or not implemented, trying API LLM for {action}.")
+            content = summarize_with_api_llm(
+                transcript_text, is_detailed_explanation)
+
+        return content
+
+    # Identical concurrent requests wait for the first one instead of generating again
+    # The transcript hash tells apart compressed and full text for the same scope
+    content, shared = generation_flights.do(
+        (video_id, action, cache_key[2], scope, cache_key[0]), generate)
+    if shared:
+        print(f"Shared in-flight {action} for video ID: {video_id}")
+    elif content:
+        index_result(video_id, action, content, scope)
+    return content
+
+
+def index_result(video_id, action, content, scope=None):
+    """Adds a whole-video result to the search index; results for part of a video are not indexed."""
+    if scope is None:
+        search_index.add_result(video_id, action, content)
+
+# --- Time Ranges and Chapters ---
+
+
+def parse_transcript_scope(data):
+    """
+    Reads the optional "chapter" or "start"/"end" fields of a summarize or
+    explain request. Returns None for the whole video, {"chapter": index}, or
+    {"start": seconds, "end": seconds or None}. Times may be seconds or
+    timestamps like "45:00". Raises TranscriptProcessingError (400) if invalid.
+    """
+    chapter = data.get("chapter")
+    start = data.get("start")
+    end = data.get("end")
+    if chapter is not None:
+        if start is not None or end is not None:
+            raise TranscriptProcessingError("Give either 'chapter' or 'start'/'end', not both", 400)
+        if isinstance(chapter, bool) or not isinstance(chapter, int) or chapter < 0:
+            raise TranscriptProcessingError("'chapter' must be a chapter index (0 or more)", 400)
+        return {"chapter": chapter}
+    if start is None and end is None:
+        return None
+
+    try:
+        start = parse_timestamp(start) if start is not None else 0.0
+        end = parse_timestamp(end) if end is not None else None
+    except ValueError:
+        raise TranscriptProcessingError(
+            "'start' and 'end' must be seconds or timestamps like 45:00", 400)
+    if start < 0 or (end is not None and end <= start):
+        raise TranscriptProcessingError("'start' must be 0 or more and 'end' must be after it", 400)
+    return {"start": start, "end": end}
+
+
+def result_scope(range_info):
+    """The (start, end) scope passed to generate_transcript_result for a load_scoped_text range."""
+    return None if range_info is None else (range_info["start"], range_info["end"])
+
+
+def range_text(video_id, transcript, start, end, compression=None):
+    """The prompt text, with timestamp markers, of the segments between `start` and `end` seconds."""
+    return prompt_text(video_id, transcript.between(start, end), compression)
+
+
+def load_scoped_text(youtube_url, scope=None, is_detailed_explanation=False, progress=None, compression=None):
+    """
+    Resolves a YouTube URL and a scope from parse_transcript_scope to
+    (video_id, transcript_text, range_info). range_info describes the part of
+    the video that was selected, and is None for the whole video.
+
+    A chapter, or a range within one chapter, is summarized from its own slice
+    of the transcript. A range over several chapters is summarized from the
+    result for each chapter it covers, so the results are cached per chapter
+    and reused by later ranges. Missing chapter results are generated here
+    first. `compression` is passed on to prompt_text for every transcript part.
+    Raises TranscriptProcessingError with the matching HTTP status.
+    """
+    if scope is None:
+        video_id, transcript_text = load_transcript_text(youtube_url, compression)
+        return video_id, transcript_text, None
+
+    video_id, transcript = load_transcript(youtube_url)
+    chapters = chapter_resolver.get(video_id, transcript.end)
+
+    if "chapter" in scope:
+        if scope["chapter"] >= len(chapters):
+            raise TranscriptProcessingError(
+                f"'chapter' must be below {len(chapters)}, the number of chapters in this video", 400)
+        chapter = chapters[scope["chapter"]]
+        transcript_text = range_text(video_id, transcript, chapter["start"], chapter["end"], compression)
+        if not transcript_text.strip():
+            raise TranscriptProcessingError("This chapter has no transcript.", 404)
+        return video_id, transcript_text, dict(chapter)
+
+    start = scope["start"]
+    end = transcript.end if scope["end"] is None else min(scope["end"], transcript.end)
+    covered = [chapter for chapter in chapters if chapter["start"] < end and chapter["end"] > start]
+    range_info = {"start": start, "end": end, "chapters": [chapter["index"] for chapter in covered]}
+    if len(covered) <= 1:
+        transcript_text = range_text(video_id, transcript, start, end, compression)
+        if not transcript_text.strip():
+            raise TranscriptProcessingError("The video has no transcript in this time range.", 404)
+        return video_id, transcript_text, range_info
+
+    action = "explanation" if is_detailed_explanation else "summary"
+    parts = []
+    for chapter in covered:
+        part_start, part_end = max(start, chapter["start"]), min(end, chapter["end"])
+        whole = part_start == chapter["start"] and part_end == chapter["end"]
+        text = range_text(video_id, transcript, part_start, part_end, compression)
+        if text.strip():
+            # Short leftover edges are cheaper to pass through than to summarize
+            summarize = whole or part_end - part_start >= RANGE_MIN_SUMMARY_SECONDS
+            parts.append((chapter["title"], part_start, part_end, text, summarize))
+
+    total = sum(1 for part in parts if part[4])
+    completed = [0]
+    completed_lock = threading.Lock()
+
+    def summarize_part(part_start, part_end, text):
+        content = generate_transcript_result(
+            video_id, text, is_detailed_explanation, scope=(part_start, part_end))
+        if progress:
+            with completed_lock:
+                completed[0] += 1
+                done = completed[0]
+            progress("summarizing_chapters", {"completed_chapters": done, "total_chapters": total})
+        return content
+
+    futures = {index: chapter_summary_executor.submit(summarize_part, part_start, part_end, text)
+               for index, (_, part_start, part_end, text, summarize) in enumerate(parts) if summarize}
+    sections = []
+    for index, (title, part_start, part_end, text, _) in enumerate(parts):
+        label = f"[{title} ({format_timestamp(part_start)}-{format_timestamp(part_end)})]"
+        if index not in futures:
+            sections.append(f"{label} (transcript)\n{text}")
+            continue
+        content = futures[index].result()
+        if not content:
+            raise TranscriptProcessingError(
+                f"Failed to get {action} of {format_timestamp(part_start)}-{format_timestamp(part_end)} "
+                f"using all available methods.", 500)
+        sections.append(f"{label}\n{content}")
+
+    print(f"Combining {len(sections)} parts ({len(futures)} {action} results) for "
+          f"{format_timestamp(start)}-{format_timestamp(end)} of video ID: {video_id}")
+    return video_id, RANGE_NOTES_HEADER + "\n\n".join(sections), range_info
+
+# --- Streaming Helpers ---
+
+
+def sse_event(data):
+    """Formats a dict as a Server-Sent Events data line."""
+    return f"data: {json.dumps(data)}\n\n"
+
+
+def sse_response(events):
+    return Response(
+        events,
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+
+def stream_transcript_processing(video_id, transcript_text, is_detailed_explanation, cache_key, cached_content=None, scope=None):
+    """
+    Streams a summary or explanation as Server-Sent Events: {"chunk": ...} events
+    while tokens are generated, then a {"done": true, ...} event carrying the
+    model, token counts and durations, or an {"error": ...} event on failure.
+    Concurrent streams for the same video, mode, model and scope share one generation.
+    """
+    action = "explanation" if is_detailed_explanation else "summary"
+    model_name = cache_key[2]
+
+    def produce(publish):
+        """Runs one streaming generation, publishing its events; returns the content."""
+        started = time.perf_counter()
+
+        # A smaller model picked under load may have a cached result of its own
+        route = route_transcript(transcript_text, is_detailed_explanation)
+        routed_key = get_result_cache_key(transcript_text, is_detailed_explanation, route["model"])
+        if routed_key != cache_key:
+            content = result_cache.get(*routed_key)
+            if content is not None:
+                index_result(video_id, action, content, scope)
+                publish({"chunk": content})
+                publish({"done": True, "action": action, "model": route["model"],
+                         "cached": True, "route": route["reason"]})
+                return content
+
+        # Long transcripts are condensed here, after the response headers are sent
+        _, prompt = build_local_llm_prompt(
+            transcript_text, is_detailed_explanation, model_name=route["model"])
+
+        parts = []
+        metadata = None
+        first_token_seconds = None
+        if prompt is not None:
+            try:
+                for event in stream_with_ollama(route["model"], prompt, task=action):
+                    if "chunk" in event:
+                        if first_token_seconds is None:
+                            first_token_seconds = round(
+                                time.perf_counter() - started, 3)
+                        parts.append(event["chunk"])
+                        publish(event)
+                    else:
+                        metadata = event
+            except requests.exceptions.RequestException as e:
+                print(f"Ollama API streaming request failed: {e}")
+
+        content = "".join(parts).strip()
+        if metadata is not None and content:
+            result_cache.put(*routed_key, content)
+            index_result(video_id, action, content, scope)
+            publish({
+                "done": True,
+                "action": action,
+                "cached": False,
+                "route": route["reason"],
+                "first_token_seconds": first_token_seconds,
+                "total_seconds": round(time.perf_counter() - started, 3),
+                **metadata
+            })
+            return content
+
+        # Fallback to API LLM only if nothing has been sent yet
+        if not parts:
+            print(
+                f"Local LLM streaming failed, trying API LLM for {action}.")
+            content = summarize_with_api_llm(
+                transcript_text, is_detailed_explanation)
+            if content:
+                index_result(video_id, action, content, scope)
+                publish({"chunk": content})
+                publish({"done": True, "action": action,
+                        "model": "api", "cached": False})
+                return content
+
+        publish(
+            {"error": f"Failed to get {action} using all available methods."})
+        return None
+
+    def generate_events():
+        if cached_content is not None:
+            index_result(video_id, action, cached_content, scope)
+            yield sse_event({"chunk": cached_content})
+            yield sse_event({"done": True, "action": action, "model": model_name, "cached": True})
+            return
+
+        flight, is_leader = generation_flights.stream(
+            (video_id, action, model_name, scope, cache_key[0]), produce)
+        if not is_leader:
+            print(f"Joined in-flight {action} for video ID: {video_id}")
+
+        if flight.streaming:
+            for event in flight.subscribe():
+                if event.get("done"):
+                    event = {**event, "coalesced": not is_leader}
+                yield sse_event(event)
+            if flight.error is not None:
+                yield sse_event({"error": f"An unexpected error occurred: {str(flight.error)}"})
+            return
+
+        # A non-streaming request for the same video is already generating; replay its result
+        try:
+            content = flight.wait()
+        except Exception as e:
+            print(f"Shared in-flight {action} failed: {e}")
+            content = None
+
+        if content:
+            yield sse_event({"chunk": content})
+            yield sse_event({"done": True, "action": action, "model": model_name, "cached": False, "coalesced": True})
+        else:
+            yield sse_event({"error": f"Failed to get {action} using all available methods."})
+
+    return sse_response(generate_events())
+
 # --- API Endpoints ---
 
 
@@ -153,29 +1206,163 @@ def summarize_with_api_llm(transcript_text, is_detailed_explanation=False):
 def chat_with_model_endpoint():
     data = request.get_json()
     user_message = data.get('message')
+    session_id = data.get('session_id')
 
-    if not user_message:
-        return jsonify({"error": "Message is required"}), 400
+    try:
+        images = resolve_chat_images(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except ImageUploadNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+
+    if not user_message and not images:
+        return jsonify({"error": "Message or images are required"}), 400
 
     print(f"Received chat message: {user_message}", flush=True)
+    if images:
+        print(f"Received {len(images)} images", flush=True)
 
-    # Use the local LLM for chat for now
-    # You might want a different prompt or model configuration for general chat
-    ollama_api_url = "http://localhost:11434/api/generate"
-    model_name = "llama3.1:8b"  # Upgraded chat model for better quality
+    if data.get('youtube_url'):
+        return video_chat_response(data, user_message, images)
 
-    # More conversational prompt for chat
-    prompt = f"User: {user_message}\nAI:"
+    if images and data.get('stream'):
+        session = None
+        if session_id:
+            try:
+                session = chat_sessions.get(session_id)
+            except ChatSessionNotFoundError as e:
+                return jsonify({"error": str(e)}), 404
+        return stream_image_chat(user_message, images, session=session,
+                                 conversation_history=data.get('conversation_history', []))
+
+    if not session_id:
+        # Stateless clients may still send the whole conversation
+        conversation_history = data.get('conversation_history', [])
+        if images:
+            reply, error, status = handle_image_chat(
+                user_message, images, conversation_history=conversation_history)
+        else:
+            reply, error, status, _ = request_chat_reply(
+                build_conversation_prompt(conversation_history, user_message))
+        if reply is None:
+            return jsonify({"error": error}), status
+        return jsonify({"reply": reply})
 
-    payload = {
-        "model": model_name,
-        "prompt": prompt,
-        "stream": False
-    }
+    try:
+        session = chat_sessions.get(session_id)
+    except ChatSessionNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+
+    with session.lock:
+        if images:
+            reply, error, status = handle_image_chat(
+                user_message, images, session=session)
+        elif session_has_images(session):
+            reply, error, status = answer_image_followup(session, user_message)
+        else:
+            reply, error, status = continue_chat_session(session, user_message)
+
+    if reply is None:
+        return jsonify({"error": error}), status
+    return jsonify({"reply": reply, "session_id": session.id})
+
+
+def resolve_chat_images(data):
+    """
+    Returns a chat message's images: the base64 data URLs in `images`, then
+    the uploads referenced by `image_ids`. Raises ValueError unless both are
+    lists of strings, and ImageUploadNotFoundError for an unknown ID.
+    """
+    images = data.get('images') or []
+    image_ids = data.get('image_ids') or []
+    for field, values in (("images", images), ("image_ids", image_ids)):
+        if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+            raise ValueError(f"{field} must be a list of strings")
+    # Images uploaded to /api/images are referenced by ID
+    return images + [image_uploads.get(image_id) for image_id in image_ids]
+
+
+def video_chat_response(data, user_message, images):
+    """Handles a /api/chat request scoped to the video in `youtube_url`."""
+    if images or not user_message:
+        return jsonify({"error": "Video chat takes a text message without images"}), 400
+
+    session = None
+    if data.get('session_id'):
+        try:
+            session = chat_sessions.get(data['session_id'])
+        except ChatSessionNotFoundError as e:
+            return jsonify({"error": str(e)}), 404
+
+    try:
+        if session is not None:
+            with session.lock:
+                reply, sources, error, status = answer_video_question(
+                    data['youtube_url'], user_message, session=session)
+        else:
+            reply, sources, error, status = answer_video_question(
+                data['youtube_url'], user_message,
+                conversation_history=data.get('conversation_history', []))
+    except TranscriptProcessingError as e:
+        return jsonify({"error": e.message}), e.status_code
+
+    if reply is None:
+        return jsonify({"error": error}), status
+    body = {"reply": reply, "sources": sources}
+    if session is not None:
+        body["session_id"] = session.id
+    return jsonify(body)
+
+
+def continue_chat_session(session, user_message, system_prompt=CHAT_SYSTEM_PROMPT):
+    """Generates and records the next reply in a session; returns (reply, error_message, status_code)."""
+    reply, error, status, response_data, context_reused = generate_session_reply(
+        session, user_message, system_prompt)
+    if reply is not None:
+        record_chat_turn(session, user_message, reply,
+                         response_data, context_reused, system_prompt)
+    return reply, error, status
+
+
+def generate_session_reply(session, user_message, system_prompt=CHAT_SYSTEM_PROMPT):
+    """
+    Generates the next reply in a session without recording it.
+    Returns (reply, error_message, status_code, response_data, context_reused).
+    When the session has a usable Ollama context only the new message is sent,
+    so prior turns are not evaluated again. If that fails, or there is no
+    context, the full prompt is rebuilt from the session history.
+    """
+    context = reusable_chat_context(session, user_message, system_prompt)
+    if context is not None:
+        reply, error, status, response_data = request_chat_reply(
+            build_chat_turn(user_message), context=context)
+        if reply is not None:
+            return reply, None, status, response_data, True
+        if status in (503, 504):
+            # Ollama is unreachable or busy; a full-prompt retry would fail the same way
+            return None, error, status, None, True
+        print(
+            f"Chat session {session.id} context reuse failed; rebuilding prompt from history", flush=True)
+        chat_sessions.record_context_fallback()
+
+    reply, error, status, response_data = request_chat_reply(
+        build_session_prompt(session, user_message, system_prompt=system_prompt))
+    return reply, error, status, response_data, False
+
+
+def request_chat_reply(prompt, context=None):
+    """
+    Sends a chat prompt to the chat model, continuing from `context` if given.
+    Returns (reply, error_message, status_code, response_data).
+    """
+    payload = build_chat_payload(prompt, context)
+    model_name = payload["model"]
+    model_residency.ensure_warm(model_name, MODEL_WARMUP_WAIT_SECONDS)
 
     try:
         # Shorter timeout for chat?
-        response = requests.post(ollama_api_url, json=payload, timeout=180)
+        with model_router.track(model_name):
+            response = ollama_client.post("/api/generate", payload, deadline=180)
         print(
             f"Ollama API response status code for chat: {response.status_code}", flush=True)
         response_text_preview = response.text[:500] if response.text else ""
@@ -187,34 +1374,463 @@ def chat_with_model_endpoint():
         if not response.text or not response.text.strip():
             print(
                 "Ollama API response for chat was empty. Returning generic error.", flush=True)
-            return jsonify({"error": "AI model returned an empty response."}), 500
+            return None, "AI model returned an empty response.", 500, None
 
         response_data = response.json()
+        model_router.observe(model_name, response_data, "chat")
         ai_reply = response_data.get("response")
 
         if ai_reply:
             print(
                 f"Successfully got chat reply from {model_name}.", flush=True)
-            return jsonify({"reply": ai_reply.strip()})
+            return ai_reply.strip(), None, 200, response_data
         else:
             print(
                 f"Ollama API chat response did not contain content. Response: {response_data}", flush=True)
-            return jsonify({"error": "AI model did not provide a reply."}), 500
+            return None, "AI model did not provide a reply.", 500, response_data
 
     except requests.exceptions.Timeout:
         print("Ollama API chat request timed out.", flush=True)
-        return jsonify({"error": "Request to AI model timed out."}), 504
+        return None, "Request to AI model timed out.", 504, None
     except requests.exceptions.ConnectionError:
         print(
-            f"Ollama API chat connection error. Is Ollama running at {ollama_api_url}?", flush=True)
-        return jsonify({"error": "Could not connect to the AI model."}), 503
+            f"Ollama API chat connection error. Is Ollama running at {ollama_client.base_url}?", flush=True)
+        return None, "Could not connect to the AI model.", 503, None
     except requests.exceptions.RequestException as e:
         print(f"Ollama API chat request failed: {e}", flush=True)
-        return jsonify({"error": "Failed to communicate with the AI model."}), 502
+        return None, "Failed to communicate with the AI model.", 502, None
     except Exception as e:
         print(
             f"An unexpected error occurred during chat processing: {e}", flush=True)
-        return jsonify({"error": "An unexpected error occurred while chatting with the AI."}), 500
+        return None, "An unexpected error occurred while chatting with the AI.", 500, None
+
+
+def prepare_image(image_data, model_name):
+    """Downscales and re-encodes an image for `model_name`; returns (mime_type, base64_data)."""
+    return image_preprocessor.process(image_data, model_name)
+
+
+def to_data_url(mime_type, data):
+    return f"data:{mime_type or 'image/jpeg'};base64,{data}"
+
+
+def handle_image_chat(user_message, images, session=None, conversation_history=None, publish=None):
+    """
+    Answers a message with images using the first installed vision model, or
+    OpenAI when none is installed or it fails. A single image is sent to the
+    vision model with the question; several images are described concurrently
+    and the text model answers over the descriptions. The turn is added to
+    `session` if given. With `publish`, progress and reply tokens are passed
+    to it as events while the reply is generated.
+    Returns (reply, error_message, status_code).
+    """
+    try:
+        return answer_image_chat(user_message, images, session, conversation_history, publish)
+    except ImageRejectedError as e:
+        print(f"Rejected chat image: {e}", flush=True)
+        return None, str(e), 400
+
+
+def answer_image_chat(user_message, images, session=None, conversation_history=None, publish=None):
+    """handle_image_chat without the 400 for rejected images; raises ImageRejectedError."""
+    images = images[:MAX_CHAT_IMAGES]
+    question = user_message or (
+        DEFAULT_IMAGE_QUESTION if len(images) == 1 else DEFAULT_IMAGES_QUESTION)
+    reply = None
+
+    model_name = model_registry.pick(VISION_MODELS)
+    if session is not None and model_name and attach_described_images(session, images, model_name):
+        # Every image was analyzed before; the text model can answer from the descriptions
+        return answer_image_followup(session, question, publish)
+
+    if model_name:
+        print(f"Using vision model: {model_name}", flush=True)
+        if len(images) == 1:
+            prompt = build_image_chat_prompt(
+                question, model_name, VISION_SYSTEM_PROMPT, session, conversation_history)
+            # Ollama expects bare base64 without the data URL prefix
+            prepared = prepare_image(images[0], model_name)
+            reply = generate_image_reply(
+                model_name, prompt, [prepared[1]], publish)
+            if reply and session is not None:
+                remember_session_image(session, images[0], prepared, model_name)
+        else:
+            reply = answer_over_image_descriptions(
+                question, images, model_name, session, conversation_history, publish)
+        if reply:
+            print(f"Successfully got vision reply from {model_name}.", flush=True)
+    else:
+        print(
+            f"None of the vision models {', '.join(VISION_MODELS)} is installed in Ollama.", flush=True)
+
+    if not reply and openai_client.configured:
+        print("Trying OpenAI for the image...", flush=True)
+        reply = describe_images_with_openai(question, images)
+        if reply and publish:
+            publish({"chunk": reply})
+
+    if not reply:
+        return None, "No vision model was able to analyze the image.", 503
+    if session is not None:
+        session.add_turn(question, reply)
+    return reply, None, 200
+
+
+def build_image_chat_prompt(question, model_name, system_prompt, session=None, conversation_history=None):
+    if session is not None:
+        return build_session_prompt(session, question, model_name, system_prompt)
+    return build_conversation_prompt(
+        conversation_history or [], question, model_name, system_prompt)
+
+
+def generate_image_reply(model_name, prompt, images=None, publish=None):
+    """Generates a reply, streaming tokens to `publish` if given; returns the reply or None."""
+    if publish is None:
+        return generate_with_ollama(model_name, prompt, images=images)
+
+    parts = []
+    try:
+        for event in stream_with_ollama(model_name, prompt, images=images):
+            if "chunk" in event:
+                parts.append(event["chunk"])
+                publish(event)
+    except requests.exceptions.RequestException as e:
+        print(f"Ollama API streaming request failed: {e}", flush=True)
+        if parts:
+            # Tokens were already sent; a fallback answer would be appended to them
+            raise
+    return "".join(parts).strip() or None
+
+
+def describe_image(image_data, model_name):
+    """
+    Returns (description, cached) for one image. Descriptions are kept in the
+    result cache by image hash, model and prompt, so a repeated image is not
+    sent to the vision model again. The description is None on failure.
+    """
+    cache_key = (image_hash(image_data), "image_description",
+                 model_name, IMAGE_DESCRIPTION_PROMPT_HASH)
+    description = result_cache.get(*cache_key)
+    if description is not None:
+        return description, True
+
+    _, image_base64 = prepare_image(image_data, model_name)
+    with vision_limiter.slot(model_name):
+        description = generate_with_ollama(
+            model_name, IMAGE_DESCRIPTION_PROMPT, images=[image_base64])
+    if description:
+        result_cache.put(*cache_key, description)
+    return description, False
+
+
+def describe_images(images, model_name, publish=None):
+    """Describes images concurrently; returns their descriptions in order, None for failures."""
+    futures = {image_description_executor.submit(describe_image, image_data, model_name): index
+               for index, image_data in enumerate(images)}
+    descriptions = [None] * len(images)
+    for future in as_completed(futures):
+        index = futures[future]
+        try:
+            descriptions[index], cached = future.result()
+        except ImageRejectedError:
+            raise
+        except Exception as e:
+            print(f"Describing image {index + 1} failed: {e}", flush=True)
+            cached = False
+        if publish:
+            publish({"image": index, "described": descriptions[index] is not None,
+                     "cached": cached, "total": len(images)})
+    return descriptions
+
+
+def answer_over_image_descriptions(question, images, model_name, session=None, conversation_history=None, publish=None):
+    """Describes each image with the vision model, then answers `question` over them with the text model."""
+    started = time.perf_counter()
+    descriptions = describe_images(images, model_name, publish)
+    described = sum(1 for description in descriptions if description)
+    print(f"Described {described} of {len(images)} images with {model_name} in "
+          f"{time.perf_counter() - started:.2f}s", flush=True)
+    if not described:
+        return None
+    if session is not None:
+        for image_data, description in zip(images, descriptions):
+            session.attach_image(image_hash(image_data), prepare_image(image_data, model_name),
+                                 model_name, description)
+
+    message = MULTI_IMAGE_MESSAGE_TEMPLATE.format(
+        count=len(images),
+        descriptions="\n\n".join(
+            f"Image {index}: {description or '(could not be analyzed)'}"
+            for index, description in enumerate(descriptions, 1)),
+        question=question)
+    text_model = chat_model()
+    prompt = build_image_chat_prompt(
+        message, text_model, MULTI_IMAGE_SYSTEM_PROMPT, session, conversation_history)
+    return generate_image_reply(text_model, prompt, publish=publish)
+
+
+def remember_session_image(session, image_data, prepared, model_name):
+    """
+    Attaches an image answered directly by the vision model to the session and
+    describes it in the background, so later questions can use the text model.
+    """
+    key = image_hash(image_data)
+    session.attach_image(key, prepared, model_name)
+
+    def store_description(future):
+        try:
+            description, _ = future.result()
+        except Exception as e:
+            print(f"Describing session image failed: {e}", flush=True)
+            return
+        if description:
+            session.describe_image(key, description)
+
+    image_description_executor.submit(
+        describe_image, image_data, model_name).add_done_callback(store_description)
+
+
+def attach_described_images(session, images, model_name):
+    """
+    Attaches images whose descriptions are already known, from the session or
+    the result cache, to the session. Returns False if any image still needs
+    the vision model.
+    """
+    known = dict(session.images_snapshot())
+    found = []
+    for image_data in images:
+        key = image_hash(image_data)
+        description = (known.get(key) or {}).get("description") or result_cache.get(
+            key, "image_description", model_name, IMAGE_DESCRIPTION_PROMPT_HASH)
+        if not description:
+            return False
+        found.append((key, image_data, description))
+
+    for key, image_data, description in found:
+        session.attach_image(key, prepare_image(image_data, model_name), model_name, description)
+    return True
+
+
+def session_has_images(session):
+    return bool(session.images)
+
+
+def answer_image_followup(session, user_message, publish=None):
+    """
+    Answers a question about the session's images with the text model, using
+    their stored descriptions. Escalates to the vision model with the most
+    recent image when the text model reports that the descriptions are not
+    enough, or when no image has been described yet.
+    Returns (reply, error_message, status_code).
+    """
+    attached = session.images_snapshot()
+    descriptions = [(index, entry["description"])
+                    for index, (_, entry) in enumerate(attached, 1) if entry["description"]]
+
+    if descriptions:
+        system_prompt = IMAGE_FOLLOWUP_SYSTEM_PROMPT.format(descriptions="\n\n".join(
+            f"Image {index}: {description}" for index, description in descriptions))
+        reply, error, status, response_data, context_reused = generate_session_reply(
+            session, user_message, system_prompt)
+        if reply is not None and NEEDS_IMAGE_MARKER not in reply:
+            record_chat_turn(session, user_message, reply, response_data, context_reused, system_prompt)
+            chat_sessions.record_image_followup(escalated=False)
+            if publish:
+                publish({"chunk": reply})
+            return reply, None, status
+        if reply is None and status in (503, 504):
+            return None, error, status
+        print(f"Chat session {session.id} needs the vision model for: {user_message}", flush=True)
+
+    chat_sessions.record_image_followup(escalated=True)
+    mime_type, image_base64 = attached[-1][1]["image"]
+    model_name = model_registry.pick(VISION_MODELS)
+    if model_name:
+        prompt = build_session_prompt(
+            session, user_message, model_name, VISION_SYSTEM_PROMPT)
+        # The stored image was prepared for the model that first saw it, which is close enough
+        reply = generate_image_reply(model_name, prompt, [image_base64], publish)
+    else:
+        reply = None
+    if not reply and openai_client.configured:
+        reply = describe_images_with_openai(
+            user_message, [to_data_url(mime_type, image_base64)])
+        if reply and publish:
+            publish({"chunk": reply})
+
+    if not reply:
+        return None, "No vision model was able to analyze the image.", 503
+    session.add_turn(user_message, reply)
+    return reply, None, 200
+
+
+def stream_image_chat(user_message, images, session=None, conversation_history=None):
+    """
+    Streams an image chat as Server-Sent Events: {"image": ...} progress events
+    while several images are described, {"chunk": ...} events for the reply,
+    then a {"done": true, ...} event, or an {"error": ...} event on failure.
+    """
+    def generate_events():
+        events = queue.Queue()
+        outcome = []
+        started = time.perf_counter()
+
+        def run():
+            try:
+                if session is not None:
+                    with session.lock:
+                        outcome.append(handle_image_chat(
+                            user_message, images, session=session, publish=events.put))
+                else:
+                    outcome.append(handle_image_chat(
+                        user_message, images, conversation_history=conversation_history, publish=events.put))
+            except Exception as e:
+                print(f"Streaming image chat failed: {e}", flush=True)
+                outcome.append((None, "The reply was interrupted.", 500))
+            events.put(None)
+
+        threading.Thread(target=run, name="image-chat", daemon=True).start()
+        for event in iter(events.get, None):
+            yield sse_event(event)
+
+        reply, error, _ = outcome[0]
+        if reply is None:
+            yield sse_event({"error": error})
+            return
+        done = {"done": True, "images": min(len(images), MAX_CHAT_IMAGES),
+                "total_seconds": round(time.perf_counter() - started, 3)}
+        if session is not None:
+            done["session_id"] = session.id
+        yield sse_event(done)
+
+    return sse_response(generate_events())
+
+
+def describe_images_with_openai(question, images):
+    """Answers a question about images with the OpenAI vision model; returns the reply or None."""
+    content = [{"type": "text", "text": question}]
+    for image_data in images[:4]:
+        mime_type, image_base64 = prepare_image(image_data, OPENAI_VISION_MODEL)
+        content.append({
+            "type": "image_url",
+            "image_url": {"url": to_data_url(mime_type, image_base64), "detail": "high"}
+        })
+
+    try:
+        reply = openai_client.chat(
+            OPENAI_VISION_MODEL,
+            [
+                {"role": "system", "content": VISION_SYSTEM_PROMPT.strip()},
+                {"role": "user", "content": content}
+            ],
+            max_tokens=1000)
+    except Exception as e:
+        print(f"OpenAI vision request failed: {e}", flush=True)
+        return None
+    return reply.strip() if reply else None
+
+
+# --- Video Chat ---
+
+
+def answer_video_question(youtube_url, question, session=None, conversation_history=None):
+    """
+    Answers a question about a video from the transcript chunks most relevant
+    to it, so the prompt does not grow with the length of the video.
+    Returns (reply, sources, error_message, status_code); raises
+    TranscriptProcessingError if the transcript cannot be loaded.
+    """
+    video_id, transcript = load_transcript(youtube_url)
+    index = video_indexes.get(video_id, "en", transcript)
+    results = video_indexes.search(index, question, VIDEO_CHAT_TOP_K)
+    if not results:
+        return None, [], "The transcript of this video is empty.", 500
+
+    message = VIDEO_QUESTION_TEMPLATE.format(
+        excerpts="\n\n".join(f"[{format_timestamp(chunk['start'])}] {chunk['text']}"
+                              for chunk, _ in results),
+        question=question)
+    sources = [{
+        "start": round(chunk["start"], 1),
+        "end": round(chunk["end"], 1),
+        "timestamp": format_timestamp(chunk["start"]),
+        "url": f"https://www.youtube.com/watch?v={video_id}&t={int(chunk['start'])}s",
+        "score": round(score, 4),
+    } for chunk, score in results]
+
+    if session is not None:
+        reply, error, status, response_data, context_reused = generate_session_reply(
+            session, message, VIDEO_CHAT_SYSTEM_PROMPT)
+        if reply is not None:
+            # Only the question is kept in the history; the excerpts are fetched again for each turn
+            record_chat_turn(session, question, reply, response_data,
+                             context_reused, VIDEO_CHAT_SYSTEM_PROMPT)
+    else:
+        reply, error, status, _ = request_chat_reply(build_conversation_prompt(
+            conversation_history or [], message, system_prompt=VIDEO_CHAT_SYSTEM_PROMPT))
+    return reply, sources, error, status
+
+
+@app.route('/api/images', methods=['POST'])
+def upload_images_endpoint():
+    """
+    Stores images for later chat messages. Accepts a raw image body
+    (Content-Type image/*) or a multipart form with one or more `images` files;
+    returns 201 with their IDs.
+    """
+    if request.content_length is not None and request.content_length > IMAGE_UPLOAD_MAX_REQUEST_BYTES:
+        return jsonify({"error": f"Uploads may be at most {IMAGE_UPLOAD_MAX_REQUEST_BYTES} bytes"}), 413
+
+    try:
+        if request.mimetype == 'multipart/form-data':
+            files = request.files.getlist('images')
+            if not files:
+                return jsonify({"error": "No images were uploaded"}), 400
+            if len(files) > MAX_CHAT_IMAGES:
+                return jsonify({"error": f"At most {MAX_CHAT_IMAGES} images may be uploaded at once"}), 400
+            uploads = [image_uploads.add(file.stream, file.mimetype) for file in files]
+        else:
+            # The body is copied from the request stream, never parsed into memory as a whole
+            uploads = [image_uploads.add(request.stream, request.mimetype)]
+    except ImageUploadError as e:
+        return jsonify({"error": e.message}), e.status_code
+    except RequestEntityTooLarge:
+        return jsonify({"error": f"Uploads may be at most {IMAGE_UPLOAD_MAX_REQUEST_BYTES} bytes"}), 413
+
+    print(f"Stored {len(uploads)} uploaded images ({sum(upload.size for upload in uploads)} bytes)", flush=True)
+    return jsonify({"images": [upload.to_dict() for upload in uploads]}), 201
+
+
+@app.route('/api/images/<image_id>', methods=['DELETE'])
+def delete_image_endpoint(image_id):
+    if not image_uploads.delete(image_id):
+        return jsonify({"error": f"Image {image_id} not found or expired."}), 404
+    return jsonify({"deleted": True})
+
+
+@app.route('/api/chat/sessions', methods=['POST'])
+def create_chat_session_endpoint():
+    data = request.get_json(silent=True) or {}
+    # An existing client-side conversation can be uploaded once to seed the session
+    session = chat_sessions.create(data.get('conversation_history'))
+    print(
+        f"Created chat session {session.id} with {len(session.messages)} messages", flush=True)
+    return jsonify(session.to_dict()), 201
+
+
+@app.route('/api/chat/sessions/<session_id>', methods=['GET'])
+def get_chat_session_endpoint(session_id):
+    try:
+        return jsonify(chat_sessions.get(session_id).to_dict())
+    except ChatSessionNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+
+
+@app.route('/api/chat/sessions/<session_id>', methods=['DELETE'])
+def delete_chat_session_endpoint(session_id):
+    if not chat_sessions.delete(session_id):
+        return jsonify({"error": f"Chat session {session_id} not found or expired."}), 404
+    return jsonify({"deleted": True})
 
 
 @app.route('/api/summarize', methods=['POST'])
@@ -227,78 +1843,332 @@ def explain_video_endpoint():
     return handle_transcript_processing(request, is_detailed_explanation=True)
 
 
-def handle_transcript_processing(current_request, is_detailed_explanation):
-    data = current_request.get_json()
-    youtube_url = data.get('youtube_url')
-
+def list_chapters(youtube_url):
+    """Returns ({"video_id", "chapters"}, status_code) for the chapters of a video."""
     if not youtube_url:
-        return jsonify({"error": "YouTube URL is required"}), 400
-
+        return {"error": "YouTube URL is required"}, 400
     try:
-        video_id = None
-        if "v=" in youtube_url:
-            video_id = youtube_url.split("v=")[1].split("&")[0]
-        elif "youtu.be/" in youtube_url:
-            video_id = youtube_url.split("youtu.be/")[1].split("?")[0]
+        video_id, transcript = load_transcript(youtube_url)
+    except TranscriptProcessingError as e:
+        return {"error": e.message}, e.status_code
+    return {"video_id": video_id, "chapters": chapter_resolver.get(video_id, transcript.end)}, 200
 
-        if not video_id:
-            return jsonify({"error": "Invalid YouTube URL format"}), 400
 
-        print(f"Fetching transcript for video ID: {video_id}")
+@app.route('/api/chapters', methods=['GET'])
+def chapters_endpoint():
+    body, status = list_chapters(request.args.get('youtube_url'))
+    return jsonify(body), status
 
-        # Try to get transcript with better error handling
-        try:
-            transcript_list = YouTubeTranscriptApi.get_transcript(video_id)
-        except Exception as transcript_error:
-            print(f"Transcript fetch error: {transcript_error}")
-            # Try alternative language codes if English fails
-            try:
-                transcript_list = YouTubeTranscriptApi.get_transcript(
-                    video_id, languages=['en-US', 'en-GB', 'en'])
-            except Exception as lang_error:
-                print(
-                    f"Alternative language transcript fetch error: {lang_error}")
-                raise transcript_error  # Re-raise the original error
 
-        transcript_text = " ".join([item['text'] for item in transcript_list])
+def handle_transcript_processing(current_request, is_detailed_explanation):
+    data = current_request.get_json()
+    youtube_url = data.get('youtube_url')
+    stream = data.get('stream', False)  # Opt-in Server-Sent Events
 
-        if not transcript_text.strip():
-            return jsonify({"error": "Fetched transcript is empty."}), 500
+    if not youtube_url:
+        return jsonify({"error": "YouTube URL is required"}), 400
 
+    try:
+        # An optional chapter or start/end time limits the result to part of the video
+        video_id, transcript_text, range_info = load_scoped_text(
+            youtube_url, parse_transcript_scope(data), is_detailed_explanation,
+            compression=parse_compression(data))
+        scope = result_scope(range_info)
         action = "explanation" if is_detailed_explanation else "summary"
-        print(
-            f"Transcript fetched successfully for {action}. Length: {len(transcript_text)} chars.")
-
-        # Try local LLM first
-        content = summarize_with_local_llm(
-            transcript_text, is_detailed_explanation)
 
-        # Fallback to API LLM if local LLM fails or is not implemented
-        if content is None:
-            print(
-                f"Local LLM failed or not implemented, trying API LLM for {action}.")
-            content = summarize_with_api_llm(
+        if stream:
+            cache_key = get_result_cache_key(
                 transcript_text, is_detailed_explanation)
+            content = result_cache.get(*cache_key)
+            if content is not None:
+                print(
+                    f"Result cache hit for {action} of video ID: {video_id}")
+            return stream_transcript_processing(
+                video_id, transcript_text, is_detailed_explanation, cache_key, cached_content=content, scope=scope)
+
+        content = generate_transcript_result(
+            video_id, transcript_text, is_detailed_explanation, scope=scope)
 
         if content:
+            if range_info is not None:
+                return jsonify({action: content, "range": range_info})
             return jsonify({action: content})
         else:
             return jsonify({"error": f"Failed to get {action} using all available methods."}), 500
 
-    except NoTranscriptFound:
-        return jsonify({"error": "No transcript found for this video. It might be disabled or not available in English."}), 404
-    except TranscriptsDisabled:
-        return jsonify({"error": "Transcripts are disabled for this video."}), 403
-    except VideoUnavailable:
-        return jsonify({"error": "This video is unavailable or private."}), 404
-    except ET.ParseError as xml_error:
-        print(f"XML parsing error: {xml_error}")
-        return jsonify({"error": "Failed to parse transcript data. The video transcript format may be corrupted."}), 500
+    except TranscriptProcessingError as e:
+        return jsonify({"error": e.message}), e.status_code
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
         print(f"Error type: {type(e).__name__}")
         return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
 
+
+# --- Job Endpoints ---
+
+
+def run_transcript_job(job, report_progress):
+    """Job worker for summarize/explain jobs; returns the same body as the sync endpoints."""
+    is_detailed_explanation = job.type == "explain"
+    action = "explanation" if is_detailed_explanation else "summary"
+
+    report_progress("fetching_transcript")
+    video_id, transcript_text, range_info = load_scoped_text(
+        job.params["youtube_url"], job.params.get("scope"), is_detailed_explanation, progress=report_progress,
+        compression=job.params.get("compression"))
+
+    report_progress("generating", {"transcript_chars": len(transcript_text)})
+    content = generate_transcript_result(
+        video_id, transcript_text, is_detailed_explanation, progress=report_progress,
+        scope=result_scope(range_info))
+
+    if not content:
+        raise TranscriptProcessingError(
+            f"Failed to get {action} using all available methods.", 500)
+    if range_info is not None:
+        return {action: content, "range": range_info}
+    return {action: content}
+
+
+def run_chat_job(job, report_progress):
+    """Job worker for chat jobs; returns the same body as /api/chat."""
+    prompt = build_chat_prompt(job.params["message"])
+    model_name = route_model("chat", estimate_tokens(prompt))["model"]
+    report_progress("generating", {"model": model_name})
+    reply = generate_with_ollama(model_name, prompt, timeout=180, task="chat")
+
+    if not reply:
+        raise Exception("AI model did not provide a reply.")
+    return {"reply": reply}
+
+
+JOB_TYPES = {
+    "summarize": (run_transcript_job, "youtube_url"),
+    "explain": (run_transcript_job, "youtube_url"),
+    "chat": (run_chat_job, "message"),
+}
+
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job_endpoint():
+    data = request.get_json()
+    job_type = data.get('type')
+
+    if job_type not in JOB_TYPES:
+        return jsonify({"error": f"Job type must be one of: {', '.join(JOB_TYPES)}"}), 400
+
+    work, required_field = JOB_TYPES[job_type]
+    value = data.get(required_field)
+    if not value:
+        return jsonify({"error": f"'{required_field}' is required for {job_type} jobs"}), 400
+
+    params = {required_field: value}
+    if work is run_transcript_job:
+        try:
+            params["scope"] = parse_transcript_scope(data)
+            params["compression"] = parse_compression(data)
+        except TranscriptProcessingError as e:
+            return jsonify({"error": e.message}), e.status_code
+
+    try:
+        job = job_manager.submit(job_type, work, params)
+    except JobQueueFullError as e:
+        return jsonify({"error": str(e)}), 503
+
+    print(f"Queued {job_type} job {job.id}", flush=True)
+    return jsonify({
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/api/jobs/{job.id}"
+    }), 202
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job_endpoint(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found or expired"}), 404
+    return jsonify(job)
+
+
+# --- Batch Endpoint ---
+
+
+def process_batch_video(index, youtube_url, is_detailed_explanation, compression=None):
+    """Fetches and summarizes one batch entry, returning its NDJSON result record."""
+    action = "explanation" if is_detailed_explanation else "summary"
+    record = {"index": index, "youtube_url": youtube_url}
+    started = time.perf_counter()
+
+    try:
+        video_id, transcript_text = load_transcript_text(youtube_url, compression)
+        record["video_id"] = video_id
+
+        # The slot is taken for the model the router picks, which may be a fallback under load
+        content = generate_transcript_result(
+            video_id, transcript_text, is_detailed_explanation, limiter=model_limiter)
+
+        if content:
+            record.update({"status": "ok", action: content})
+        else:
+            record.update({"status": "error", "status_code": 500,
+                           "error": f"Failed to get {action} using all available methods."})
+    except TranscriptProcessingError as e:
+        record.update({"status": "error", "status_code": e.status_code, "error": e.message})
+    except Exception as e:
+        print(f"Batch item {index} failed: {e}")
+        record.update({"status": "error", "status_code": 500,
+                       "error": f"An unexpected error occurred: {str(e)}"})
+
+    record["seconds"] = round(time.perf_counter() - started, 3)
+    return record
+
+
+@app.route('/api/batch', methods=['POST'])
+def batch_endpoint():
+    data = request.get_json()
+    mode = data.get('mode', 'summarize')
+    youtube_urls = data.get('youtube_urls') or []
+    playlist = data.get('playlist_id')
+
+    if mode not in ('summarize', 'explain'):
+        return jsonify({"error": "Mode must be 'summarize' or 'explain'"}), 400
+    if not isinstance(youtube_urls, list) or not all(isinstance(url, str) for url in youtube_urls):
+        return jsonify({"error": "youtube_urls must be a list of URL strings"}), 400
+    youtube_urls = list(youtube_urls)
+    try:
+        compression = parse_compression(data)
+    except TranscriptProcessingError as e:
+        return jsonify({"error": e.message}), e.status_code
+
+    if playlist:
+        try:
+            video_ids = resolve_playlist(playlist, max_videos=BATCH_MAX_VIDEOS)
+        except PlaylistResolutionError as e:
+            return jsonify({"error": str(e)}), 502
+        youtube_urls.extend(
+            f"https://www.youtube.com/watch?v={video_id}" for video_id in video_ids)
+
+    if not youtube_urls:
+        return jsonify({"error": "youtube_urls or playlist_id is required"}), 400
+    if len(youtube_urls) > BATCH_MAX_VIDEOS:
+        return jsonify({"error": f"A batch may contain at most {BATCH_MAX_VIDEOS} videos"}), 400
+
+    is_detailed_explanation = mode == 'explain'
+    print(f"Starting batch {mode} of {len(youtube_urls)} videos", flush=True)
+
+    def generate_lines():
+        started = time.perf_counter()
+        results = queue.Queue()
+        succeeded = 0
+
+        # Transcripts are fetched in parallel; generations are bounded per model by model_limiter
+        executor = ThreadPoolExecutor(
+            max_workers=BATCH_FETCH_WORKERS, thread_name_prefix="batch")
+        try:
+            for index, youtube_url in enumerate(youtube_urls):
+                future = executor.submit(
+                    process_batch_video, index, youtube_url, is_detailed_explanation, compression)
+                future.add_done_callback(
+                    lambda done_future: results.put(done_future.result()))
+
+            for _ in range(len(youtube_urls)):
+                record = results.get()
+                if record["status"] == "ok":
+                    succeeded += 1
+                yield json.dumps(record) + "\n"
+        finally:
+            # Drop videos that have not started if the client disconnects
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        yield json.dumps({
+            "done": True,
+            "total": len(youtube_urls),
+            "succeeded": succeeded,
+            "failed": len(youtube_urls) - succeeded,
+            "seconds": round(time.perf_counter() - started, 3)
+        }) + "\n"
+
+    return Response(generate_lines(), mimetype='application/x-ndjson',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+# --- Search Endpoint ---
+
+
+SEARCH_MAX_LIMIT = 100
+
+
+def run_search(args):
+    """
+    Searches every processed transcript, summary and explanation.
+    Query parameters: q (required), kind (repeatable: transcript, summary,
+    explanation), video_id, limit, offset, and match=any to match any word
+    instead of all of them. Returns (body, status_code).
+    """
+    query = args.get('q', '').strip()
+    if not query:
+        return {"error": "Query parameter 'q' is required"}, 400
+    kinds = args.getlist('kind')
+    if any(kind not in DOCUMENT_KINDS for kind in kinds):
+        return {"error": f"kind must be one of: {', '.join(DOCUMENT_KINDS)}"}, 400
+    try:
+        limit = min(max(int(args.get('limit', 20)), 1), SEARCH_MAX_LIMIT)
+        offset = max(int(args.get('offset', 0)), 0)
+    except ValueError:
+        return {"error": "limit and offset must be integers"}, 400
+
+    results, took_ms = search_index.search(
+        query, kinds=kinds, video_id=args.get('video_id'), limit=limit,
+        offset=offset, match_any=args.get('match') == 'any')
+    return {"query": query, "results": results, "took_ms": round(took_ms, 2),
+            "limit": limit, "offset": offset}, 200
+
+
+@app.route('/api/search', methods=['GET'])
+def search_endpoint():
+    body, status = run_search(request.args)
+    return jsonify(body), status
+
+
+@app.route('/api/ready', methods=['GET'])
+def readiness_endpoint():
+    ready, details = model_residency.readiness()
+    return jsonify({"ready": ready, **details}), 200 if ready else 503
+
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    return jsonify({
+        "transcript_cache": transcript_cache.stats(),
+        "transcript_normalizer": transcript_normalizer.stats(),
+        "result_cache": result_cache.stats(),
+        "chunked_summarizer": chunked_summarizer.stats(),
+        "jobs": job_manager.stats(),
+        "model_concurrency": model_limiter.stats(),
+        "vision_concurrency": vision_limiter.stats(),
+        "chat_sessions": chat_sessions.stats(),
+        "chat_context": chat_context.stats(),
+        "models": model_residency.stats(),
+        "model_registry": model_registry.stats(),
+        "image_preprocessor": image_preprocessor.stats(),
+        "image_uploads": image_uploads.stats(),
+        "video_indexes": video_indexes.stats(),
+        "search_index": search_index.stats(),
+        "chapters": chapter_resolver.stats(),
+        "extractive_compressor": extractive_compressor.stats(),
+        "model_router": model_router.stats(),
+        "llm_clients": {
+            "ollama": ollama_client.stats(),
+            "openai": openai_client.stats(),
+        },
+        "coalescing": {
+            "transcript_fetches": transcript_flights.stats(),
+            "generations": generation_flights.stats(),
+            "generations_saved": generation_flights.coalesced,
+        },
+    })
+
 # --- Serve Client Files ---
 
 
@@ -317,4 +2187,7 @@ def serve_static_files(path):
 
 
 if __name__ == '__main__':
+    # With the reloader, only the child process that serves requests warms models
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services()
     app.run(debug=True, port=5000)
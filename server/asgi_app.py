@@ -0,0 +1,633 @@
+"""
+Asyncio (ASGI) serving mode for the chat, summarize and explain endpoints.
+
+Serves the same JSON and Server-Sent Events contracts as app.py, but talks to
+Ollama through a shared non-blocking client, so one process can hold hundreds
+of concurrent streams without a thread for each. Prompts, caches and
+transcript loading are shared with app.py.
+
+Run with:
+    hypercorn asgi_app:app --bind localhost:5000
+"""
+import asyncio
+import concurrent.futures
+import os
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+from quart import Quart, Response, jsonify, request
+from quart_cors import cors
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from app import (
+    IMAGE_UPLOAD_MAX_REQUEST_BYTES,
+    MAX_CHAT_IMAGES,
+    MODEL_WARMUP_WAIT_SECONDS,
+    OLLAMA_BASE_URL,
+    ChatSessionNotFoundError,
+    ImageUploadError,
+    ImageUploadNotFoundError,
+    TranscriptProcessingError,
+    answer_image_followup,
+    answer_video_question,
+    build_chat_payload,
+    build_chat_turn,
+    build_conversation_prompt,
+    build_local_llm_prompt,
+    build_session_prompt,
+    chapter_resolver,
+    chat_context,
+    chat_sessions,
+    chunked_summarizer,
+    extractive_compressor,
+    generation_flights,
+    get_model_and_prompt_template,
+    get_result_cache_key,
+    handle_image_chat,
+    image_preprocessor,
+    image_uploads,
+    index_result,
+    list_chapters,
+    load_scoped_text,
+    model_registry,
+    model_residency,
+    model_router,
+    ollama_client,
+    parse_compression,
+    parse_transcript_scope,
+    record_chat_turn,
+    resolve_chat_images,
+    reusable_chat_context,
+    result_cache,
+    result_scope,
+    route_transcript,
+    run_search,
+    search_index,
+    session_has_images,
+    start_background_services,
+    sse_event,
+    summarize_with_api_llm,
+    transcript_cache,
+    transcript_flights,
+    transcript_normalizer,
+    video_indexes,
+    vision_limiter,
+)
+from llm_client import AsyncOllamaClient
+
+app = cors(Quart(__name__), allow_origin="*")
+# Quart's default of 16MB would cut uploads short; bodies over the upload limit are refused as in app.py
+app.config['MAX_CONTENT_LENGTH'] = IMAGE_UPLOAD_MAX_REQUEST_BYTES
+
+# Shares the circuit breaker with app.py's client, so both fail fast together
+ollama = AsyncOllamaClient(
+    base_url=OLLAMA_BASE_URL,
+    max_connections=int(os.getenv("ASGI_OLLAMA_MAX_CONNECTIONS", 200)),
+    max_retries=ollama_client.max_retries,
+    backoff_base=ollama_client.backoff_base,
+    breaker=ollama_client.breaker)
+
+
+@app.before_serving
+async def startup():
+    start_background_services()
+
+
+@app.after_serving
+async def shutdown():
+    await ollama.aclose()
+
+
+async def ensure_warm(model_name):
+    """Waits on a worker thread for a cold model to load; warm models return immediately."""
+    if not model_residency.is_warm(model_name):
+        await asyncio.to_thread(model_residency.ensure_warm, model_name, MODEL_WARMUP_WAIT_SECONDS)
+
+
+async def build_prompt(transcript_text, is_detailed_explanation, model_name):
+    """Async counterpart of build_local_llm_prompt; only map-reduce runs on a thread."""
+    if chunked_summarizer.needs_chunking(transcript_text):
+        return await asyncio.to_thread(
+            build_local_llm_prompt, transcript_text, is_detailed_explanation, model_name=model_name)
+
+    _, prompt_template = get_model_and_prompt_template(is_detailed_explanation)
+    return model_name, prompt_template.format(transcript_text=transcript_text)
+
+
+async def generate_text(model_name, prompt, task):
+    """Runs a non-streaming generation and returns its text (or None), feeding the model router."""
+    payload = {"model": model_name, "prompt": prompt, "stream": False,
+               "keep_alive": model_residency.keep_alive_for(model_name)}
+    with model_router.track(model_name):
+        response_data = await ollama.generate_json(payload)
+    model_router.observe(model_name, response_data, task)
+    content = (response_data.get("response") or "").strip()
+    if content:
+        print(f"Successfully got content from {model_name}.")
+    return content or None
+
+
+def run_locked(session, fn, /, *args, **kwargs):
+    """Calls fn holding the session's turn lock, if there is a session; for use on worker threads."""
+    if session is None:
+        return fn(*args, **kwargs)
+    with session.lock:
+        return fn(*args, **kwargs)
+
+
+@asynccontextmanager
+async def session_turn(session):
+    """Holds the session's turn lock, shared with the worker-thread paths, without blocking the event loop."""
+    if not session.lock.acquire(blocking=False):
+        acquire = asyncio.ensure_future(asyncio.to_thread(session.lock.acquire))
+        try:
+            await asyncio.shield(acquire)
+        except asyncio.CancelledError:
+            # The worker thread still takes the lock; hand it back as soon as it does
+            acquire.add_done_callback(lambda _: session.lock.release())
+            raise
+    try:
+        yield
+    finally:
+        session.lock.release()
+
+# --- API Endpoints ---
+
+
+@app.route('/api/chat', methods=['POST'])
+async def chat_with_model_endpoint():
+    data = await request.get_json()
+    user_message = data.get('message')
+
+    try:
+        images = resolve_chat_images(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except ImageUploadNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+
+    if not user_message and not images:
+        return jsonify({"error": "Message or images are required"}), 400
+
+    print(f"Received chat message: {user_message}", flush=True)
+
+    session = None
+    if data.get('session_id'):
+        try:
+            session = chat_sessions.get(data['session_id'])
+        except ChatSessionNotFoundError as e:
+            return jsonify({"error": str(e)}), 404
+
+    if data.get('youtube_url'):
+        if images or not user_message:
+            return jsonify({"error": "Video chat takes a text message without images"}), 400
+        # Index building and retrieval are CPU-bound or blocking; they run on a worker thread
+        try:
+            reply, sources, error, status = await asyncio.to_thread(
+                run_locked, session, answer_video_question, data['youtube_url'], user_message,
+                session=session, conversation_history=data.get('conversation_history', []))
+        except TranscriptProcessingError as e:
+            return jsonify({"error": e.message}), e.status_code
+        if reply is None:
+            return jsonify({"error": error}), status
+        body = {"reply": reply, "sources": sources}
+        if session is not None:
+            body["session_id"] = session.id
+        return jsonify(body)
+
+    if images and data.get('stream'):
+        return Response(
+            stream_image_chat(user_message, images, session=session,
+                              conversation_history=data.get('conversation_history', [])),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    if images or (session is not None and session_has_images(session)):
+        # Vision requests and questions about earlier images are rare and heavy; they run on a worker thread
+        if images:
+            reply, error, status = await asyncio.to_thread(
+                run_locked, session, handle_image_chat, user_message, images, session=session,
+                conversation_history=data.get('conversation_history', []))
+        else:
+            reply, error, status = await asyncio.to_thread(
+                run_locked, session, answer_image_followup, session, user_message)
+        if reply is None:
+            return jsonify({"error": error}), status
+        if session is None:
+            return jsonify({"reply": reply})
+        return jsonify({"reply": reply, "session_id": session.id})
+
+    try:
+        if session is None:
+            ai_reply, _ = await chat_generate(build_conversation_prompt(
+                data.get('conversation_history', []), user_message))
+        else:
+            # Turns in one session run one at a time, as in app.py
+            async with session_turn(session):
+                ai_reply = await continue_chat_session(session, user_message)
+    except httpx.TimeoutException:
+        print("Ollama API chat request timed out.", flush=True)
+        return jsonify({"error": "Request to AI model timed out."}), 504
+    except httpx.ConnectError:
+        print(
+            f"Ollama API chat connection error. Is Ollama running at {ollama.base_url}?", flush=True)
+        return jsonify({"error": "Could not connect to the AI model."}), 503
+    except httpx.HTTPError as e:
+        print(f"Ollama API chat request failed: {e}", flush=True)
+        return jsonify({"error": "Failed to communicate with the AI model."}), 502
+    except Exception as e:
+        print(
+            f"An unexpected error occurred during chat processing: {e}", flush=True)
+        return jsonify({"error": "An unexpected error occurred while chatting with the AI."}), 500
+
+    if ai_reply:
+        if session is None:
+            return jsonify({"reply": ai_reply})
+        return jsonify({"reply": ai_reply, "session_id": session.id})
+    return jsonify({"error": "AI model did not provide a reply."}), 500
+
+
+async def stream_image_chat(user_message, images, session=None, conversation_history=None):
+    """Async counterpart of stream_image_chat in app.py; the chat runs on a worker thread."""
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    started = time.perf_counter()
+
+    def publish(event):
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    chat = asyncio.ensure_future(asyncio.to_thread(
+        run_locked, session, handle_image_chat, user_message, images, session=session,
+        conversation_history=conversation_history, publish=publish))
+    # Completion is delivered after every event the thread published before returning
+    chat.add_done_callback(lambda _: events.put_nowait(None))
+    while True:
+        event = await events.get()
+        if event is None:
+            break
+        yield sse_event(event)
+
+    try:
+        reply, error, _ = chat.result()
+    except Exception as e:
+        print(f"Streaming image chat failed: {e}", flush=True)
+        reply, error = None, "The reply was interrupted."
+    if reply is None:
+        yield sse_event({"error": error})
+        return
+    done = {"done": True, "images": min(len(images), MAX_CHAT_IMAGES),
+            "total_seconds": round(time.perf_counter() - started, 3)}
+    if session is not None:
+        done["session_id"] = session.id
+    yield sse_event(done)
+
+
+async def chat_generate(prompt, context=None):
+    """Returns (reply, response_data) for a chat prompt, continuing from `context` if given."""
+    payload = build_chat_payload(prompt, context)
+    await ensure_warm(payload["model"])
+    with model_router.track(payload["model"]):
+        response_data = await ollama.generate_json(payload, deadline=180)
+    model_router.observe(payload["model"], response_data, "chat")
+    reply = (response_data.get("response") or "").strip()
+    return reply or None, response_data
+
+
+async def continue_chat_session(session, user_message):
+    """Async counterpart of continue_chat_session in app.py; returns the reply or None."""
+    context = reusable_chat_context(session, user_message)
+    if context is not None:
+        try:
+            reply, response_data = await chat_generate(build_chat_turn(user_message), context)
+        except httpx.HTTPStatusError as e:
+            print(f"Ollama API chat request with context failed: {e}", flush=True)
+            reply = None
+        if reply:
+            record_chat_turn(session, user_message, reply,
+                             response_data, context_reused=True)
+            return reply
+        print(
+            f"Chat session {session.id} context reuse failed; rebuilding prompt from history", flush=True)
+        chat_sessions.record_context_fallback()
+
+    reply, response_data = await chat_generate(
+        build_session_prompt(session, user_message))
+    if reply:
+        record_chat_turn(session, user_message, reply,
+                         response_data, context_reused=False)
+    return reply
+
+
+class BodyReader:
+    """File-like view of a request body for code on a worker thread; read() waits for the next chunk."""
+
+    def __init__(self, body, loop, timeout=None):
+        self._chunks = body.__aiter__()
+        self._loop = loop
+        self.timeout = timeout
+
+    def read(self, size=-1):
+        chunk = asyncio.run_coroutine_threadsafe(self._chunks.__anext__(), self._loop)
+        try:
+            return chunk.result(timeout=self.timeout)
+        except StopAsyncIteration:
+            return b""
+        except concurrent.futures.TimeoutError:
+            chunk.cancel()
+            raise ImageUploadError("Timed out waiting for the upload body", 408)
+
+
+@app.route('/api/images', methods=['POST'])
+async def upload_images_endpoint():
+    """Async counterpart of upload_images_endpoint in app.py; uploads are copied on a worker thread."""
+    if request.content_length is not None and request.content_length > IMAGE_UPLOAD_MAX_REQUEST_BYTES:
+        return jsonify({"error": f"Uploads may be at most {IMAGE_UPLOAD_MAX_REQUEST_BYTES} bytes"}), 413
+
+    try:
+        if request.mimetype == 'multipart/form-data':
+            files = (await request.files).getlist('images')
+            if not files:
+                return jsonify({"error": "No images were uploaded"}), 400
+            if len(files) > MAX_CHAT_IMAGES:
+                return jsonify({"error": f"At most {MAX_CHAT_IMAGES} images may be uploaded at once"}), 400
+            uploads = [await asyncio.to_thread(image_uploads.add, file.stream, file.mimetype) for file in files]
+        else:
+            # The body is copied chunk by chunk as it arrives, never held in memory as a whole
+            reader = BodyReader(request.body, asyncio.get_running_loop(), request.body_timeout)
+            uploads = [await asyncio.to_thread(image_uploads.add, reader, request.mimetype)]
+    except ImageUploadError as e:
+        return jsonify({"error": e.message}), e.status_code
+    except RequestEntityTooLarge:
+        return jsonify({"error": f"Uploads may be at most {IMAGE_UPLOAD_MAX_REQUEST_BYTES} bytes"}), 413
+
+    print(f"Stored {len(uploads)} uploaded images ({sum(upload.size for upload in uploads)} bytes)", flush=True)
+    return jsonify({"images": [upload.to_dict() for upload in uploads]}), 201
+
+
+@app.route('/api/images/<image_id>', methods=['DELETE'])
+async def delete_image_endpoint(image_id):
+    if not image_uploads.delete(image_id):
+        return jsonify({"error": f"Image {image_id} not found or expired."}), 404
+    return jsonify({"deleted": True})
+
+
+@app.route('/api/chat/sessions', methods=['POST'])
+async def create_chat_session_endpoint():
+    data = await request.get_json(silent=True) or {}
+    session = chat_sessions.create(data.get('conversation_history'))
+    return jsonify(session.to_dict()), 201
+
+
+@app.route('/api/chat/sessions/<session_id>', methods=['GET'])
+async def get_chat_session_endpoint(session_id):
+    try:
+        return jsonify(chat_sessions.get(session_id).to_dict())
+    except ChatSessionNotFoundError as e:
+        return jsonify({"error": str(e)}), 404
+
+
+@app.route('/api/chat/sessions/<session_id>', methods=['DELETE'])
+async def delete_chat_session_endpoint(session_id):
+    if not chat_sessions.delete(session_id):
+        return jsonify({"error": f"Chat session {session_id} not found or expired."}), 404
+    return jsonify({"deleted": True})
+
+
+@app.route('/api/summarize', methods=['POST'])
+async def summarize_video_endpoint():
+    return await handle_transcript_processing(is_detailed_explanation=False)
+
+
+@app.route('/api/explain', methods=['POST'])
+async def explain_video_endpoint():
+    return await handle_transcript_processing(is_detailed_explanation=True)
+
+
+async def handle_transcript_processing(is_detailed_explanation):
+    data = await request.get_json()
+    youtube_url = data.get('youtube_url')
+    stream = data.get('stream', False)  # Opt-in Server-Sent Events
+
+    if not youtube_url:
+        return jsonify({"error": "YouTube URL is required"}), 400
+
+    action = "explanation" if is_detailed_explanation else "summary"
+    try:
+        # The transcript API is synchronous; cache hits return almost immediately.
+        # Ranges over several chapters also generate missing chapter results here.
+        video_id, transcript_text, range_info = await asyncio.to_thread(
+            load_scoped_text, youtube_url, parse_transcript_scope(data), is_detailed_explanation,
+            compression=parse_compression(data))
+    except TranscriptProcessingError as e:
+        return jsonify({"error": e.message}), e.status_code
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        return jsonify({"error": f"An unexpected error occurred: {str(e)}"}), 500
+
+    scope = result_scope(range_info)
+    cache_key = get_result_cache_key(transcript_text, is_detailed_explanation)
+    content = result_cache.get(*cache_key)
+    if content is not None:
+        print(f"Result cache hit for {action} of video ID: {video_id}")
+
+    if stream:
+        return Response(
+            stream_events(video_id, transcript_text, is_detailed_explanation,
+                          cache_key, cached_content=content, scope=scope),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    shared = False
+    if content is None:
+        async def generate():
+            # A smaller model picked under load may have a cached result of its own
+            route = route_transcript(transcript_text, is_detailed_explanation)
+            routed_key = get_result_cache_key(transcript_text, is_detailed_explanation, route["model"])
+            if routed_key != cache_key:
+                content = result_cache.get(*routed_key)
+                if content is not None:
+                    return content
+
+            content = None
+            model_name, prompt = await build_prompt(transcript_text, is_detailed_explanation, route["model"])
+            if prompt is not None:
+                try:
+                    await ensure_warm(model_name)
+                    content = await generate_text(model_name, prompt, action)
+                except httpx.HTTPError as e:
+                    print(f"Ollama API request failed: {e}")
+            if content is not None:
+                result_cache.put(*routed_key, content)
+                return content
+
+            print(
+                f"Local LLM failed or not implemented, trying API LLM for {action}.")
+            return await asyncio.to_thread(summarize_with_api_llm, transcript_text, is_detailed_explanation)
+
+        # Identical concurrent requests wait for the first one, with the same key as app.py
+        content, shared = await generation_flights.do_async(
+            (video_id, action, cache_key[2], scope, cache_key[0]), generate)
+        if shared:
+            print(f"Shared in-flight {action} for video ID: {video_id}")
+
+    if content:
+        if not shared:
+            index_result(video_id, action, content, scope)
+        if range_info is not None:
+            return jsonify({action: content, "range": range_info})
+        return jsonify({action: content})
+    return jsonify({"error": f"Failed to get {action} using all available methods."}), 500
+
+
+async def stream_events(video_id, transcript_text, is_detailed_explanation, cache_key, cached_content=None, scope=None):
+    """Async counterpart of stream_transcript_processing in app.py; same event format and coalescing."""
+    action = "explanation" if is_detailed_explanation else "summary"
+    model_name = cache_key[2]
+
+    async def produce(publish):
+        """Runs one streaming generation, publishing its events; returns the content."""
+        started = time.perf_counter()
+
+        route = route_transcript(transcript_text, is_detailed_explanation)
+        routed_key = get_result_cache_key(transcript_text, is_detailed_explanation, route["model"])
+        if routed_key != cache_key:
+            content = result_cache.get(*routed_key)
+            if content is not None:
+                index_result(video_id, action, content, scope)
+                publish({"chunk": content})
+                publish({"done": True, "action": action, "model": route["model"],
+                         "cached": True, "route": route["reason"]})
+                return content
+
+        routed_model, prompt = await build_prompt(transcript_text, is_detailed_explanation, route["model"])
+
+        parts = []
+        metadata = None
+        first_token_seconds = None
+        if prompt is not None:
+            try:
+                await ensure_warm(routed_model)
+                with model_router.track(routed_model):
+                    async for event in ollama.stream(routed_model, prompt, keep_alive=model_residency.keep_alive_for(routed_model)):
+                        if "chunk" in event:
+                            if first_token_seconds is None:
+                                first_token_seconds = round(
+                                    time.perf_counter() - started, 3)
+                            parts.append(event["chunk"])
+                            publish(event)
+                        else:
+                            metadata = event
+            except httpx.HTTPError as e:
+                print(f"Ollama API streaming request failed: {e}")
+
+        content = "".join(parts).strip()
+        if metadata is not None and content:
+            model_router.observe(routed_model, metadata, action)
+            result_cache.put(*routed_key, content)
+            index_result(video_id, action, content, scope)
+            publish({
+                "done": True,
+                "action": action,
+                "cached": False,
+                "route": route["reason"],
+                "first_token_seconds": first_token_seconds,
+                "total_seconds": round(time.perf_counter() - started, 3),
+                **metadata
+            })
+            return content
+
+        # Fallback to API LLM only if nothing has been sent yet
+        if not parts:
+            content = await asyncio.to_thread(summarize_with_api_llm, transcript_text, is_detailed_explanation)
+            if content:
+                index_result(video_id, action, content, scope)
+                publish({"chunk": content})
+                publish({"done": True, "action": action, "model": "api", "cached": False})
+                return content
+
+        publish({"error": f"Failed to get {action} using all available methods."})
+        return None
+
+    if cached_content is not None:
+        index_result(video_id, action, cached_content, scope)
+        yield sse_event({"chunk": cached_content})
+        yield sse_event({"done": True, "action": action, "model": model_name, "cached": True})
+        return
+
+    flight, is_leader = generation_flights.stream_async(
+        (video_id, action, model_name, scope, cache_key[0]), produce)
+    if not is_leader:
+        print(f"Joined in-flight {action} for video ID: {video_id}")
+
+    if flight.streaming:
+        async for event in flight.subscribe_async():
+            if event.get("done"):
+                event = {**event, "coalesced": not is_leader}
+            yield sse_event(event)
+        if flight.error is not None:
+            yield sse_event({"error": f"An unexpected error occurred: {str(flight.error)}"})
+        return
+
+    # A non-streaming request for the same video is already generating; replay its result
+    try:
+        content = await flight.wait_async()
+    except Exception as e:
+        print(f"Shared in-flight {action} failed: {e}")
+        content = None
+
+    if content:
+        yield sse_event({"chunk": content})
+        yield sse_event({"done": True, "action": action, "model": model_name, "cached": False, "coalesced": True})
+    else:
+        yield sse_event({"error": f"Failed to get {action} using all available methods."})
+
+
+@app.route('/api/chapters', methods=['GET'])
+async def chapters_endpoint():
+    body, status = await asyncio.to_thread(list_chapters, request.args.get('youtube_url'))
+    return jsonify(body), status
+
+
+@app.route('/api/search', methods=['GET'])
+async def search_endpoint():
+    body, status = await asyncio.to_thread(run_search, request.args)
+    return jsonify(body), status
+
+
+@app.route('/api/ready', methods=['GET'])
+async def readiness_endpoint():
+    ready, details = model_residency.readiness()
+    return jsonify({"ready": ready, **details}), 200 if ready else 503
+
+
+@app.route('/api/metrics', methods=['GET'])
+async def metrics_endpoint():
+    return jsonify({
+        "transcript_cache": transcript_cache.stats(),
+        "transcript_normalizer": transcript_normalizer.stats(),
+        "result_cache": result_cache.stats(),
+        "chunked_summarizer": chunked_summarizer.stats(),
+        "chat_sessions": chat_sessions.stats(),
+        "chat_context": chat_context.stats(),
+        "models": model_residency.stats(),
+        "model_registry": model_registry.stats(),
+        "image_preprocessor": image_preprocessor.stats(),
+        "image_uploads": image_uploads.stats(),
+        "vision_concurrency": vision_limiter.stats(),
+        "video_indexes": video_indexes.stats(),
+        "search_index": search_index.stats(),
+        "chapters": chapter_resolver.stats(),
+        "extractive_compressor": extractive_compressor.stats(),
+        "model_router": model_router.stats(),
+        "llm_clients": {"ollama": ollama.stats()},
+        "coalescing": {
+            "transcript_fetches": transcript_flights.stats(),
+            "generations": generation_flights.stats(),
+            "generations_saved": generation_flights.coalesced,
+        },
+    })
+
+
+if __name__ == '__main__':
+    app.run(debug=True, port=5000)
@@ -0,0 +1,173 @@
+"""
+Chapters of a YouTube video, used to summarize part of a video.
+
+Chapters come from the timestamps in the video description ("0:00 Intro").
+The description is read through the YouTube Data API when YOUTUBE_API_KEY is
+set, and from the public watch page otherwise. YouTube only shows chapters
+when the first one starts at 0:00 and there are at least three. Videos
+without chapters are split into fixed-length windows instead, so every
+transcript has chapters and summaries can be cached per chapter.
+"""
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import requests
+
+from transcript import format_timestamp
+
+TIMESTAMP_PATTERN = re.compile(r"^(?:(\d+):)?(\d{1,2}):(\d{2})$")
+CHAPTER_LINE_PATTERN = re.compile(
+    r"^\s*[\[(]?((?:\d+:)?\d{1,2}:\d{2})[\])]?\s*[-–—:|.]*\s*(.*?)\s*$")
+SHORT_DESCRIPTION_PATTERN = re.compile(r'"shortDescription":("(?:[^"\\]|\\.)*")')
+MIN_DESCRIPTION_CHAPTERS = 3
+
+
+def parse_timestamp(value):
+    """
+    Parses seconds given as a number or as "m:ss" / "h:mm:ss".
+    Raises ValueError for anything else.
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid timestamp: {value!r}")
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    match = TIMESTAMP_PATTERN.match(text)
+    if match:
+        hours, minutes, seconds = match.groups()
+        return float(int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds))
+    return float(text)
+
+
+def parse_description_chapters(description):
+    """
+    Returns [(start_seconds, title), ...] for the chapter list in a video
+    description, or [] if it has none that YouTube would show.
+    """
+    marks = []
+    for line in (description or "").splitlines():
+        match = CHAPTER_LINE_PATTERN.match(line)
+        if not match:
+            continue
+        start = parse_timestamp(match.group(1))
+        if marks and start <= marks[-1][0]:
+            continue
+        marks.append((start, match.group(2) or f"Chapter {len(marks) + 1}"))
+    if len(marks) < MIN_DESCRIPTION_CHAPTERS or marks[0][0] != 0:
+        return []
+    return marks
+
+
+def build_chapters(marks, duration):
+    """Turns [(start, title), ...] into chapter dicts that end where the next one starts."""
+    chapters = []
+    for index, (start, title) in enumerate(marks):
+        if start >= duration:
+            break
+        end = marks[index + 1][0] if index + 1 < len(marks) else duration
+        chapters.append({
+            "index": index,
+            "title": title,
+            "start": float(start),
+            "end": float(min(end, duration)),
+        })
+    return chapters
+
+
+def fixed_chapters(duration, window_seconds):
+    """Splits `duration` seconds into consecutive windows of `window_seconds`."""
+    marks = []
+    start = 0
+    while start < duration or not marks:
+        end = min(start + window_seconds, duration)
+        marks.append((start, f"{format_timestamp(start)}-{format_timestamp(end)}"))
+        start += window_seconds
+    return build_chapters(marks, max(duration, 1))
+
+
+def fetch_description_with_api(video_id, timeout):
+    response = requests.get(
+        "https://www.googleapis.com/youtube/v3/videos",
+        params={"part": "snippet", "id": video_id, "key": os.getenv("YOUTUBE_API_KEY")},
+        timeout=timeout)
+    response.raise_for_status()
+    items = response.json().get("items", [])
+    return items[0]["snippet"].get("description", "") if items else ""
+
+
+def fetch_description_from_page(video_id, timeout):
+    response = requests.get(
+        "https://www.youtube.com/watch",
+        params={"v": video_id},
+        headers={"Accept-Language": "en-US,en;q=0.9"},
+        timeout=timeout)
+    response.raise_for_status()
+    match = SHORT_DESCRIPTION_PATTERN.search(response.text)
+    return json.loads(match.group(1)) if match else ""
+
+
+class ChapterResolver:
+    """Looks up and caches the chapter marks of videos."""
+
+    def __init__(self, window_seconds=300, max_entries=1000, timeout=10):
+        self.window_seconds = window_seconds
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        # Video ID -> description chapter marks; [] when the video has none
+        self._marks = OrderedDict()
+        self.lookups = 0
+        self.described = 0
+        self.fixed = 0
+        self.failures = 0
+
+    def get(self, video_id, duration):
+        """Returns the video's chapters, or fixed-length windows if it has none."""
+        marks = self._lookup(video_id)
+        chapters = build_chapters(marks, duration) if marks else []
+        with self._lock:
+            if chapters:
+                self.described += 1
+            else:
+                self.fixed += 1
+        return chapters or fixed_chapters(duration, self.window_seconds)
+
+    def _lookup(self, video_id):
+        with self._lock:
+            if video_id in self._marks:
+                self._marks.move_to_end(video_id)
+                return self._marks[video_id]
+
+        try:
+            if os.getenv("YOUTUBE_API_KEY"):
+                description = fetch_description_with_api(video_id, self.timeout)
+            else:
+                description = fetch_description_from_page(video_id, self.timeout)
+            marks = parse_description_chapters(description)
+        except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+            print(f"Could not read chapters of video {video_id}: {e}")
+            with self._lock:
+                self.failures += 1
+            # Not cached, so the next request tries again
+            return []
+
+        with self._lock:
+            self.lookups += 1
+            self._marks[video_id] = marks
+            while len(self._marks) > self.max_entries:
+                self._marks.popitem(last=False)
+        return marks
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._marks),
+                "window_seconds": self.window_seconds,
+                "lookups": self.lookups,
+                "described": self.described,
+                "fixed": self.fixed,
+                "failures": self.failures,
+            }
@@ -0,0 +1,245 @@
+"""
+Server-side chat sessions.
+
+A session keeps the conversation history on the server, so clients only send
+a session ID and the new message on each turn instead of re-uploading the
+whole conversation. Each message is rendered into prompt text and its tokens
+counted once, when it is added; prompts are assembled from those rendered
+lines, and older ones are folded into a rolling summary (see
+conversation_context.py). Sessions that have been idle longer than the TTL are expired, and the
+least recently used ones are evicted once the store is full.
+
+A session also keeps the `context` token array Ollama returned for its last
+reply, so the next turn can continue from it and only the new message has to
+be evaluated. The store records prompt-evaluation counts and times for turns
+with and without a reused context.
+
+Images shared in a session are remembered by content hash, together with a
+text description and the preprocessed image. Follow-up questions are
+answered by the text model from those descriptions, and only sent back to
+the vision model when the description is not enough.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from chunked_summarizer import estimate_tokens
+
+
+class ChatSessionNotFoundError(Exception):
+    """Raised when a session ID is unknown or the session has expired."""
+
+
+class ChatSession:
+    """History, pre-rendered prompt lines and rolling summary for one conversation."""
+
+    def __init__(self, session_id, render_message, max_messages, max_images=8):
+        self.id = session_id
+        self.created_at = time.time()
+        self.last_active = self.created_at
+        self.turns = 0
+        # Ollama context after the last reply, and the model and system prompt that produced it
+        self.context = None
+        self.context_model = None
+        self.context_system_prompt = None
+        # Messages not yet folded into the summary, oldest first
+        self.messages = []
+        self.summary = ""
+        self.summarized_messages = 0
+        self.fold_pending = False
+        self.max_messages = max_messages
+        # Shared images by hash, oldest first: {"description", "image": (mime_type, base64), "model"}
+        self.images = OrderedDict()
+        self.max_images = max_images
+        self._render_message = render_message
+        self._state_lock = threading.Lock()
+        # Serializes turns, so concurrent messages in one session see each other's replies
+        self.lock = threading.Lock()
+
+    def add_message(self, message_type, content):
+        content = (content or "").strip()
+        if not content:
+            return
+        rendered = self._render_message(message_type, content)
+        with self._state_lock:
+            self.messages.append({
+                "type": message_type,
+                "content": content,
+                "rendered": rendered,
+                "tokens": estimate_tokens(rendered),
+            })
+            # Safety net in case summaries keep failing
+            del self.messages[:-self.max_messages]
+
+    def add_turn(self, user_message, reply, context=None, model=None, system_prompt=None):
+        self.add_message("user", user_message)
+        self.add_message("bot", reply)
+        self.turns += 1
+        self.context = context
+        self.context_model = model
+        self.context_system_prompt = system_prompt
+
+    def attach_image(self, image_hash, image, model, description=None):
+        """Remembers an image shared in this session; the most recent `max_images` are kept."""
+        with self._state_lock:
+            entry = self.images.pop(image_hash, None) or {"description": None}
+            entry.update({"image": image, "model": model})
+            if description:
+                entry["description"] = description
+            self.images[image_hash] = entry
+            while len(self.images) > self.max_images:
+                self.images.popitem(last=False)
+            # The prompt that produced the current Ollama context did not include this image
+            self.context = None
+
+    def describe_image(self, image_hash, description):
+        """Stores a description for an attached image once it is available."""
+        with self._state_lock:
+            entry = self.images.get(image_hash)
+            if entry is None or entry["description"] == description:
+                return
+            entry["description"] = description
+            self.context = None
+
+    def images_snapshot(self):
+        """Returns [(image_hash, entry), ...] for the attached images, oldest first."""
+        with self._state_lock:
+            return [(image_hash, dict(entry)) for image_hash, entry in self.images.items()]
+
+    def history_snapshot(self):
+        """Returns (summary, messages) as of now."""
+        with self._state_lock:
+            return self.summary, list(self.messages)
+
+    def apply_summary(self, summary, folded_count):
+        """Replaces the summary and drops the `folded_count` oldest messages it now covers."""
+        with self._state_lock:
+            self.summary = summary
+            del self.messages[:folded_count]
+            self.summarized_messages += folded_count
+
+    def to_dict(self):
+        return {
+            "session_id": self.id,
+            "created_at": self.created_at,
+            "last_active": self.last_active,
+            "turns": self.turns,
+            "context_tokens": len(self.context) if self.context else 0,
+            "summary": self.summary,
+            "summarized_messages": self.summarized_messages,
+            "images": [{"hash": image_hash, "described": entry["description"] is not None}
+                       for image_hash, entry in self.images_snapshot()],
+            "history": [{"type": message["type"], "content": message["content"]}
+                        for message in self.messages],
+        }
+
+
+class ChatSessionStore:
+    """In-memory chat sessions with an idle TTL and a maximum session count."""
+
+    def __init__(self, render_message, max_session_messages=500, idle_ttl_seconds=1800, max_sessions=1000,
+                 max_session_images=8):
+        self.render_message = render_message
+        self.max_session_messages = max_session_messages
+        self.max_session_images = max_session_images
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_sessions = max_sessions
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+        self.context_fallbacks = 0
+        self.image_followups = 0
+        self.image_escalations = 0
+        self._prompt_eval = {
+            "context_reused": {"turns": 0, "prompt_eval_count": 0, "prompt_eval_ms": 0.0},
+            "full_prompt": {"turns": 0, "prompt_eval_count": 0, "prompt_eval_ms": 0.0},
+        }
+
+    def create(self, history=None):
+        """Creates a session, optionally seeded with a client-side history."""
+        session = ChatSession(
+            uuid.uuid4().hex, self.render_message, self.max_session_messages, self.max_session_images)
+        for message in history or []:
+            session.add_message(message.get("type"), message.get("content"))
+
+        with self._lock:
+            self._expire_locked(time.time())
+            self._sessions[session.id] = session
+            self.created += 1
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+                self.evicted += 1
+        return session
+
+    def get(self, session_id):
+        """Returns the session and marks it active, or raises ChatSessionNotFoundError."""
+        now = time.time()
+        with self._lock:
+            self._expire_locked(now)
+            session = self._sessions.get(session_id)
+            if session is None:
+                raise ChatSessionNotFoundError(
+                    f"Chat session {session_id} not found or expired.")
+            session.last_active = now
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def record_prompt_eval(self, context_reused, response_data):
+        """Adds one turn's prompt_eval_count and prompt_eval_duration (ns) to the metrics."""
+        with self._lock:
+            bucket = self._prompt_eval["context_reused" if context_reused else "full_prompt"]
+            bucket["turns"] += 1
+            bucket["prompt_eval_count"] += response_data.get("prompt_eval_count") or 0
+            bucket["prompt_eval_ms"] += (response_data.get("prompt_eval_duration") or 0) / 1e6
+
+    def record_context_fallback(self):
+        with self._lock:
+            self.context_fallbacks += 1
+
+    def record_image_followup(self, escalated):
+        """Counts a question about session images, and whether it needed the vision model."""
+        with self._lock:
+            self.image_followups += 1
+            if escalated:
+                self.image_escalations += 1
+
+    def _expire_locked(self, now):
+        cutoff = now - self.idle_ttl_seconds
+        # Sessions are kept in least-recently-active order
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.last_active >= cutoff:
+                break
+            del self._sessions[session_id]
+            self.expired += 1
+
+    def stats(self):
+        with self._lock:
+            self._expire_locked(time.time())
+            return {
+                "active": len(self._sessions),
+                "created": self.created,
+                "expired": self.expired,
+                "evicted": self.evicted,
+                "max_sessions": self.max_sessions,
+                "idle_ttl_seconds": self.idle_ttl_seconds,
+                "context_fallbacks": self.context_fallbacks,
+                "image_followups": self.image_followups,
+                "image_escalations": self.image_escalations,
+                "prompt_eval": {
+                    mode: {
+                        **bucket,
+                        "prompt_eval_ms": round(bucket["prompt_eval_ms"], 1),
+                        "avg_prompt_eval_count": round(bucket["prompt_eval_count"] / bucket["turns"], 1) if bucket["turns"] else None,
+                        "avg_prompt_eval_ms": round(bucket["prompt_eval_ms"] / bucket["turns"], 1) if bucket["turns"] else None,
+                    }
+                    for mode, bucket in self._prompt_eval.items()
+                },
+            }
@@ -0,0 +1,160 @@
+"""
+Map-reduce summarization for transcripts that do not fit in a single prompt.
+
+The transcript is split on token-budget boundaries and each chunk is condensed
+concurrently on a bounded, shared worker pool (the map step). The caller then
+combines the partial notes with a final prompt (the reduce step). If the
+combined notes are still over budget, they are chunked and condensed again.
+"""
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Rough average for English text; good enough for budgeting prompt sizes
+CHARS_PER_TOKEN = 4
+
+SENTENCE_ENDINGS = ('. ', '? ', '! ', '.\n', '?\n', '!\n')
+
+
+def estimate_tokens(text):
+    """Estimates the number of tokens in `text` (about four characters per token)."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def split_into_chunks(text, max_tokens):
+    """
+    Splits text into chunks of at most `max_tokens` estimated tokens.
+    Breaks at the last sentence ending in the second half of a window when there
+    is one, otherwise at the last space, and only mid-word as a last resort.
+    """
+    max_chars = max(1, max_tokens * CHARS_PER_TOKEN)
+    chunks = []
+    start = 0
+    length = len(text)
+
+    while start < length:
+        end = start + max_chars
+        if end >= length:
+            chunk = text[start:].strip()
+            if chunk:
+                chunks.append(chunk)
+            break
+
+        window = text[start:end]
+        cut = max(window.rfind(ending) for ending in SENTENCE_ENDINGS)
+        if cut >= max_chars // 2:
+            cut += 1  # Keep the punctuation with the sentence it ends
+        else:
+            cut = window.rfind(' ')
+            if cut <= 0:
+                cut = max_chars
+
+        chunk = text[start:start + cut].strip()
+        if chunk:
+            chunks.append(chunk)
+        start += cut
+
+    return chunks
+
+
+class MapReduceSummarizer:
+    """Runs chunked map-reduce summarization on a bounded worker pool."""
+
+    def __init__(self, chunk_tokens=3000, max_workers=2, max_levels=3, history_size=20):
+        self.chunk_tokens = chunk_tokens
+        self.max_workers = max_workers
+        self.max_levels = max_levels
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="chunk-summarizer")
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.failures = 0
+        self.chunks_processed = 0
+        self.recent_reports = deque(maxlen=history_size)
+
+    def needs_chunking(self, text):
+        return estimate_tokens(text) > self.chunk_tokens
+
+    def _map_level(self, text, map_fn, level, on_chunk_done=None):
+        chunks = split_into_chunks(text, self.chunk_tokens)
+        total = len(chunks)
+        completed = [0]
+        completed_lock = threading.Lock()
+
+        def run_chunk(index, chunk):
+            started = time.perf_counter()
+            partial = map_fn(chunk, index, total)
+            if on_chunk_done:
+                with completed_lock:
+                    completed[0] += 1
+                    done = completed[0]
+                on_chunk_done(done, total, level)
+            return partial, {
+                "level": level,
+                "chunk": index + 1,
+                "input_tokens": estimate_tokens(chunk),
+                "output_tokens": estimate_tokens(partial) if partial else 0,
+                "seconds": round(time.perf_counter() - started, 3),
+                "ok": partial is not None,
+            }
+
+        futures = [self._executor.submit(run_chunk, index, chunk)
+                   for index, chunk in enumerate(chunks)]
+        results = [future.result() for future in futures]
+        partials = [partial for partial, _ in results]
+        timings = [timing for _, timing in results]
+        return partials, timings
+
+    def condense(self, text, map_fn, on_chunk_done=None):
+        """
+        Runs the map step: condenses `text` into partial notes with
+        map_fn(chunk, index, total), repeating on the combined notes while they
+        are still over budget. Returns (partials, report); partials is None if
+        any chunk failed. The caller combines the notes in the reduce step.
+        on_chunk_done(completed, total, level) is called as chunks finish.
+        """
+        started = time.perf_counter()
+        report = {"input_tokens": estimate_tokens(text), "chunks": [], "levels": 0}
+
+        current = text
+        partials = None
+        for level in range(1, self.max_levels + 1):
+            partials, timings = self._map_level(
+                current, map_fn, level, on_chunk_done)
+            report["chunks"].extend(timings)
+            report["levels"] = level
+            if any(partial is None for partial in partials):
+                partials = None
+                break
+
+            combined = "\n\n".join(partials)
+            if not self.needs_chunking(combined) or len(partials) == 1:
+                break
+            # Notes are still too long for one reduce prompt, condense them again
+            current = combined
+
+        report["output_tokens"] = sum(
+            estimate_tokens(partial) for partial in partials) if partials else 0
+        report["total_seconds"] = round(time.perf_counter() - started, 3)
+        report["ok"] = partials is not None
+
+        with self._lock:
+            self.runs += 1
+            self.chunks_processed += len(report["chunks"])
+            if partials is None:
+                self.failures += 1
+            self.recent_reports.append(report)
+
+        return partials, report
+
+    def stats(self):
+        with self._lock:
+            return {
+                "chunk_tokens": self.chunk_tokens,
+                "max_workers": self.max_workers,
+                "runs": self.runs,
+                "failures": self.failures,
+                "chunks_processed": self.chunks_processed,
+                "recent_runs": list(self.recent_reports),
+            }
@@ -0,0 +1,5 @@
+"""Lets tests import the server modules, which live at the top level of server/."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -0,0 +1,141 @@
+"""
+Token-budgeted conversation history for chat prompts.
+
+Each chat model has a context budget (in tokens). A prompt gets as many of the
+most recent messages as fit in that budget after the fixed parts of the prompt
+and a reserve for the reply. Older messages are not simply dropped: once a
+session's unsummarized history no longer fits, the oldest messages are folded
+into a rolling summary in the background by a lighter model. The summary is
+cached on the session and goes at the top of later prompts, so every message is
+summarized only once.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from chunked_summarizer import estimate_tokens
+
+SUMMARY_HEADER = "Summary of the earlier conversation:\n"
+
+
+class ConversationContextManager:
+    """Fits chat history into per-model token budgets and maintains rolling summaries."""
+
+    def __init__(self, summarize_fn, default_budget=4096, budgets=None, reply_reserve=1024,
+                 keep_ratio=0.5, min_recent_messages=4):
+        # summarize_fn(previous_summary, rendered_messages) -> new summary text or None
+        self.summarize_fn = summarize_fn
+        self.default_budget = default_budget
+        self.budgets = dict(budgets or {})
+        self.reply_reserve = reply_reserve
+        # After a fold, recent history is trimmed to this share of the budget, so folds do not run every turn
+        self.keep_ratio = keep_ratio
+        self.min_recent_messages = min_recent_messages
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="history-summary")
+        self._lock = threading.Lock()
+        self.truncated_prompts = 0
+        self.dropped_messages = 0
+        self.folds = 0
+        self.folded_messages = 0
+        self.fold_failures = 0
+
+    def budget_for(self, model):
+        return self.budgets.get(model, self.default_budget)
+
+    def history_budget(self, model, fixed_text):
+        """Tokens left for history once the fixed prompt text and the reply reserve are accounted for."""
+        return max(0, self.budget_for(model) - self.reply_reserve - estimate_tokens(fixed_text))
+
+    def fits(self, model, context_tokens, new_text):
+        """Whether a reused Ollama context plus a new message still fits the model's budget."""
+        return context_tokens + estimate_tokens(new_text) + self.reply_reserve <= self.budget_for(model)
+
+    @staticmethod
+    def _fit_recent(messages, available):
+        """Returns how many of the newest messages fit in `available` tokens."""
+        used = 0
+        count = 0
+        for message in reversed(messages):
+            if used + message["tokens"] > available:
+                break
+            used += message["tokens"]
+            count += 1
+        return count
+
+    def render_history(self, messages, model, fixed_text):
+        """Renders the newest client-supplied messages that fit; used for stateless requests."""
+        kept = self._fit_recent(messages, self.history_budget(model, fixed_text))
+        self._record_truncation(len(messages) - kept)
+        return "".join(message["rendered"] for message in messages[len(messages) - kept:])
+
+    def render_session_history(self, session, model, fixed_text):
+        """
+        Renders the session's rolling summary and the newest messages that fit.
+        Schedules a fold when some messages did not fit.
+        """
+        summary, messages = session.history_snapshot()
+        summary_text = f"{SUMMARY_HEADER}{summary}\n\n" if summary else ""
+        available = self.history_budget(model, fixed_text + summary_text)
+        kept = self._fit_recent(messages, available)
+
+        if kept < len(messages):
+            self._record_truncation(len(messages) - kept)
+            self.schedule_fold(session, model)
+        return summary_text + "".join(message["rendered"] for message in messages[len(messages) - kept:])
+
+    def _record_truncation(self, dropped):
+        if dropped <= 0:
+            return
+        with self._lock:
+            self.truncated_prompts += 1
+            self.dropped_messages += dropped
+
+    def schedule_fold(self, session, model):
+        """Folds the session's oldest messages into its summary on the background worker."""
+        if session.fold_pending:
+            return
+        session.fold_pending = True
+        self._executor.submit(self._fold, session, model)
+
+    def _fold(self, session, model):
+        try:
+            summary, messages = session.history_snapshot()
+            keep_tokens = int(self.history_budget(model, "") * self.keep_ratio)
+            keep = max(self._fit_recent(messages, keep_tokens),
+                       min(self.min_recent_messages, len(messages)))
+            fold_count = len(messages) - keep
+            if fold_count <= 0:
+                return
+
+            folded = "".join(message["rendered"] for message in messages[:fold_count])
+            new_summary = self.summarize_fn(summary, folded)
+            if not new_summary:
+                with self._lock:
+                    self.fold_failures += 1
+                return
+
+            session.apply_summary(new_summary, fold_count)
+            with self._lock:
+                self.folds += 1
+                self.folded_messages += fold_count
+            print(
+                f"Folded {fold_count} messages of chat session {session.id} into its summary", flush=True)
+        except Exception as e:
+            print(f"Summarizing chat session {session.id} history failed: {e}", flush=True)
+            with self._lock:
+                self.fold_failures += 1
+        finally:
+            session.fold_pending = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "default_budget": self.default_budget,
+                "budgets": dict(self.budgets),
+                "reply_reserve": self.reply_reserve,
+                "truncated_prompts": self.truncated_prompts,
+                "dropped_messages": self.dropped_messages,
+                "folds": self.folds,
+                "folded_messages": self.folded_messages,
+                "fold_failures": self.fold_failures,
+            }
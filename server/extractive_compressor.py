@@ -0,0 +1,251 @@
+"""
+Extractive pre-compression for very long transcripts.
+
+Before a transcript far over the prompt budget goes through map-reduce, its
+most informative sentences can be picked out so the model reads a dense
+digest instead of raw captions. Sentences are scored with TF-IDF, either by
+similarity to the whole transcript (fast) or by TextRank over the sentence
+similarity graph (better at finding the central points). The top-ranked
+sentences are kept up to a token budget, in their original order, with
+[m:ss] markers so results can still cite timestamps.
+
+Scoring is vectorized in NumPy over sparse (sentence, term, weight) triplets.
+TextRank's power iteration multiplies by the similarity matrix as X (X^T v),
+so the sentence-by-sentence matrix is never built, and a three-hour
+transcript is scored in a fraction of a second. Optionally, a sentence too
+similar to one already kept is skipped, so repeated points do not crowd out
+the rest of the video.
+"""
+import re
+import threading
+import time
+
+import numpy as np
+
+from chunked_summarizer import estimate_tokens
+from transcript import format_timestamp
+
+METHODS = ("tfidf", "textrank")
+SENTENCE_PATTERN = re.compile(r"[^.!?]+(?:[.!?]+|$)")
+WORD_PATTERN = re.compile(r"\S+")
+TERM_PATTERN = re.compile(r"\w+")
+# Auto-generated captions may have no punctuation; longer runs are split into pseudo-sentences
+MAX_SENTENCE_WORDS = 40
+PSEUDO_SENTENCE_WORDS = 25
+STOP_WORDS = frozenset("""
+a about after again all also am an and any are as at be because been before being but by can
+could did do does doing don't down for from get got had has have having he her here hers him his
+how i i'm if in into is it it's its just know like me more most my no not now of off okay on once
+one only or other our out over really right so some such than that that's the their them then there
+these they this those through to too um uh up us very was we were what when where which while who
+why will with would yeah you your
+""".split())
+# Redundancy filtering only considers the top-ranked sentences worth this many token budgets
+CANDIDATE_POOL_BUDGETS = 3
+MIN_FILL_TOKENS = 8
+DIGEST_HEADER = "(Key sentences extracted from a long transcript, in their original order. Each [m:ss] marks where a passage starts.)\n\n"
+
+
+class ExtractiveCompressor:
+    """Selects the top-ranked sentences of a Transcript up to a token budget."""
+
+    def __init__(self, damping=0.85, iterations=50, tolerance=1e-6):
+        self.damping = damping
+        self.iterations = iterations
+        self.tolerance = tolerance
+        self._lock = threading.Lock()
+        self.runs = 0
+        self.total_ms = 0.0
+        self.tokens_in = 0
+        self.tokens_out = 0
+
+    def split_sentences(self, transcript):
+        """Returns [(start_seconds, sentence), ...] in order."""
+        text = transcript.text
+        sentences = []
+        for match in SENTENCE_PATTERN.finditer(text):
+            words = list(WORD_PATTERN.finditer(match.group()))
+            if not words:
+                continue
+            step = PSEUDO_SENTENCE_WORDS if len(words) > MAX_SENTENCE_WORDS else len(words)
+            for first in range(0, len(words), step):
+                piece = words[first:first + step]
+                offset = match.start() + piece[0].start()
+                sentence = match.group()[piece[0].start():piece[-1].end()]
+                sentences.append((transcript.start_at(offset), sentence))
+        return sentences
+
+    @staticmethod
+    def vectorize(sentences):
+        """
+        Returns (rows, columns, weights, terms): sparse TF-IDF triplets of the
+        sentences, sorted by row, with sublinear TF and L2-normalized rows.
+        """
+        count = len(sentences)
+        vocabulary = {}
+        rows = []
+        columns = []
+        for row, sentence in enumerate(sentences):
+            for term in TERM_PATTERN.findall(sentence.lower()):
+                if len(term) > 1 and term not in STOP_WORDS:
+                    rows.append(row)
+                    columns.append(vocabulary.setdefault(term, len(vocabulary)))
+        terms = len(vocabulary)
+        if not terms:
+            empty = np.zeros(0, dtype=np.int64)
+            return empty, empty, np.zeros(0), 0
+
+        keys, frequencies = np.unique(
+            np.asarray(rows, dtype=np.int64) * terms + np.asarray(columns, dtype=np.int64), return_counts=True)
+        rows, columns = keys // terms, keys % terms
+        document_frequency = np.bincount(columns, minlength=terms)
+        idf = np.log((1 + count) / (1 + document_frequency)) + 1
+        weights = (1 + np.log(frequencies)) * idf[columns]
+        norms = np.sqrt(np.bincount(rows, weights=weights * weights, minlength=count))
+        weights /= norms[rows]
+        return rows, columns, weights, terms
+
+    def score(self, count, rows, columns, weights, terms, method="textrank"):
+        """Returns one relevance score per sentence from vectorize() triplets."""
+        if not terms:
+            return np.zeros(count)
+
+        if method == "tfidf":
+            # Similarity of each sentence to the centroid of the whole transcript
+            centroid = np.bincount(columns, weights=weights, minlength=terms) / count
+            return np.bincount(rows, weights=weights * centroid[columns], minlength=count)
+
+        def similarity_times(vector):
+            # (X X^T - I) v over nonempty rows: cosine similarity to every other sentence
+            projected = np.bincount(columns, weights=weights * vector[rows], minlength=terms)
+            return np.bincount(rows, weights=weights * projected[columns], minlength=count) - nonempty * vector
+
+        nonempty = (np.bincount(rows, minlength=count) > 0).astype(np.float64)
+        degree = similarity_times(np.ones(count))
+        degree[degree <= 0] = 1.0
+        rank = np.full(count, 1.0 / count)
+        for _ in range(self.iterations):
+            updated = (1 - self.damping) / count + self.damping * similarity_times(rank / degree)
+            converged = np.abs(updated - rank).sum() < self.tolerance
+            rank = updated
+            if converged:
+                break
+        return rank
+
+    @staticmethod
+    def select(order, tokens, max_tokens, rows, columns, weights, redundancy_threshold):
+        """
+        Walks sentences from best to worst, keeping each one that fits the
+        remaining budget and whose cosine similarity to every kept sentence is
+        below `redundancy_threshold`. Near-duplicates are only used to fill
+        what is left of the budget. Returns the kept indexes in order.
+        """
+        if not len(order):
+            return order
+        # Only the best few budgets' worth of sentences are candidates, with their own vocabulary
+        pool = order[:np.searchsorted(np.cumsum(tokens[order]), CANDIDATE_POOL_BUDGETS * max_tokens) + 1]
+        bounds = np.searchsorted(rows, np.arange(len(tokens) + 1))
+        pool_columns = np.concatenate([columns[bounds[index]:bounds[index + 1]] for index in pool])
+        vocabulary, local_columns = np.unique(pool_columns, return_inverse=True)
+        capacity = min(len(pool), max(max_tokens, 0) // max(int(tokens.min()), 1) + 1)
+        kept_vectors = np.zeros((capacity, max(len(vocabulary), 1)), dtype=np.float32)
+
+        kept = []
+        remaining = max_tokens
+        position = 0
+        for index in pool:
+            size = bounds[index + 1] - bounds[index]
+            sentence_columns = local_columns[position:position + size]
+            sentence_weights = weights[bounds[index]:bounds[index + 1]]
+            position += size
+            if tokens[index] > remaining:
+                continue
+            if kept and size:
+                similarity = kept_vectors[:len(kept), sentence_columns] @ sentence_weights
+                if similarity.max() >= redundancy_threshold:
+                    continue
+            kept_vectors[len(kept), sentence_columns] = sentence_weights
+            kept.append(index)
+            remaining -= tokens[index]
+
+        # Budget left over after filtering goes to the best of the skipped sentences
+        chosen = np.zeros(len(tokens), dtype=bool)
+        chosen[kept] = True
+        for index in order:
+            if remaining < MIN_FILL_TOKENS:
+                break
+            if not chosen[index] and tokens[index] <= remaining:
+                kept.append(index)
+                remaining -= tokens[index]
+        return np.sort(np.asarray(kept, dtype=np.int64))
+
+    @staticmethod
+    def assemble(sentences, kept, timestamp_interval):
+        """Joins the kept sentences into the digest, starting a marked line for each passage."""
+        lines = []
+        previous = None
+        marker_time = None
+        for index in kept:
+            start, text = sentences[index]
+            if previous is None or index != previous + 1 or start - marker_time >= timestamp_interval:
+                lines.append(f"[{format_timestamp(start)}] {text}")
+                marker_time = start
+            else:
+                lines[-1] += f" {text}"
+            previous = index
+        return DIGEST_HEADER + "\n".join(lines)
+
+    def compress(self, transcript, max_tokens, method="textrank", redundancy_threshold=None, timestamp_interval=30):
+        """
+        Returns (digest, report): the top-ranked sentences of `transcript` that
+        fit in `max_tokens`, in order, with a [m:ss] marker at the start of each
+        passage and at least every `timestamp_interval` seconds within one.
+        The whole digest, markers included, stays within `max_tokens`. With a
+        `redundancy_threshold`, near-duplicates of kept sentences are skipped.
+        """
+        started = time.perf_counter()
+        sentences = self.split_sentences(transcript)
+        texts = [sentence for _, sentence in sentences]
+        tokens = np.fromiter((estimate_tokens(text) + 1 for text in texts), dtype=np.int64, count=len(texts))
+
+        rows, columns, weights, terms = self.vectorize(texts)
+        scores = self.score(len(texts), rows, columns, weights, terms, method)
+        order = np.argsort(-scores, kind="stable")
+
+        # Markers and the header also take tokens, so the selection budget shrinks until the digest fits
+        budget = max_tokens - estimate_tokens(DIGEST_HEADER)
+        while True:
+            if redundancy_threshold is None:
+                kept = np.sort(order[np.cumsum(tokens[order]) <= budget])
+            else:
+                kept = self.select(order, tokens, budget, rows, columns, weights, redundancy_threshold)
+            digest = self.assemble(sentences, kept, timestamp_interval)
+            overflow = estimate_tokens(digest) - max_tokens
+            if overflow <= 0 or budget <= 0:
+                break
+            budget -= overflow
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        report = {
+            "method": method,
+            "sentences": len(sentences),
+            "kept_sentences": len(kept),
+            "tokens_before": int(tokens.sum()),
+            "tokens_after": estimate_tokens(digest),
+            "milliseconds": round(elapsed_ms, 1),
+        }
+        with self._lock:
+            self.runs += 1
+            self.total_ms += elapsed_ms
+            self.tokens_in += report["tokens_before"]
+            self.tokens_out += report["tokens_after"]
+        return digest, report
+
+    def stats(self):
+        with self._lock:
+            return {
+                "runs": self.runs,
+                "avg_ms": round(self.total_ms / self.runs, 1) if self.runs else None,
+                "tokens_in": self.tokens_in,
+                "tokens_out": self.tokens_out,
+            }
@@ -0,0 +1,229 @@
+"""
+Image preprocessing for vision requests.
+
+Clients send images as full-resolution base64 data URLs; a phone screenshot is
+several megabytes, while a vision encoder only looks at a few hundred pixels
+per side (LLaVA 1.5 uses 336x336 and LLaVA 1.6 tiles up to 672x672). Each image
+is decoded once, downscaled to the target model's input resolution, re-encoded
+as JPEG and cached by a hash of its content, so a follow-up question about the
+same image skips all of it. JPEGs are decoded at reduced scale when the target
+is much smaller than the original, which is far cheaper than a full decode.
+
+Images arrive either as base64 strings from JSON requests or as binary
+uploads (see image_uploads.py), which expose `mime_type`, `sha256` and
+`read()`; uploads are only base64-encoded after processing.
+
+Pillow is optional. Without it, images are passed through unchanged.
+"""
+import base64
+import binascii
+import hashlib
+import io
+import threading
+import time
+from collections import OrderedDict
+
+STAGES = ("decode", "resize", "encode")
+# Formats every vision backend accepts, so a small enough original can be sent as is
+PASSTHROUGH_FORMATS = {"JPEG": "image/jpeg", "PNG": "image/png"}
+
+
+class ImageRejectedError(Exception):
+    """Raised for an image that must not reach a vision model, such as a decompression bomb."""
+
+
+def split_data_url(image_data):
+    """Returns (mime_type, base64_data) for a data URL or bare base64 string."""
+    if image_data.startswith("data:"):
+        header, _, data = image_data.partition(",")
+        return header[5:].split(";", 1)[0] or None, data
+    return None, image_data
+
+
+def image_hash(image_data):
+    """
+    Returns a stable hex digest for an image: the upload's SHA-256, or the hash
+    of the base64 content of a data URL or bare base64 string.
+    """
+    if not isinstance(image_data, str):
+        return image_data.sha256
+    _, data = split_data_url(image_data)
+    return hashlib.sha256(data.encode("ascii", "ignore")).hexdigest()
+
+
+class ImagePreprocessor:
+    """Downscales and re-encodes images for vision models, with an in-memory LRU cache."""
+
+    def __init__(self, default_max_side=672, max_sides=None, quality=85,
+                 cache_max_bytes=64 * 1024 * 1024, cache_max_entries=256):
+        self.default_max_side = default_max_side
+        self.max_sides = dict(max_sides or {})
+        self.quality = quality
+        self.cache_max_bytes = cache_max_bytes
+        self.cache_max_entries = cache_max_entries
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cache_bytes = 0
+        self._pillow = None
+        self.images = 0
+        self.hits = 0
+        self.misses = 0
+        self.processed = 0
+        self.resized = 0
+        self.passthrough = 0
+        self.failures = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._stage_ms = {stage: 0.0 for stage in STAGES}
+
+    def max_side_for(self, model):
+        return self.max_sides.get(model, self.default_max_side)
+
+    def _load_pillow(self):
+        if self._pillow is None:
+            try:
+                from PIL import Image, ImageOps
+                self._pillow = (Image, ImageOps)
+            except ImportError:
+                print("Pillow is not installed; images are sent to vision models unprocessed", flush=True)
+                self._pillow = False
+        return self._pillow
+
+    def process(self, image_data, model):
+        """
+        Returns (mime_type, base64_data) for an image (data URL, bare base64 or
+        upload) prepared for `model`. Images that cannot be decoded are returned
+        as received. Raises ImageRejectedError for images whose pixel count is
+        over Pillow's decompression bomb limit.
+        """
+        if isinstance(image_data, str):
+            mime_type, data = split_data_url(image_data)
+            load_raw = lambda: base64.b64decode(data, validate=False)
+            original = lambda: data
+        else:
+            mime_type = image_data.mime_type
+            load_raw = image_data.read
+            original = lambda: base64.b64encode(image_data.read()).decode("ascii")
+        max_side = self.max_side_for(model)
+        key = (image_hash(image_data), max_side, self.quality)
+
+        with self._lock:
+            self.images += 1
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        pillow = self._load_pillow()
+        if not pillow:
+            return mime_type, original()
+        Image, _ = pillow
+        try:
+            result, raw_size, timings = self._transform(pillow, load_raw, original, max_side)
+        except Image.DecompressionBombError as e:
+            # A few kilobytes can declare gigapixels; sending it on would only move the problem
+            with self._lock:
+                self.failures += 1
+            raise ImageRejectedError(f"The image is too large to process: {e}") from e
+        except (binascii.Error, ValueError, OSError) as e:
+            # Includes Pillow's UnidentifiedImageError
+            print(f"Preprocessing image failed; sending it unprocessed: {e}", flush=True)
+            with self._lock:
+                self.failures += 1
+            return mime_type, original()
+
+        self._store(key, result, raw_size, timings)
+        return result
+
+    def _transform(self, pillow, load_raw, original, max_side):
+        Image, ImageOps = pillow
+        timings = {}
+
+        started = time.perf_counter()
+        raw = load_raw()
+        image = Image.open(io.BytesIO(raw))
+        original_format = image.format
+        original_size = image.size
+        # JPEGs can be decoded at 1/2, 1/4 or 1/8 scale; draft picks the smallest that still covers the target
+        image.draft("RGB", (max_side, max_side))
+        image.load()
+        timings["decode"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        # Phone photos are stored sideways with an EXIF rotation tag
+        image = ImageOps.exif_transpose(image)
+        needs_resize = max(original_size) > max_side
+        if needs_resize:
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+        if image.mode != "RGB":
+            # JPEG has no alpha channel; flatten transparency onto white
+            rgba = image.convert("RGBA")
+            image = Image.new("RGB", rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel("A"))
+        timings["resize"] = time.perf_counter() - started
+
+        started = time.perf_counter()
+        buffer = io.BytesIO()
+        image.save(buffer, "JPEG", quality=self.quality, optimize=True)
+        encoded = buffer.getvalue()
+        passthrough = not needs_resize and original_format in PASSTHROUGH_FORMATS and len(raw) <= len(encoded)
+        if passthrough:
+            # Already small; re-encoding would only cost quality
+            result = (PASSTHROUGH_FORMATS[original_format], original())
+            output_size = len(raw)
+        else:
+            result = ("image/jpeg", base64.b64encode(encoded).decode("ascii"))
+            output_size = len(encoded)
+        timings["encode"] = time.perf_counter() - started
+
+        timings["resized"] = needs_resize
+        timings["passthrough"] = passthrough
+        timings["output_size"] = output_size
+        return result, len(raw), timings
+
+    def _store(self, key, result, raw_size, timings):
+        entry_bytes = len(result[1])
+        with self._lock:
+            self.processed += 1
+            self.bytes_in += raw_size
+            self.bytes_out += timings["output_size"]
+            if timings["resized"]:
+                self.resized += 1
+            elif timings["passthrough"]:
+                self.passthrough += 1
+            for stage in STAGES:
+                self._stage_ms[stage] += timings[stage] * 1000
+
+            if key not in self._cache and entry_bytes <= self.cache_max_bytes:
+                self._cache[key] = result
+                self._cache_bytes += entry_bytes
+                while len(self._cache) > self.cache_max_entries or self._cache_bytes > self.cache_max_bytes:
+                    _, evicted = self._cache.popitem(last=False)
+                    self._cache_bytes -= len(evicted[1])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pillow_available": bool(self._pillow) if self._pillow is not None else None,
+                "default_max_side": self.default_max_side,
+                "max_sides": dict(self.max_sides),
+                "quality": self.quality,
+                "images": self.images,
+                "processed": self.processed,
+                "cache_hits": self.hits,
+                "cache_misses": self.misses,
+                "cache_entries": len(self._cache),
+                "cache_bytes": self._cache_bytes,
+                "resized": self.resized,
+                "passthrough": self.passthrough,
+                "failures": self.failures,
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "bytes_saved": self.bytes_in - self.bytes_out,
+                "avg_stage_ms": {
+                    stage: round(total / self.processed, 2) if self.processed else None
+                    for stage, total in self._stage_ms.items()
+                },
+            }
@@ -0,0 +1,192 @@
+"""
+Binary image uploads for the chat API.
+
+Sending images as base64 inside a JSON body makes them a third larger, and the
+whole body has to be parsed into memory before the request is handled.
+Instead, clients can upload raw image bytes (a binary body or multipart form
+files) once and refer to them by ID in chat messages. Each upload is copied in
+fixed-size blocks into a spool that stays in memory up to a threshold and
+moves to a temporary file above it, while its size is checked against the
+limit and its SHA-256 is computed. Uploads expire after a TTL, and the oldest
+are dropped when the store holds more than its byte limit. A dropped upload
+stays readable for requests that already hold it; its spool is closed once the
+last of them lets go of it.
+"""
+import hashlib
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+from collections import OrderedDict
+
+READ_BLOCK_SIZE = 64 * 1024
+
+
+class ImageUploadError(Exception):
+    """Raised when an upload is rejected; carries the HTTP status code to return."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+
+
+class ImageUploadNotFoundError(Exception):
+    """Raised when an image ID is unknown or the upload has expired."""
+
+
+class UploadedImage:
+    """A spooled image upload. The vision pipeline reads it with `read()`."""
+
+    def __init__(self, image_id, spool, size, sha256, mime_type):
+        self.id = image_id
+        self.size = size
+        self.sha256 = sha256
+        self.mime_type = mime_type
+        self.created_at = time.time()
+        self._spool = spool
+        self._lock = threading.Lock()
+        # Closes the spool when the last reference to the upload is dropped
+        self._finalizer = weakref.finalize(self, spool.close)
+
+    def read(self):
+        with self._lock:
+            if self._spool.closed:
+                raise ImageUploadNotFoundError(f"Image {self.id} not found or expired.")
+            self._spool.seek(0)
+            return self._spool.read()
+
+    def close(self):
+        with self._lock:
+            self._finalizer()
+
+    def to_dict(self):
+        return {
+            "image_id": self.id,
+            "size": self.size,
+            "mime_type": self.mime_type,
+            "sha256": self.sha256,
+        }
+
+
+class ImageUploadStore:
+    """Spooled image uploads addressed by ID, with a TTL and a total byte limit."""
+
+    def __init__(self, spool_memory_bytes=1024 * 1024, max_image_bytes=20 * 1024 * 1024,
+                 max_total_bytes=256 * 1024 * 1024, ttl_seconds=1800):
+        self.spool_memory_bytes = spool_memory_bytes
+        self.max_image_bytes = max_image_bytes
+        self.max_total_bytes = max_total_bytes
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._uploads = OrderedDict()
+        self._total_bytes = 0
+        self.uploaded = 0
+        self.rejected = 0
+        self.expired = 0
+        self.evicted = 0
+        self.spilled_to_disk = 0
+
+    def add(self, stream, mime_type):
+        """
+        Copies an image from a file-like `stream` into a spool and returns the
+        UploadedImage. Raises ImageUploadError if it is not an image or is too large.
+        """
+        mime_type = (mime_type or "").split(";", 1)[0].strip().lower()
+        if not mime_type.startswith("image/"):
+            self._record_rejection()
+            raise ImageUploadError(f"Unsupported content type '{mime_type or 'none'}'; expected an image", 415)
+
+        spool = tempfile.SpooledTemporaryFile(max_size=self.spool_memory_bytes)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            while True:
+                block = stream.read(READ_BLOCK_SIZE)
+                if not block:
+                    break
+                size += len(block)
+                if size > self.max_image_bytes:
+                    raise ImageUploadError(
+                        f"Images may be at most {self.max_image_bytes} bytes", 413)
+                digest.update(block)
+                spool.write(block)
+        except ImageUploadError:
+            spool.close()
+            self._record_rejection()
+            raise
+        except BaseException:
+            # The request body failed or exceeded the request limit mid-copy
+            spool.close()
+            raise
+        if not size:
+            spool.close()
+            self._record_rejection()
+            raise ImageUploadError("The uploaded image is empty")
+
+        upload = UploadedImage(uuid.uuid4().hex, spool, size, digest.hexdigest(), mime_type)
+        with self._lock:
+            self._expire_locked(time.time())
+            self._uploads[upload.id] = upload
+            self._total_bytes += size
+            self.uploaded += 1
+            if size > self.spool_memory_bytes:
+                self.spilled_to_disk += 1
+            while self._total_bytes > self.max_total_bytes and len(self._uploads) > 1:
+                self._remove_locked(next(iter(self._uploads)))
+                self.evicted += 1
+        return upload
+
+    def get(self, image_id):
+        """Returns the upload, or raises ImageUploadNotFoundError."""
+        with self._lock:
+            self._expire_locked(time.time())
+            upload = self._uploads.get(image_id)
+            if upload is None:
+                raise ImageUploadNotFoundError(f"Image {image_id} not found or expired.")
+            return upload
+
+    def delete(self, image_id):
+        with self._lock:
+            if image_id not in self._uploads:
+                return False
+            self._remove_locked(image_id)
+            return True
+
+    def _record_rejection(self):
+        with self._lock:
+            self.rejected += 1
+
+    def _remove_locked(self, image_id):
+        # Not closed here: a request that got the upload before it expired or
+        # was evicted may still be reading it
+        upload = self._uploads.pop(image_id)
+        self._total_bytes -= upload.size
+
+    def _expire_locked(self, now):
+        cutoff = now - self.ttl_seconds
+        # Uploads are kept in creation order
+        while self._uploads:
+            image_id, upload = next(iter(self._uploads.items()))
+            if upload.created_at >= cutoff:
+                break
+            self._remove_locked(image_id)
+            self.expired += 1
+
+    def stats(self):
+        with self._lock:
+            self._expire_locked(time.time())
+            return {
+                "entries": len(self._uploads),
+                "bytes": self._total_bytes,
+                "max_bytes": self.max_total_bytes,
+                "max_image_bytes": self.max_image_bytes,
+                "spool_memory_bytes": self.spool_memory_bytes,
+                "ttl_seconds": self.ttl_seconds,
+                "uploaded": self.uploaded,
+                "rejected": self.rejected,
+                "expired": self.expired,
+                "evicted": self.evicted,
+                "spilled_to_disk": self.spilled_to_disk,
+            }
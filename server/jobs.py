@@ -0,0 +1,164 @@
+"""
+Asynchronous job queue for long-running LLM work.
+
+Jobs are submitted with a work function and run on a bounded worker pool, so
+the number of concurrent LLM generations is independent of the number of
+HTTP request threads. Clients poll a job for its status, progress and result.
+Finished jobs are kept for a configurable retention period and then dropped.
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class JobQueueFullError(Exception):
+    """Raised when the number of unfinished jobs has reached the queue limit."""
+
+
+class Job:
+    """State of a single submitted job."""
+
+    def __init__(self, job_type, params):
+        self.id = uuid.uuid4().hex
+        self.type = job_type
+        self.params = params
+        self.status = QUEUED
+        self.stage = QUEUED
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.error_status = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "type": self.type,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": dict(self.progress),
+            "result": self.result,
+            "error": self.error,
+            "error_status": self.error_status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """Runs jobs on a bounded worker pool and retains their results for a while."""
+
+    def __init__(self, max_workers=2, max_pending=100, retention_seconds=3600):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="job-worker")
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self.submitted = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def submit(self, job_type, work, params=None):
+        """
+        Queues work(job, report_progress) and returns the new Job.
+        The work function returns the job result or raises to fail the job.
+        Raises JobQueueFullError if too many jobs are already queued or running.
+        """
+        self._purge_expired()
+        job = Job(job_type, params or {})
+
+        with self._lock:
+            unfinished = sum(1 for existing in self._jobs.values()
+                             if existing.status in (QUEUED, RUNNING))
+            if unfinished >= self.max_pending:
+                self.rejected += 1
+                raise JobQueueFullError(
+                    f"Job queue is full ({unfinished} jobs pending).")
+            self._jobs[job.id] = job
+            self.submitted += 1
+
+        self._executor.submit(self._run, job, work)
+        return job
+
+    def _run(self, job, work):
+        def report_progress(stage, details=None):
+            with self._lock:
+                job.stage = stage
+                if details:
+                    job.progress.update(details)
+
+        with self._lock:
+            job.status = RUNNING
+            job.stage = RUNNING
+            job.started_at = time.time()
+
+        try:
+            result = work(job, report_progress)
+        except Exception as e:
+            print(f"Job {job.id} ({job.type}) failed: {e}", flush=True)
+            with self._lock:
+                job.status = FAILED
+                job.stage = FAILED
+                job.error = getattr(e, "message", None) or str(e)
+                job.error_status = getattr(e, "status_code", 500)
+                job.finished_at = time.time()
+                self.failed += 1
+            return
+
+        with self._lock:
+            job.status = SUCCEEDED
+            job.stage = SUCCEEDED
+            job.result = result
+            job.finished_at = time.time()
+            self.succeeded += 1
+
+    def get(self, job_id):
+        """Returns a snapshot dict of the job, or None if unknown or expired."""
+        self._purge_expired()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            snapshot = job.to_dict()
+            if job.status == QUEUED:
+                snapshot["queue_position"] = sum(
+                    1 for other in self._jobs.values()
+                    if other.status == QUEUED and other.created_at <= job.created_at)
+            return snapshot
+
+    def _purge_expired(self):
+        cutoff = time.time() - self.retention_seconds
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.finished_at is not None and job.finished_at < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
+
+    def stats(self):
+        with self._lock:
+            queued = sum(1 for job in self._jobs.values() if job.status == QUEUED)
+            running = sum(1 for job in self._jobs.values() if job.status == RUNNING)
+            return {
+                "max_workers": self.max_workers,
+                "max_pending": self.max_pending,
+                "retention_seconds": self.retention_seconds,
+                "queued": queued,
+                "running": running,
+                "retained": len(self._jobs),
+                "submitted": self.submitted,
+                "succeeded": self.succeeded,
+                "failed": self.failed,
+                "rejected": self.rejected,
+            }
@@ -0,0 +1,511 @@
+"""
+Shared LLM client layer for Ollama and OpenAI.
+
+Every model call in the server goes through these clients instead of building
+its own connection:
+
+- OllamaClient: pooled keep-alive `requests.Session` for the Flask app
+- AsyncOllamaClient: pooled `httpx.AsyncClient` for the ASGI app
+- OpenAIClient: one shared OpenAI SDK client for the cloud fallback
+
+Each call has a deadline that bounds all attempts together. Connection
+errors, timeouts and 5xx responses are retried with exponential backoff and
+full jitter while the deadline allows. A circuit breaker per backend makes
+calls fail fast while the backend is down, so requests do not hang for
+minutes against a dead Ollama.
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRYABLE_STATUS_CODES = (502, 503, 504)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised without touching the network while a backend's circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds. It then lets a single trial call through
+    (half-open): success closes it again, failure re-opens it. Every call
+    that allow() lets through must end in record_success, record_failure or
+    record_abandoned, or a half-open breaker waits for its trial forever.
+    """
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_progress = False
+        self.rejected = 0
+        self.times_opened = 0
+
+    def allow(self):
+        """Returns True if a call may proceed now."""
+        with self._lock:
+            if self._state == OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    return False
+                self._state = HALF_OPEN
+                self._trial_in_progress = False
+
+            if self._state == HALF_OPEN:
+                if self._trial_in_progress:
+                    self.rejected += 1
+                    return False
+                self._trial_in_progress = True
+            return True
+
+    def check(self):
+        if not self.allow():
+            raise CircuitOpenError(
+                f"{self.name} circuit is open after repeated failures; failing fast.")
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self._record_failure_locked()
+
+    def record_abandoned(self):
+        """
+        Ends a call that stopped without a verdict: it timed out reading a
+        slow reply, was cancelled, or failed with an error the callers do not
+        retry. It is not counted while the breaker is closed, but a half-open
+        trial counts as failed.
+        """
+        with self._lock:
+            if self._state == HALF_OPEN and self._trial_in_progress:
+                self._record_failure_locked()
+
+    def _record_failure_locked(self):
+        self._failures += 1
+        self._trial_in_progress = False
+        if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+            if self._state != OPEN:
+                self.times_opened += 1
+                print(
+                    f"{self.name} circuit opened after {self._failures} failures.", flush=True)
+            self._state = OPEN
+            self._opened_at = time.monotonic()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def stats(self):
+        state = self.state
+        with self._lock:
+            return {
+                "state": state,
+                "consecutive_failures": self._failures,
+                "times_opened": self.times_opened,
+                "rejected": self.rejected,
+            }
+
+
+def backoff_delay(attempt, base, cap):
+    """Exponential backoff with full jitter for retry number `attempt` (starting at 1)."""
+    return random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+
+
+class OllamaClient:
+    """Pooled, retrying, circuit-breaking client for the Ollama HTTP API."""
+
+    def __init__(self, base_url="http://localhost:11434", pool_size=20, max_retries=2,
+                 backoff_base=0.5, backoff_max=5.0, connect_timeout=10, breaker=None):
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.connect_timeout = connect_timeout
+        self.breaker = breaker or CircuitBreaker("ollama")
+
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size,
+                              pool_maxsize=pool_size, pool_block=False)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+
+    def url(self, path):
+        return f"{self.base_url}{path}"
+
+    def request(self, method, path, payload=None, deadline=300, stream=False):
+        """
+        Sends a request and returns the requests.Response (the caller checks the
+        status). Retries connection errors, timeouts and 502/503/504 with
+        jittered backoff until `deadline` seconds have passed in total.
+        """
+        self.breaker.check()
+        deadline_at = time.monotonic() + deadline
+        attempt = 0
+
+        with self._lock:
+            self.requests += 1
+
+        try:
+            while True:
+                attempt += 1
+                remaining = deadline_at - time.monotonic()
+                if remaining <= 0:
+                    self.breaker.record_failure()
+                    raise requests.exceptions.Timeout(
+                        f"Deadline of {deadline}s exceeded calling {path}")
+
+                try:
+                    response = self._session.request(
+                        method, self.url(path), json=payload, stream=stream,
+                        timeout=(min(self.connect_timeout, remaining), remaining))
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    error = e
+                    response = None
+                else:
+                    if response.status_code not in RETRYABLE_STATUS_CODES:
+                        self.breaker.record_success()
+                        return response
+                    error = None
+
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_max)
+                can_retry = attempt <= self.max_retries and time.monotonic() + delay < deadline_at
+                # A read timeout means the model was working; retrying would only double the wait
+                if isinstance(error, requests.exceptions.ReadTimeout):
+                    can_retry = False
+
+                if not can_retry:
+                    if isinstance(error, requests.exceptions.ReadTimeout):
+                        # A slow generation is not a sign the backend is down
+                        self.breaker.record_abandoned()
+                    else:
+                        self.breaker.record_failure()
+                    with self._lock:
+                        self.failures += 1
+                    if error is not None:
+                        raise error
+                    return response
+
+                if response is not None:
+                    response.close()
+                with self._lock:
+                    self.retries += 1
+                print(
+                    f"Retrying Ollama {path} in {delay:.2f}s (attempt {attempt + 1}): "
+                    f"{error or response.status_code}", flush=True)
+                time.sleep(delay)
+        except BaseException:
+            # Cancellations and unexpected errors still settle a half-open trial
+            self.breaker.record_abandoned()
+            raise
+
+    def post(self, path, payload, deadline=300, stream=False):
+        return self.request("POST", path, payload=payload, deadline=deadline, stream=stream)
+
+    def get(self, path, deadline=10):
+        return self.request("GET", path, deadline=deadline)
+
+    def stream_lines(self, path, payload, deadline=300):
+        """
+        POSTs a streaming request and yields each decoded NDJSON object.
+        Raises requests.exceptions.Timeout if the deadline passes mid-stream.
+        """
+        deadline_at = time.monotonic() + deadline
+        with self.post(path, payload, deadline=deadline, stream=True) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if time.monotonic() > deadline_at:
+                    raise requests.exceptions.Timeout(
+                        f"Deadline of {deadline}s exceeded while streaming {path}")
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line.decode('utf-8'))
+                except json.JSONDecodeError:
+                    continue
+
+    def stats(self):
+        with self._lock:
+            return {
+                "base_url": self.base_url,
+                "pool_size": self.pool_size,
+                "requests": self.requests,
+                "retries": self.retries,
+                "failures": self.failures,
+                "circuit": self.breaker.stats(),
+            }
+
+
+class AsyncOllamaClient:
+    """
+    Async counterpart of OllamaClient for the ASGI app, built on one shared
+    httpx.AsyncClient. Raises httpx errors; an open circuit is raised as
+    httpx.ConnectError so callers map it like an unreachable backend.
+    """
+
+    def __init__(self, base_url="http://localhost:11434", max_connections=200, max_retries=2,
+                 backoff_base=0.5, backoff_max=5.0, connect_timeout=10, breaker=None):
+        self.base_url = base_url.rstrip('/')
+        self.max_connections = max_connections
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.connect_timeout = connect_timeout
+        self.breaker = breaker or CircuitBreaker("ollama")
+        self.in_flight = 0
+        self.retries = 0
+        self._client = None
+
+    def url(self, path):
+        return f"{self.base_url}{path}"
+
+    def _get_client(self):
+        import httpx
+
+        # Created lazily so the client binds to the server's running event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections))
+        return self._client
+
+    def _check_breaker(self):
+        import httpx
+
+        if not self.breaker.allow():
+            raise httpx.ConnectError(
+                f"{self.breaker.name} circuit is open after repeated failures; failing fast.")
+
+    async def _send(self, path, payload, deadline, stream):
+        import httpx
+
+        self._check_breaker()
+        client = self._get_client()
+        deadline_at = time.monotonic() + deadline
+        attempt = 0
+
+        try:
+            while True:
+                attempt += 1
+                remaining = deadline_at - time.monotonic()
+                timeout = httpx.Timeout(
+                    max(remaining, 0.001), connect=min(self.connect_timeout, max(remaining, 0.001)))
+                request = client.build_request(
+                    "POST", self.url(path), json=payload, timeout=timeout)
+                try:
+                    response = await client.send(request, stream=stream)
+                except (httpx.ConnectError, httpx.ConnectTimeout, httpx.ReadTimeout) as e:
+                    error = e
+                    response = None
+                else:
+                    if response.status_code not in RETRYABLE_STATUS_CODES:
+                        self.breaker.record_success()
+                        return response
+                    error = None
+
+                delay = backoff_delay(attempt, self.backoff_base, self.backoff_max)
+                can_retry = (attempt <= self.max_retries
+                             and time.monotonic() + delay < deadline_at
+                             and not isinstance(error, httpx.ReadTimeout))
+                if not can_retry:
+                    if isinstance(error, httpx.ReadTimeout):
+                        # A slow generation is not a sign the backend is down
+                        self.breaker.record_abandoned()
+                    else:
+                        self.breaker.record_failure()
+                    if error is not None:
+                        raise error
+                    return response
+
+                if response is not None:
+                    await response.aclose()
+                self.retries += 1
+                await asyncio.sleep(delay)
+        except BaseException:
+            # Cancellations and unexpected errors still settle a half-open trial
+            self.breaker.record_abandoned()
+            raise
+
+    async def generate_json(self, payload, deadline=300):
+        """Posts a non-streaming /api/generate payload and returns the decoded response body."""
+        self.in_flight += 1
+        try:
+            response = await self._send("/api/generate", payload, deadline, stream=False)
+        finally:
+            self.in_flight -= 1
+
+        print(f"Ollama API response status code: {response.status_code}")
+        response.raise_for_status()
+        return response.json()
+
+    async def generate(self, model_name, prompt, deadline=300, keep_alive=None):
+        """Runs a non-streaming generation and returns the stripped response text (or None if empty)."""
+        payload = {"model": model_name, "prompt": prompt, "stream": False}
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        content = (await self.generate_json(payload, deadline)).get("response")
+        if content:
+            print(f"Successfully got content from {model_name}.")
+            return content.strip()
+        print("Ollama API response did not contain content.")
+        return None
+
+    async def stream(self, model_name, prompt, deadline=300, keep_alive=None):
+        """
+        Streams a generation. Yields {"chunk": text} events and finally a
+        metadata dict with the model, token counts and durations.
+        """
+        payload = {"model": model_name, "prompt": prompt, "stream": True}
+        if keep_alive is not None:
+            payload["keep_alive"] = keep_alive
+        self.in_flight += 1
+        try:
+            response = await self._send("/api/generate", payload, deadline, stream=True)
+            try:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    try:
+                        chunk_data = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+
+                    if chunk_data.get('response'):
+                        yield {"chunk": chunk_data['response']}
+
+                    if chunk_data.get('done', False):
+                        yield ollama_stream_metadata(chunk_data, model_name)
+                        return
+            finally:
+                await response.aclose()
+        finally:
+            self.in_flight -= 1
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self):
+        return {
+            "base_url": self.base_url,
+            "in_flight": self.in_flight,
+            "max_connections": self.max_connections,
+            "retries": self.retries,
+            "circuit": self.breaker.stats(),
+        }
+
+
+def ollama_stream_metadata(chunk_data, model_name):
+    """Extracts model, token counts and durations (nanoseconds) from Ollama's final chunk."""
+    return {
+        "model": chunk_data.get("model", model_name),
+        "prompt_eval_count": chunk_data.get("prompt_eval_count"),
+        "eval_count": chunk_data.get("eval_count"),
+        "total_duration": chunk_data.get("total_duration"),
+        "load_duration": chunk_data.get("load_duration"),
+        "prompt_eval_duration": chunk_data.get("prompt_eval_duration"),
+        "eval_duration": chunk_data.get("eval_duration"),
+    }
+
+
+class OpenAIClient:
+    """
+    One shared OpenAI SDK client (it pools its own connections), guarded by a
+    circuit breaker. The SDK is imported lazily so it stays optional.
+    """
+
+    def __init__(self, api_key, timeout=120, max_retries=2, breaker=None):
+        self.api_key = api_key
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.breaker = breaker or CircuitBreaker("openai")
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def configured(self):
+        return bool(self.api_key)
+
+    def _get_client(self):
+        with self._lock:
+            if self._client is None:
+                from openai import OpenAI
+
+                self._client = OpenAI(
+                    api_key=self.api_key, timeout=self.timeout, max_retries=self.max_retries)
+            return self._client
+
+    def chat(self, model, messages, max_tokens=None, deadline=None):
+        """Returns the text of a chat completion; raises on failure or open circuit."""
+        self.breaker.check()
+        options = {"model": model, "messages": messages}
+        if max_tokens:
+            options["max_tokens"] = max_tokens
+        if deadline:
+            options["timeout"] = deadline
+
+        try:
+            response = self._get_client().chat.completions.create(**options)
+        except BaseException as e:
+            self._record_error(e)
+            raise
+        self.breaker.record_success()
+        return response.choices[0].message.content
+
+    def _record_error(self, error):
+        """
+        Counts connection errors and 5xx responses against the breaker.
+        Timeouts, cancellations and other errors only settle a half-open
+        trial; a 4xx response shows the API is reachable.
+        """
+        try:
+            import openai
+        except ImportError:
+            self.breaker.record_abandoned()
+            return
+        if isinstance(error, openai.APITimeoutError):
+            self.breaker.record_abandoned()
+        elif isinstance(error, openai.APIConnectionError):
+            self.breaker.record_failure()
+        elif isinstance(error, openai.APIStatusError):
+            if error.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+        else:
+            self.breaker.record_abandoned()
+
+    def stats(self):
+        return {
+            "configured": self.configured,
+            "circuit": self.breaker.stats(),
+        }
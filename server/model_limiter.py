@@ -0,0 +1,80 @@
+"""
+Per-model concurrency limits for LLM generations.
+
+Each model gets a semaphore sized from a configurable limit, so a batch of
+hundreds of videos cannot flood Ollama with parallel generations for one
+model. Active and waiting counts per model are tracked for metrics.
+"""
+import threading
+from contextlib import contextmanager
+
+
+def parse_model_settings(spec):
+    """Parses "model=value,model=value" (model names may contain ':') into a dict of strings."""
+    settings = {}
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        model, value = item.rsplit("=", 1)
+        if model.strip() and value.strip():
+            settings[model.strip()] = value.strip()
+    return settings
+
+
+def parse_model_limits(spec):
+    """Parses "model=limit,model=limit" into a dict of positive integers."""
+    return {model: max(1, int(limit))
+            for model, limit in parse_model_settings(spec).items() if limit.isdigit()}
+
+
+class ModelConcurrencyLimiter:
+    """Bounds the number of concurrent generations per model."""
+
+    def __init__(self, default_limit=1, limits=None):
+        self.default_limit = default_limit
+        self.limits = dict(limits or {})
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._active = {}
+        self._waiting = {}
+
+    def limit_for(self, model):
+        return self.limits.get(model, self.default_limit)
+
+    def _semaphore(self, model):
+        with self._lock:
+            semaphore = self._semaphores.get(model)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.limit_for(model))
+                self._semaphores[model] = semaphore
+                self._active[model] = 0
+                self._waiting[model] = 0
+            return semaphore
+
+    @contextmanager
+    def slot(self, model):
+        """Holds one of the model's generation slots for the duration of the block."""
+        semaphore = self._semaphore(model)
+        with self._lock:
+            self._waiting[model] += 1
+        semaphore.acquire()
+        with self._lock:
+            self._waiting[model] -= 1
+            self._active[model] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active[model] -= 1
+            semaphore.release()
+
+    def stats(self):
+        with self._lock:
+            return {
+                model: {
+                    "limit": self.limit_for(model),
+                    "active": self._active[model],
+                    "waiting": self._waiting[model],
+                }
+                for model in self._semaphores
+            }
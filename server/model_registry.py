@@ -0,0 +1,126 @@
+"""
+Cached view of the models installed in Ollama.
+
+The installed models are read from /api/tags once and cached for a TTL; a
+background thread refreshes the list before it goes stale, so picking a model
+never costs a round trip on the request path. A list that went stale anyway
+(Ollama was down) is still returned while the thread refreshes it. Callers
+pass an ordered list of acceptable models and get the first installed one,
+instead of probing models with full generation requests until one succeeds.
+"""
+import threading
+import time
+
+
+def normalize_model_name(name):
+    """Ollama treats a model without a tag as ':latest'."""
+    name = name.strip()
+    return name if ":" in name else f"{name}:latest"
+
+
+class ModelRegistry:
+    """Installed-model list from Ollama, cached with a TTL and refreshed in the background."""
+
+    def __init__(self, client, ttl_seconds=300):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._models = None
+        self._fetched_at = None
+        self._thread = None
+        # Set to make the background thread refresh before its next scheduled run
+        self._wake = threading.Event()
+        self.refreshes = 0
+        self.failures = 0
+        self.last_error = None
+
+    def start(self):
+        """Loads the model list and keeps refreshing it in the background (once)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="model-registry", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self.refresh()
+            # Refresh at half the TTL so readers never see a stale list
+            self._wake.wait(timeout=max(1, self.ttl_seconds / 2))
+            self._wake.clear()
+
+    def refresh(self):
+        """Fetches the installed models from /api/tags. Keeps the last known list on failure."""
+        if not self._refresh_lock.acquire(blocking=False):
+            return  # Another caller is already refreshing
+        try:
+            response = self.client.get("/api/tags")
+            response.raise_for_status()
+            models = {normalize_model_name(entry["name"])
+                      for entry in response.json().get("models", []) if entry.get("name")}
+        except Exception as e:
+            print(f"Listing Ollama models failed: {e}", flush=True)
+            with self._lock:
+                self.failures += 1
+                self.last_error = str(e)
+            return
+        finally:
+            self._refresh_lock.release()
+
+        with self._lock:
+            self._models = models
+            self._fetched_at = time.time()
+            self.refreshes += 1
+            self.last_error = None
+
+    def installed(self):
+        """
+        Returns the set of installed models, or None if it has never been
+        fetched. Never waits on Ollama once start() has been called: a stale
+        list is returned as is and refreshed in the background.
+        """
+        with self._lock:
+            fetched_at = self._fetched_at
+            started = self._thread is not None
+        if fetched_at is None and not started:
+            # Before start(), the very first call loads the list
+            self.refresh()
+        elif fetched_at is None or time.time() - fetched_at > self.ttl_seconds:
+            if started:
+                self._wake.set()
+            else:
+                threading.Thread(target=self.refresh, name="model-registry-refresh", daemon=True).start()
+        with self._lock:
+            return self._models
+
+    def is_installed(self, model):
+        models = self.installed()
+        return models is not None and normalize_model_name(model) in models
+
+    def pick(self, candidates):
+        """
+        Returns the first installed model from `candidates`, or None when none
+        of them is installed. If the installed models are unknown (Ollama has
+        not answered yet), the first candidate is returned so the request can
+        still be tried.
+        """
+        models = self.installed()
+        if models is None:
+            return candidates[0] if candidates else None
+        for model in candidates:
+            if normalize_model_name(model) in models:
+                return model
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "models": sorted(self._models) if self._models is not None else None,
+                "age_seconds": round(time.time() - self._fetched_at, 1) if self._fetched_at else None,
+                "ttl_seconds": self.ttl_seconds,
+                "refreshes": self.refreshes,
+                "failures": self.failures,
+                "last_error": self.last_error,
+            }
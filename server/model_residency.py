@@ -0,0 +1,252 @@
+"""
+Model warm-up and residency tracking for Ollama.
+
+Loading a model such as llama3.1:8b takes several seconds, and Ollama unloads
+idle models once their keep_alive expires. This manager preloads the
+configured models at startup and gives every model a keep_alive policy, which
+callers send with each request so that traffic does not reset it to Ollama's
+default. It also polls /api/ps to see which models are still resident and
+reloads configured models that were evicted. Callers use `ensure_warm` before
+sending traffic, so a cold model is loaded once and every waiting request
+shares that load.
+"""
+import re
+import threading
+import time
+from datetime import datetime
+
+COLD = "cold"
+LOADING = "loading"
+WARM = "warm"
+FAILED = "failed"
+
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_keep_alive_seconds(keep_alive):
+    """
+    Converts an Ollama keep_alive value ("30m", "1h30m", "300", -1) to seconds.
+    Returns None for "forever" (any negative value).
+    """
+    text = str(keep_alive).strip()
+    try:
+        seconds = float(text)
+    except ValueError:
+        seconds = sum(float(amount) * DURATION_UNITS[unit]
+                      for amount, unit in DURATION_PART.findall(text))
+        if text.startswith("-"):
+            seconds = -1
+    return None if seconds < 0 else seconds
+
+
+def parse_expires_at(value):
+    """Parses Ollama's RFC 3339 expires_at (nanosecond precision) to a Unix timestamp."""
+    if not value:
+        return None
+    # datetime only accepts up to microseconds
+    value = re.sub(r"(\.\d{6})\d+", r"\1", value).replace("Z", "+00:00")
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        return None
+
+
+class ModelResidencyManager:
+    """Preloads models, tracks which are resident in Ollama and warms cold ones on demand."""
+
+    def __init__(self, client, models, keep_alive_default="30m", keep_alive=None,
+                 check_interval=60, warmup_timeout=300, rewarm=True):
+        self.client = client
+        self.models = list(dict.fromkeys(model.strip() for model in models if model.strip()))
+        self.keep_alive_default = keep_alive_default
+        self.keep_alive = dict(keep_alive or {})
+        self.check_interval = check_interval
+        self.warmup_timeout = warmup_timeout
+        self.rewarm = rewarm
+        self._lock = threading.Lock()
+        self._states = {}
+        self._thread = None
+        self.warmups = 0
+        self.warmup_failures = 0
+        self.cold_waits = 0
+        self.last_check = None
+        for model in self.models:
+            self._state(model)
+
+    def keep_alive_for(self, model):
+        return self.keep_alive.get(model, self.keep_alive_default)
+
+    def stays_resident(self, model):
+        """Models with keep_alive 0 are unloaded after every request, so they are never kept warm."""
+        return parse_keep_alive_seconds(self.keep_alive_for(model)) != 0
+
+    def resident_models(self):
+        return [model for model in self.models if self.stays_resident(model)]
+
+    def _state(self, model):
+        state = self._states.get(model)
+        if state is None:
+            state = {
+                "state": COLD,
+                "expires_at": None,
+                "load_seconds": None,
+                "size_vram": None,
+                "error": None,
+                "failed_at": None,
+                "ready": threading.Event(),
+            }
+            state["ready"].set()
+            self._states[model] = state
+        return state
+
+    def start(self):
+        """Starts the background warm-up and residency check loop (once)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self._run, name="model-residency", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        for model in self.resident_models():
+            self.warm(model)
+        while True:
+            time.sleep(self.check_interval)
+            self.refresh()
+            if self.rewarm:
+                for model in self.resident_models():
+                    if not self.is_warm(model):
+                        print(f"Model {model} is no longer resident; warming it again", flush=True)
+                        self.warm(model)
+
+    def warm(self, model):
+        """Loads the model with an empty prompt and its keep_alive policy. Returns True when warm."""
+        with self._lock:
+            state = self._state(model)
+            if state["state"] == LOADING:
+                leader = False
+            else:
+                leader = True
+                state["state"] = LOADING
+                state["ready"].clear()
+        if not leader:
+            state["ready"].wait(self.warmup_timeout)
+            return self.is_warm(model)
+
+        keep_alive = self.keep_alive_for(model)
+        started = time.perf_counter()
+        try:
+            # An empty prompt only loads the model into memory
+            response = self.client.post(
+                "/api/generate", {"model": model, "keep_alive": keep_alive}, deadline=self.warmup_timeout)
+            response.raise_for_status()
+            load_duration = response.json().get("load_duration")
+        except Exception as e:
+            print(f"Warming model {model} failed: {e}", flush=True)
+            with self._lock:
+                state.update(state=FAILED, error=str(e), failed_at=time.time())
+                self.warmup_failures += 1
+            return False
+        else:
+            elapsed = time.perf_counter() - started
+            keep_alive_seconds = parse_keep_alive_seconds(keep_alive)
+            with self._lock:
+                state.update(
+                    state=WARM,
+                    error=None,
+                    load_seconds=round(load_duration / 1e9 if load_duration else elapsed, 3),
+                    expires_at=None if keep_alive_seconds is None else time.time() + keep_alive_seconds)
+                self.warmups += 1
+            print(f"Model {model} warm after {elapsed:.2f}s", flush=True)
+            return True
+        finally:
+            state["ready"].set()
+
+    def refresh(self):
+        """Updates residency from Ollama's list of loaded models (/api/ps)."""
+        try:
+            response = self.client.get("/api/ps")
+            response.raise_for_status()
+            loaded = {entry.get("name"): entry for entry in response.json().get("models", [])}
+        except Exception as e:
+            print(f"Checking resident models failed: {e}", flush=True)
+            return
+
+        with self._lock:
+            self.last_check = time.time()
+            for name in loaded:
+                self._state(name)
+            for model, state in self._states.items():
+                if state["state"] == LOADING:
+                    continue
+                entry = loaded.get(model)
+                if entry is None:
+                    state.update(state=COLD, expires_at=None, size_vram=None)
+                else:
+                    state.update(
+                        state=WARM,
+                        expires_at=parse_expires_at(entry.get("expires_at")),
+                        size_vram=entry.get("size_vram"))
+
+    def is_warm(self, model):
+        with self._lock:
+            state = self._states.get(model)
+            if state is None or state["state"] != WARM:
+                return False
+            return state["expires_at"] is None or state["expires_at"] > time.time()
+
+    def ensure_warm(self, model, timeout=None):
+        """
+        Returns immediately if the model is warm. Otherwise loads it (or joins a
+        load already in progress) and waits up to `timeout` seconds.
+        """
+        if self.is_warm(model):
+            return True
+        if not self.stays_resident(model):
+            # A warm-up would only load the model twice
+            return False
+        with self._lock:
+            state = self._states.get(model)
+            if state is not None and state["state"] == FAILED and time.time() - state["failed_at"] < self.check_interval:
+                # Do not hold every request behind a warm-up that just failed
+                return False
+        with self._lock:
+            self.cold_waits += 1
+        print(f"Model {model} is cold; warming it before sending traffic", flush=True)
+
+        if timeout is None:
+            return self.warm(model)
+        worker = threading.Thread(target=self.warm, args=(model,), daemon=True)
+        worker.start()
+        worker.join(timeout)
+        return self.is_warm(model)
+
+    def readiness(self):
+        """Returns (ready, details); ready means every configured model that stays resident is warm."""
+        return all(self.is_warm(model) for model in self.resident_models()), self.stats()
+
+    def stats(self):
+        with self._lock:
+            now = time.time()
+            return {
+                "models": {
+                    model: {
+                        "state": state["state"],
+                        "configured": model in self.models,
+                        "stays_resident": self.stays_resident(model),
+                        "keep_alive": self.keep_alive_for(model),
+                        "expires_in_seconds": round(state["expires_at"] - now) if state["expires_at"] else None,
+                        "load_seconds": state["load_seconds"],
+                        "size_vram": state["size_vram"],
+                        "error": state["error"],
+                    }
+                    for model, state in self._states.items()
+                },
+                "warmups": self.warmups,
+                "warmup_failures": self.warmup_failures,
+                "cold_waits": self.cold_waits,
+                "last_check": self.last_check,
+                "check_interval": self.check_interval,
+            }
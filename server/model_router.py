@@ -0,0 +1,202 @@
+"""
+Load-aware model routing for summaries, explanations and chat.
+
+Each task has a route, which is an ordered list of models. The route starts
+with the preferred model and continues with smaller, faster fallbacks. For each
+request the router walks the route and takes the first model that passes
+every rule:
+
+- input: the prompt fits the model's input limit, if one is set
+- queue: fewer than the model's maximum requests are already running on it
+- slo: the estimated time to answer is within the task's latency SLO
+
+The estimate comes from the prompt length, the task's typical reply length,
+and the model's recently measured prompt and generation speeds (tokens/sec
+from Ollama's response metadata). It is multiplied by the number of requests
+already running on the model, and a cold model's load time is added. A model
+that has not been measured yet is assumed to meet the SLO, so it gets tried.
+
+When no model passes, the request goes to the model expected to answer first:
+a faster answer from a smaller model beats a timeout. Every decision is
+counted per task, model and reason, and the latest ones are kept for metrics.
+"""
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+PREFERRED = "preferred"
+OVERLOADED = "overloaded"
+NANOSECONDS = 1e9
+# Below this, load_duration is Ollama's bookkeeping for a model that was already resident
+MIN_LOAD_SECONDS = 0.5
+
+
+class ModelRouter:
+    """Picks a model for each request from its task's route, given measured speeds and current load."""
+
+    def __init__(self, routes, slo_seconds=None, output_tokens=None, max_queue_default=4,
+                 max_queue=None, input_limits=None, is_warm=None, smoothing=0.3, recent_entries=20):
+        self.routes = {task: list(models) for task, models in routes.items()}
+        self.slo_seconds = dict(slo_seconds or {})
+        self.max_queue_default = max_queue_default
+        self.max_queue = dict(max_queue or {})
+        self.input_limits = dict(input_limits or {})
+        self.is_warm = is_warm
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        # Task -> typical reply length in tokens, seeded with a prior and updated from replies
+        self._output_tokens = dict(output_tokens or {})
+        # Model -> {"prompt_tps", "eval_tps", "load_seconds", "samples"}
+        self._speeds = {}
+        self._in_flight = {}
+        # Task -> {(model, reason): count}
+        self._decisions = {task: {} for task in self.routes}
+        self._recent = deque(maxlen=recent_entries)
+
+    def route(self, task, input_tokens, candidates=None, input_limit=None):
+        """
+        Returns the routing decision for a request as a dict with the chosen
+        "model", the "reason" (preferred, the rule that ruled out the preferred
+        model, or overloaded), the models "skipped" with their rule and
+        estimate, and the chosen model's estimate. `candidates` restricts the
+        route, for example to installed models. `input_limit`, if given, maps a
+        model to its input limit in place of the configured limits.
+        """
+        candidates = list(candidates if candidates is not None else self.routes[task])
+        slo = self.slo_seconds.get(task)
+        limit_for = input_limit or self.input_limits.get
+
+        with self._lock:
+            chosen = None
+            skipped = []
+            estimates = {}
+            for model in candidates:
+                estimates[model] = self._estimate_locked(model, task, input_tokens)
+                limit = limit_for(model)
+                if limit is not None and input_tokens > limit:
+                    failed = "input"
+                elif self._in_flight.get(model, 0) >= self.max_queue.get(model, self.max_queue_default):
+                    failed = "queue"
+                elif slo is not None and estimates[model] is not None and estimates[model] > slo:
+                    failed = "slo"
+                else:
+                    chosen = model
+                    break
+                skipped.append({"model": model, "rule": failed, "estimated_seconds": self._round(estimates[model])})
+
+            reason = skipped[0]["rule"] if skipped else PREFERRED
+            if chosen is None:
+                # Nothing meets every rule; of the models the prompt fits, the one expected to answer first
+                fitting = [entry["model"] for entry in skipped if entry["rule"] != "input"] or candidates
+                measured = [model for model in fitting if estimates[model] is not None]
+                chosen = min(measured, key=estimates.get) if measured else fitting[0]
+                reason = OVERLOADED
+
+            decision = {
+                "task": task,
+                "model": chosen,
+                "reason": reason,
+                "input_tokens": input_tokens,
+                "queue_depth": self._in_flight.get(chosen, 0),
+                "estimated_seconds": self._round(estimates[chosen]),
+                "slo_seconds": slo,
+                "skipped": skipped,
+                "at": time.time(),
+            }
+            counts = self._decisions.setdefault(task, {})
+            counts[(chosen, reason)] = counts.get((chosen, reason), 0) + 1
+            self._recent.append(decision)
+        return decision
+
+    def _estimate_locked(self, model, task, input_tokens):
+        """Seconds until a new request would be answered, or None if the model's speed is unknown."""
+        speed = self._speeds.get(model)
+        if speed is None or not speed["prompt_tps"] or not speed["eval_tps"]:
+            return None
+        service = (input_tokens / speed["prompt_tps"]
+                   + self._output_tokens.get(task, 0) / speed["eval_tps"])
+        # Requests already running on the model are assumed to take about as long as this one
+        estimate = service * (self._in_flight.get(model, 0) + 1)
+        if self.is_warm is not None and not self.is_warm(model):
+            estimate += speed["load_seconds"]
+        return estimate
+
+    @contextmanager
+    def track(self, model):
+        """Counts a request as running on `model` for the duration of the block."""
+        with self._lock:
+            self._in_flight[model] = self._in_flight.get(model, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight[model] -= 1
+
+    def observe(self, model, metadata, task=None):
+        """Updates the model's speeds, and the task's reply length, from an Ollama response."""
+        if not metadata:
+            return
+        prompt_count = metadata.get("prompt_eval_count")
+        prompt_duration = metadata.get("prompt_eval_duration")
+        eval_count = metadata.get("eval_count")
+        eval_duration = metadata.get("eval_duration")
+        load_duration = metadata.get("load_duration")
+
+        with self._lock:
+            speed = self._speeds.setdefault(
+                model, {"prompt_tps": None, "eval_tps": None, "load_seconds": 0.0, "samples": 0})
+            if prompt_count and prompt_duration:
+                speed["prompt_tps"] = self._smooth(
+                    speed["prompt_tps"], prompt_count * NANOSECONDS / prompt_duration)
+            if eval_count and eval_duration:
+                speed["eval_tps"] = self._smooth(
+                    speed["eval_tps"], eval_count * NANOSECONDS / eval_duration)
+                if task is not None:
+                    self._output_tokens[task] = self._smooth(self._output_tokens.get(task), eval_count)
+            if load_duration and load_duration / NANOSECONDS >= MIN_LOAD_SECONDS:
+                speed["load_seconds"] = self._smooth(
+                    speed["load_seconds"] or None, load_duration / NANOSECONDS)
+            speed["samples"] += 1
+
+    @staticmethod
+    def _round(estimate):
+        return round(estimate, 1) if estimate is not None else None
+
+    def _smooth(self, previous, value):
+        if previous is None:
+            return float(value)
+        return previous + self.smoothing * (value - previous)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tasks": {
+                    task: {
+                        "route": self.routes.get(task, []),
+                        "slo_seconds": self.slo_seconds.get(task),
+                        "output_tokens": round(self._output_tokens[task]) if task in self._output_tokens else None,
+                        "decisions": [
+                            {"model": model, "reason": reason, "count": count}
+                            for (model, reason), count in sorted(self._decisions.get(task, {}).items())
+                        ],
+                    }
+                    for task in self.routes
+                },
+                "models": {
+                    model: self._model_stats_locked(model)
+                    for model in sorted(set(self._speeds) | set(self._in_flight))
+                },
+                "recent": list(self._recent)[-10:],
+            }
+
+    def _model_stats_locked(self, model):
+        speed = self._speeds.get(model, {})
+        return {
+            "in_flight": self._in_flight.get(model, 0),
+            "max_queue": self.max_queue.get(model, self.max_queue_default),
+            "prompt_tokens_per_second": round(speed["prompt_tps"], 1) if speed.get("prompt_tps") else None,
+            "eval_tokens_per_second": round(speed["eval_tps"], 1) if speed.get("eval_tps") else None,
+            "load_seconds": round(speed.get("load_seconds", 0.0), 1),
+            "samples": speed.get("samples", 0),
+        }
@@ -0,0 +1,119 @@
+"""
+Pluggable resolution of YouTube playlists into video IDs.
+
+Resolvers are registered by name with `register_playlist_resolver` and take
+(playlist_id, max_videos), returning an ordered list of video IDs. Two are
+built in: the YouTube Data API (used when YOUTUBE_API_KEY is set) and a
+fallback that reads video IDs from the public playlist page.
+"""
+import os
+import re
+
+import requests
+
+PLAYLIST_RESOLVERS = {}
+
+VIDEO_ID_PATTERN = re.compile(r'"videoId":"([A-Za-z0-9_-]{11})"')
+
+
+class PlaylistResolutionError(Exception):
+    """Raised when a playlist cannot be resolved into video IDs."""
+
+
+def register_playlist_resolver(name):
+    """Decorator that registers a resolver function under `name`."""
+    def decorator(resolver):
+        PLAYLIST_RESOLVERS[name] = resolver
+        return resolver
+    return decorator
+
+
+def extract_playlist_id(playlist):
+    """Accepts a bare playlist ID or any URL with a list= parameter."""
+    if "list=" in playlist:
+        return playlist.split("list=")[1].split("&")[0]
+    return playlist.strip()
+
+
+@register_playlist_resolver("youtube_api")
+def resolve_with_youtube_api(playlist_id, max_videos):
+    api_key = os.getenv("YOUTUBE_API_KEY")
+    if not api_key:
+        raise PlaylistResolutionError("YOUTUBE_API_KEY is not set.")
+
+    video_ids = []
+    page_token = None
+    while len(video_ids) < max_videos:
+        params = {
+            "part": "contentDetails",
+            "playlistId": playlist_id,
+            "maxResults": 50,
+            "key": api_key,
+        }
+        if page_token:
+            params["pageToken"] = page_token
+
+        response = requests.get(
+            "https://www.googleapis.com/youtube/v3/playlistItems", params=params, timeout=30)
+        if response.status_code == 404:
+            raise PlaylistResolutionError(f"Playlist {playlist_id} not found.")
+        response.raise_for_status()
+        data = response.json()
+
+        for item in data.get("items", []):
+            video_id = item.get("contentDetails", {}).get("videoId")
+            if video_id:
+                video_ids.append(video_id)
+
+        page_token = data.get("nextPageToken")
+        if not page_token:
+            break
+
+    return video_ids[:max_videos]
+
+
+@register_playlist_resolver("html")
+def resolve_from_playlist_page(playlist_id, max_videos):
+    # The initial page only lists the first ~100 videos of a playlist
+    response = requests.get(
+        "https://www.youtube.com/playlist",
+        params={"list": playlist_id},
+        headers={"Accept-Language": "en-US,en;q=0.9"},
+        timeout=30)
+    response.raise_for_status()
+
+    video_ids = []
+    seen = set()
+    for video_id in VIDEO_ID_PATTERN.findall(response.text):
+        if video_id not in seen:
+            seen.add(video_id)
+            video_ids.append(video_id)
+
+    if not video_ids:
+        raise PlaylistResolutionError(
+            f"No videos found for playlist {playlist_id}.")
+    return video_ids[:max_videos]
+
+
+def resolve_playlist(playlist, max_videos=500, resolver=None):
+    """
+    Resolves a playlist ID or URL to an ordered list of video IDs.
+    Uses `resolver` if given, then PLAYLIST_RESOLVER from the environment, then
+    the YouTube Data API when a key is configured, and the playlist page otherwise.
+    """
+    playlist_id = extract_playlist_id(playlist)
+    if not playlist_id:
+        raise PlaylistResolutionError("Playlist ID is empty.")
+
+    name = resolver or os.getenv("PLAYLIST_RESOLVER") or (
+        "youtube_api" if os.getenv("YOUTUBE_API_KEY") else "html")
+    if name not in PLAYLIST_RESOLVERS:
+        raise PlaylistResolutionError(
+            f"Unknown playlist resolver '{name}'. Available: {', '.join(PLAYLIST_RESOLVERS)}")
+
+    print(f"Resolving playlist {playlist_id} with '{name}' resolver")
+    try:
+        return PLAYLIST_RESOLVERS[name](playlist_id, max_videos)
+    except requests.exceptions.RequestException as e:
+        raise PlaylistResolutionError(
+            f"Failed to resolve playlist {playlist_id}: {e}")
@@ -0,0 +1,160 @@
+"""
+Content-addressed cache for generated summaries and explanations.
+
+Results are keyed by the hash of the transcript text, the processing mode,
+the model name and the hash of the prompt template. Changing the prompt or
+the model therefore produces a different key, and the stale entries are
+purged on startup by `invalidate_stale`. Storage is a SQLite file with the
+same LRU/TTL eviction as the transcript cache.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+
+def content_hash(text):
+    """Returns a stable hex digest for a transcript or prompt template."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """LRU + TTL cache of LLM outputs persisted to a SQLite file."""
+
+    def __init__(self, path, max_bytes=50 * 1024 * 1024, max_entries=10000, ttl_seconds=30 * 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS results (
+                transcript_hash TEXT NOT NULL,
+                mode TEXT NOT NULL,
+                model TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                content TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (transcript_hash, mode, model, prompt_hash)
+            )""")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_results_accessed ON results (accessed_at)")
+        self._conn.commit()
+
+    def get(self, transcript_hash, mode, model, prompt_hash):
+        """Returns the cached content, or None on a miss or expired entry."""
+        key = (transcript_hash, mode, model, prompt_hash)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, created_at FROM results "
+                "WHERE transcript_hash = ? AND mode = ? AND model = ? AND prompt_hash = ?",
+                key).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            content, created_at = row
+            if self.ttl_seconds and now - created_at > self.ttl_seconds:
+                self._conn.execute(
+                    "DELETE FROM results "
+                    "WHERE transcript_hash = ? AND mode = ? AND model = ? AND prompt_hash = ?",
+                    key)
+                self._conn.commit()
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                "UPDATE results SET accessed_at = ? "
+                "WHERE transcript_hash = ? AND mode = ? AND model = ? AND prompt_hash = ?",
+                (now,) + key)
+            self._conn.commit()
+            self.hits += 1
+            return content
+
+    def put(self, transcript_hash, mode, model, prompt_hash, content):
+        """Stores a generated result and evicts old entries if over the limits."""
+        size = len(content.encode('utf-8'))
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results "
+                "(transcript_hash, mode, model, prompt_hash, content, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (transcript_hash, mode, model, prompt_hash, content, size, now, now))
+            self._evict_locked()
+            self._conn.commit()
+
+    def invalidate_stale(self, mode, models, prompt_hash):
+        """Deletes every entry for `mode` produced by a different prompt, or by a model not in `models`."""
+        models = list(models)
+        with self._lock:
+            cursor = self._conn.execute(
+                f"DELETE FROM results WHERE mode = ? AND (model NOT IN ({', '.join('?' for _ in models)}) "
+                "OR prompt_hash != ?)",
+                (mode, *models, prompt_hash))
+            self._conn.commit()
+            self.invalidations += cursor.rowcount
+            return cursor.rowcount
+
+    def _evict_locked(self):
+        count, total_bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        if count <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+
+        victims = []
+        for row in self._conn.execute(
+                "SELECT transcript_hash, mode, model, prompt_hash, size FROM results ORDER BY accessed_at ASC"):
+            if count <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            victims.append(row[:4])
+            count -= 1
+            total_bytes -= row[4]
+
+        self._conn.executemany(
+            "DELETE FROM results "
+            "WHERE transcript_hash = ? AND mode = ? AND model = ? AND prompt_hash = ?",
+            victims)
+        self.evictions += len(victims)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM results")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            count, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": count,
+            "bytes": total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,121 @@
+"""
+Benchmark for the full-text search index (search_index.py).
+
+Fills an index with synthetic transcript passages, summaries and
+explanations, then times the query shapes that matter for /api/search: a
+term that occurs in a large share of passages, the same term with match=any,
+filtered to one video or one kind, a short and a longer prefix, and a rare
+term. Passage words are drawn from a Zipf-like vocabulary (w0, w1, ...), so
+low-numbered words are common and high-numbered ones are rare.
+
+    python search_benchmark.py --passages 1000000 --path /tmp/search-bench.sqlite3
+
+Documents are inserted in batches the way the server adds them, and the FTS
+tables are not optimized afterwards, so segment counts match a live index.
+An existing database at --path is reused when it already holds at least the
+requested number of passages, so the queries can be re-run without rebuilding.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import time
+
+from search_index import SearchIndex
+
+PASSAGES_PER_VIDEO = 100
+COMMON_TERM = "python"
+
+
+def video_id_for(number):
+    return f"vid{number:08d}"
+
+
+def build(path, passages, passage_words, vocabulary, common_share, seed=0):
+    """Adds synthetic documents to the index at `path` until it holds `passages` transcript passages."""
+    SearchIndex(path)  # creates the schema
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA synchronous=OFF")
+    existing = connection.execute(
+        "SELECT COUNT(*) FROM documents WHERE kind = 'transcript'").fetchone()[0]
+    if existing >= passages:
+        connection.close()
+        return existing, 0.0
+
+    rng = random.Random(seed + existing)
+    words = [f"w{rank}" for rank in range(vocabulary)]
+    cum_weights = []
+    total = 0.0
+    for rank in range(vocabulary):
+        total += 1.0 / (rank + 1)
+        cum_weights.append(total)
+
+    def text(length):
+        chosen = rng.choices(words, cum_weights=cum_weights, k=length)
+        if rng.random() < common_share:
+            chosen[rng.randrange(length)] = COMMON_TERM
+        return " ".join(chosen)
+
+    started = time.perf_counter()
+    batch = 10_000
+    for first in range(existing, passages, batch):
+        rows = []
+        for number in range(first, min(first + batch, passages)):
+            video_id = video_id_for(number // PASSAGES_PER_VIDEO)
+            position = number % PASSAGES_PER_VIDEO
+            rows.append((video_id, "transcript", position * 30.0, text(passage_words)))
+            if position == PASSAGES_PER_VIDEO - 1:
+                rows.append((video_id, "summary", None, text(passage_words * 2)))
+                rows.append((video_id, "explanation", None, text(passage_words * 4)))
+        connection.executemany(
+            "INSERT INTO documents (video_id, kind, start, content_hash, content) VALUES (?, ?, ?, '', ?)",
+            rows)
+        connection.commit()
+        done = min(first + batch, passages)
+        if done % 100_000 == 0 or done == passages:
+            elapsed = time.perf_counter() - started
+            print(f"  {done} passages ({elapsed:.0f}s)", flush=True)
+    connection.close()
+    return passages, time.perf_counter() - started
+
+
+def run_queries(index, passages, repeats):
+    videos = max(passages // PASSAGES_PER_VIDEO, 1)
+    cases = [
+        ("common term", dict(query=COMMON_TERM)),
+        ("common term, match=any", dict(query=f"{COMMON_TERM} w5", match_any=True)),
+        ("common term, one video", dict(query=COMMON_TERM, video_id=video_id_for(videos // 2))),
+        ("common term, kind=summary", dict(query=COMMON_TERM, kinds=["summary"])),
+        ("two common words", dict(query="w0 w1")),
+        ("2-char prefix w1*", dict(query="w1*")),
+        ("4-char prefix w123*", dict(query="w123*")),
+        ("rare term", dict(query="w49000")),
+        ("page 5", dict(query=COMMON_TERM, offset=80)),
+    ]
+    print(f"{'query':<28} {'median ms':>10} {'max ms':>10} {'results':>8}")
+    for name, kwargs in cases:
+        timings = []
+        for _ in range(repeats):
+            results, elapsed_ms = index.search(**kwargs)
+            timings.append(elapsed_ms)
+        print(f"{name:<28} {statistics.median(timings):>10.1f} {max(timings):>10.1f} {len(results):>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--path", default="search-bench.sqlite3")
+    parser.add_argument("--passages", type=int, default=100_000)
+    parser.add_argument("--passage-words", type=int, default=120)
+    parser.add_argument("--vocabulary", type=int, default=50_000)
+    parser.add_argument("--common-share", type=float, default=0.3,
+                        help="share of documents that contain the common term")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    passages, build_seconds = build(args.path, args.passages, args.passage_words,
+                                    args.vocabulary, args.common_share)
+    if build_seconds:
+        print(f"Indexed {passages} passages in {build_seconds:.0f}s")
+    print(f"{passages} passages, {os.path.getsize(args.path) / 2**20:.0f} MB")
+    run_queries(SearchIndex(args.path), passages, args.repeats)
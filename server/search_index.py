@@ -0,0 +1,317 @@
+"""
+Full-text search over processed transcripts, summaries and explanations.
+
+Everything the server fetches or generates is added to a SQLite FTS5 index
+as it is produced: transcripts as timestamped passages, so a hit can link to
+the moment in the video, and each summary or explanation as one document.
+Indexing is incremental. A video whose transcript hash is unchanged is
+skipped, and a newer summary replaces the previous one. Writes run on a
+single background thread, so requests never wait for them. The database
+uses write-ahead logging and searches use their own connection, so readers
+are not blocked by writes either.
+
+Results are ranked with BM25 and returned with highlighted snippets. Snippets
+are HTML-escaped, so the only markup in them is the <mark> around matches.
+
+Each kind of document has its own FTS5 table, so a kind filter only opens
+the tables it needs, and the video ID is an indexed column, so a video filter
+is part of the MATCH expression and FTS5 intersects doclists instead of
+checking every matching row. Ordering a whole match set by rank means scoring
+every row that contains the terms, which is slow for common words in a large
+index. Each kind is therefore searched newest first for at most
+`candidates_per_kind` matches, and only those candidates are ranked. Prefixes
+shorter than MIN_PREFIX_CHARS are searched as whole words, since expanding
+them merges the doclists of a large part of the vocabulary.
+"""
+import hashlib
+import html
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from transcript import format_timestamp
+from video_index import chunk_transcript
+
+SEARCH_TERM_PATTERN = re.compile(r"\w+", re.UNICODE)
+DOCUMENT_KINDS = ("transcript", "summary", "explanation")
+FTS_TABLES = {kind: f"{kind}_fts" for kind in DOCUMENT_KINDS}
+MIN_PREFIX_CHARS = 3
+# Bumped when the FTS tables change; older ones are dropped and rebuilt from documents
+SCHEMA_VERSION = 2
+# Private-use characters mark matches in snippets until the text around them is HTML-escaped
+MARK_START = "\ue000"
+MARK_END = "\ue001"
+
+
+def quote_term(value):
+    """Quotes a value as an FTS5 string, so it is matched as a phrase and never parsed as query syntax."""
+    return '"' + value.replace('"', '""') + '"'
+
+
+def build_match_query(query, match_any=False):
+    """
+    Turns free text into an FTS5 MATCH expression over the content column:
+    every word is quoted, so user input never hits FTS5 query syntax, and a
+    trailing '*' keeps a prefix search if the prefix has at least
+    MIN_PREFIX_CHARS characters. Returns None if the query has no words.
+    """
+    terms = []
+    for word in query.split():
+        prefix = word.endswith("*")
+        word_terms = SEARCH_TERM_PATTERN.findall(word)
+        terms.extend(quote_term(term) for term in word_terms)
+        if prefix and word_terms and len(word_terms[-1]) >= MIN_PREFIX_CHARS:
+            terms[-1] += "*"
+    if not terms:
+        return None
+    return f"content : ({(' OR ' if match_any else ' ').join(terms)})"
+
+
+def highlight(snippet):
+    """HTML-escapes an FTS5 snippet and turns its match markers into <mark> tags."""
+    return html.escape(snippet).replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+
+
+class SearchIndex:
+    """SQLite FTS5 index of transcripts and generated results."""
+
+    def __init__(self, path, passage_tokens=120, snippet_tokens=24, candidates_per_kind=1000):
+        self.path = path
+        self.passage_tokens = passage_tokens
+        self.snippet_tokens = snippet_tokens
+        self.candidates_per_kind = candidates_per_kind
+        self.indexed_transcripts = 0
+        self.skipped_transcripts = 0
+        self.indexed_results = 0
+        self.write_failures = 0
+        self.pending_writes = 0
+        self.searches = 0
+        self.capped_searches = 0
+        self.search_ms = 0.0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._writer = sqlite3.connect(path, check_same_thread=False)
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self._writer.execute("PRAGMA synchronous=NORMAL")
+        self._writer.executescript(
+            """CREATE TABLE IF NOT EXISTS videos (
+                video_id TEXT PRIMARY KEY,
+                transcript_hash TEXT,
+                indexed_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS documents (
+                id INTEGER PRIMARY KEY,
+                video_id TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                start REAL,
+                content_hash TEXT NOT NULL,
+                content TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_documents_video ON documents (video_id, kind);""")
+        if self._writer.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            self._migrate()
+        self._writer.commit()
+
+        self._reader_lock = threading.Lock()
+        self._reader = sqlite3.connect(path, check_same_thread=False)
+        self._stats_lock = threading.Lock()
+        # One writer thread keeps index updates ordered and off the request path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-index")
+
+    def _migrate(self):
+        """Replaces the FTS tables of an older schema and fills the new ones from documents."""
+        if self._writer.execute("SELECT 1 FROM documents LIMIT 1").fetchone():
+            print("Rebuilding the search index for the new schema...", flush=True)
+        self._writer.executescript(
+            """DROP TRIGGER IF EXISTS documents_after_insert;
+            DROP TRIGGER IF EXISTS documents_after_delete;
+            DROP TABLE IF EXISTS documents_fts;""")
+        for kind, table in FTS_TABLES.items():
+            # Filter and display columns live in the FTS table, so a search never joins back to documents
+            self._writer.executescript(
+                f"""DROP TABLE IF EXISTS {table};
+                CREATE VIRTUAL TABLE {table} USING fts5(
+                    content, video_id, start UNINDEXED,
+                    content='documents', content_rowid='id', tokenize='porter unicode61', prefix='3 4'
+                );
+                CREATE TRIGGER IF NOT EXISTS {table}_after_insert AFTER INSERT ON documents
+                WHEN new.kind = '{kind}' BEGIN
+                    INSERT INTO {table} (rowid, content, video_id, start)
+                    VALUES (new.id, new.content, new.video_id, new.start);
+                END;
+                CREATE TRIGGER IF NOT EXISTS {table}_after_delete AFTER DELETE ON documents
+                WHEN old.kind = '{kind}' BEGIN
+                    INSERT INTO {table} ({table}, rowid, content, video_id, start)
+                    VALUES ('delete', old.id, old.content, old.video_id, old.start);
+                END;""")
+            self._writer.execute(
+                f"INSERT INTO {table} (rowid, content, video_id, start) "
+                "SELECT id, content, video_id, start FROM documents WHERE kind = ?", (kind,))
+        self._writer.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def add_transcript(self, video_id, transcript):
+        """Queues a Transcript for indexing; unchanged transcripts are skipped."""
+        return self._submit(self._index_transcript, video_id, transcript)
+
+    def add_result(self, video_id, kind, content):
+        """Queues a summary or explanation for indexing, replacing the previous one."""
+        return self._submit(self._index_result, video_id, kind, content)
+
+    def flush(self):
+        """Waits until every queued write has been applied."""
+        self._executor.submit(lambda: None).result()
+
+    def _submit(self, index_fn, *args):
+        with self._stats_lock:
+            self.pending_writes += 1
+        return self._executor.submit(self._write, index_fn, *args)
+
+    def _write(self, index_fn, *args):
+        try:
+            index_fn(*args)
+            self._writer.commit()
+        except sqlite3.Error as e:
+            self._writer.rollback()
+            print(f"Search indexing failed: {e}", flush=True)
+            with self._stats_lock:
+                self.write_failures += 1
+        finally:
+            with self._stats_lock:
+                self.pending_writes -= 1
+
+    def _index_transcript(self, video_id, transcript):
+        transcript_hash = transcript.fingerprint()
+        row = self._writer.execute(
+            "SELECT transcript_hash FROM videos WHERE video_id = ?", (video_id,)).fetchone()
+        if row is not None and row[0] == transcript_hash:
+            with self._stats_lock:
+                self.skipped_transcripts += 1
+            return
+
+        self._writer.execute(
+            "DELETE FROM documents WHERE video_id = ? AND kind = 'transcript'", (video_id,))
+        self._writer.executemany(
+            "INSERT INTO documents (video_id, kind, start, content_hash, content) VALUES (?, 'transcript', ?, ?, ?)",
+            [(video_id, passage["start"], transcript_hash, passage["text"])
+             for passage in chunk_transcript(transcript, self.passage_tokens)])
+        self._writer.execute(
+            "INSERT INTO videos (video_id, transcript_hash, indexed_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (video_id) DO UPDATE SET transcript_hash = excluded.transcript_hash, "
+            "indexed_at = excluded.indexed_at",
+            (video_id, transcript_hash, time.time()))
+        with self._stats_lock:
+            self.indexed_transcripts += 1
+
+    def _index_result(self, video_id, kind, content):
+        content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        row = self._writer.execute(
+            "SELECT content_hash FROM documents WHERE video_id = ? AND kind = ?",
+            (video_id, kind)).fetchone()
+        if row is not None and row[0] == content_hash:
+            return
+
+        self._writer.execute(
+            "DELETE FROM documents WHERE video_id = ? AND kind = ?", (video_id, kind))
+        self._writer.execute(
+            "INSERT INTO documents (video_id, kind, start, content_hash, content) VALUES (?, ?, NULL, ?, ?)",
+            (video_id, kind, content_hash, content))
+        self._writer.execute(
+            "INSERT INTO videos (video_id, transcript_hash, indexed_at) VALUES (?, NULL, ?) "
+            "ON CONFLICT (video_id) DO UPDATE SET indexed_at = excluded.indexed_at",
+            (video_id, time.time()))
+        with self._stats_lock:
+            self.indexed_results += 1
+
+    def search(self, query, kinds=None, video_id=None, limit=20, offset=0, match_any=False):
+        """
+        Returns (results, total_ms) for a free-text query, best matches first.
+        Each result has the video ID, document kind, BM25 score, an HTML-escaped
+        snippet with <mark> highlights and, for transcript passages, the timestamp and a
+        link to that moment in the video.
+        """
+        started = time.perf_counter()
+        match = build_match_query(query, match_any)
+        if match is None:
+            return [], 0.0
+
+        if video_id:
+            match += f" AND video_id : {quote_term(video_id)}"
+        candidate_limit = max(self.candidates_per_kind, offset + limit)
+
+        candidates = []
+        capped = False
+        with self._reader_lock:
+            for kind in kinds or DOCUMENT_KINDS:
+                table = FTS_TABLES[kind]
+                # Newest matches first: FTS5 walks the doclists in rowid order and
+                # stops at the limit, where ORDER BY rank would score every match
+                sql = (f"SELECT rowid, bm25({table}, 1.0, 0.0) FROM {table} "
+                       f"WHERE {table} MATCH ?")
+                params = [match]
+                if video_id:
+                    # The tokenizer folds case and splits on '-' and '_'; this keeps only exact IDs
+                    sql += " AND video_id = ?"
+                    params.append(video_id)
+                sql += " ORDER BY rowid DESC LIMIT ?"
+                params.append(candidate_limit)
+                rows = self._reader.execute(sql, params).fetchall()
+                capped = capped or len(rows) == candidate_limit
+                candidates.extend((score, kind, rowid) for rowid, score in rows)
+            # Lower BM25 values are better matches
+            candidates.sort()
+            rows = []
+            for score, kind, rowid in candidates[offset:offset + limit]:
+                table = FTS_TABLES[kind]
+                row = self._reader.execute(
+                    f"SELECT video_id, start, snippet({table}, 0, ?, ?, '…', ?) "
+                    f"FROM {table} WHERE {table} MATCH ? AND rowid = ?",
+                    (MARK_START, MARK_END, self.snippet_tokens, match, rowid)).fetchone()
+                # The document may have been replaced since the candidates were read
+                if row is not None:
+                    rows.append((row[0], kind, row[1], row[2], score))
+
+        results = []
+        for result_video_id, kind, start, snippet, score in rows:
+            result = {
+                "video_id": result_video_id,
+                "kind": kind,
+                "score": round(-score, 4),
+                "snippet": highlight(snippet),
+                "url": f"https://www.youtube.com/watch?v={result_video_id}",
+            }
+            if start is not None:
+                result["start"] = round(start, 1)
+                result["timestamp"] = format_timestamp(start)
+                result["url"] += f"&t={int(start)}s"
+            results.append(result)
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            self.searches += 1
+            self.capped_searches += capped
+            self.search_ms += elapsed_ms
+        return results, elapsed_ms
+
+    def stats(self):
+        with self._reader_lock:
+            videos = self._reader.execute("SELECT COUNT(*) FROM videos").fetchone()[0]
+            documents = self._reader.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+        with self._stats_lock:
+            return {
+                "videos": videos,
+                "documents": documents,
+                "pending_writes": self.pending_writes,
+                "indexed_transcripts": self.indexed_transcripts,
+                "skipped_transcripts": self.skipped_transcripts,
+                "indexed_results": self.indexed_results,
+                "write_failures": self.write_failures,
+                "searches": self.searches,
+                "capped_searches": self.capped_searches,
+                "avg_search_ms": round(self.search_ms / self.searches, 2) if self.searches else None,
+            }
@@ -0,0 +1,229 @@
+"""
+Single-flight coalescing of identical in-flight work.
+
+The first caller for a key becomes the leader and does the work; callers that
+arrive with the same key while it is running wait for the leader and share its
+result (or its exception) instead of repeating the work. Streaming flights
+also record every published event, so late subscribers replay the stream from
+the beginning and then follow it live.
+
+Flights can be led and awaited from threads and from asyncio event loops alike;
+async callers are woken through their loop instead of blocking it.
+"""
+import asyncio
+import threading
+
+
+class Flight:
+    """One in-flight unit of work and everything it has produced so far."""
+
+    def __init__(self, streaming=False):
+        self.streaming = streaming
+        self.events = []
+        self.done = False
+        self.result = None
+        self.error = None
+        self._cond = threading.Condition()
+        # (loop, future) pairs of async callers waiting for the next change
+        self._waiters = []
+
+    def publish(self, event):
+        with self._cond:
+            self.events.append(event)
+            self._notify_locked()
+
+    def finish(self, result=None, error=None):
+        with self._cond:
+            self.result = result
+            self.error = error
+            self.done = True
+            self._notify_locked()
+
+    def _notify_locked(self):
+        self._cond.notify_all()
+        waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+
+    async def _changed(self, seen):
+        """Waits without blocking the event loop until there are more than `seen` events or the flight is done."""
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            if len(self.events) > seen or self.done:
+                return
+            future = loop.create_future()
+            self._waiters.append((loop, future))
+        await future
+
+    def wait(self, timeout=None):
+        """Blocks until the flight finishes; returns its result or raises its error."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.done, timeout=timeout):
+                raise TimeoutError("Timed out waiting for in-flight request")
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    def subscribe(self):
+        """Yields every published event in order, blocking for new ones until done."""
+        index = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: index < len(self.events) or self.done)
+                pending = self.events[index:]
+                index = len(self.events)
+                finished = self.done
+            yield from pending
+            if finished:
+                return
+
+    async def wait_async(self):
+        """Async counterpart of wait()."""
+        while not self.done:
+            await self._changed(len(self.events))
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+    async def subscribe_async(self):
+        """Async counterpart of subscribe()."""
+        index = 0
+        while True:
+            await self._changed(index)
+            with self._cond:
+                pending = self.events[index:]
+                index = len(self.events)
+                finished = self.done
+            for event in pending:
+                yield event
+            if finished:
+                return
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class SingleFlight:
+    """Coalesces concurrent calls that share a key into a single execution."""
+
+    def __init__(self, name="single_flight"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._flights = {}
+        # Running async leaders, referenced so they are not garbage collected
+        self._tasks = set()
+        self.leaders = 0
+        self.coalesced = 0
+
+    def _join(self, key, streaming):
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                return flight, False
+            flight = Flight(streaming=streaming)
+            self._flights[key] = flight
+            self.leaders += 1
+            return flight, True
+
+    def _forget(self, key, flight):
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    def do(self, key, fn):
+        """
+        Runs fn() once for all concurrent callers with the same key.
+        Returns (result, shared) where shared is True for callers that waited
+        on another caller's execution.
+        """
+        flight, is_leader = self._join(key, streaming=False)
+        if not is_leader:
+            return flight.wait(), True
+
+        try:
+            result = fn()
+        except Exception as e:
+            flight.finish(error=e)
+            raise
+        else:
+            flight.finish(result=result)
+            return result, False
+        finally:
+            self._forget(key, flight)
+
+    def stream(self, key, produce):
+        """
+        Starts produce(publish) on a background thread unless a flight for the
+        key is already running, and returns (flight, is_leader). produce
+        publishes events as it goes and returns the final result. Running it
+        off the request thread keeps the work going for the other subscribers
+        if the leader's client disconnects.
+        """
+        flight, is_leader = self._join(key, streaming=True)
+        if not is_leader:
+            return flight, False
+
+        def run():
+            try:
+                result = produce(flight.publish)
+            except Exception as e:
+                flight.finish(error=e)
+            else:
+                flight.finish(result=result)
+            finally:
+                self._forget(key, flight)
+
+        threading.Thread(target=run, name=f"{self.name}-stream", daemon=True).start()
+        return flight, True
+
+    async def do_async(self, key, fn):
+        """
+        Async counterpart of do(); fn is a coroutine function. It runs as its
+        own task, so a caller whose client disconnects does not cancel the
+        work the other callers are waiting for.
+        """
+        flight, is_leader = self._join(key, streaming=False)
+        if is_leader:
+            self._start_task(key, flight, fn())
+        return await flight.wait_async(), not is_leader
+
+    def stream_async(self, key, produce):
+        """
+        Async counterpart of stream(); produce(publish) is a coroutine function
+        and runs as a task on the current event loop. Read the events with
+        flight.subscribe_async().
+        """
+        flight, is_leader = self._join(key, streaming=True)
+        if is_leader:
+            self._start_task(key, flight, produce(flight.publish))
+        return flight, is_leader
+
+    def _start_task(self, key, flight, coroutine):
+        async def run():
+            try:
+                result = await coroutine
+            except BaseException as e:
+                # Waiters are released even if the task is cancelled at shutdown
+                flight.finish(error=e)
+                if not isinstance(e, Exception):
+                    raise
+            else:
+                flight.finish(result=result)
+            finally:
+                self._forget(key, flight)
+
+        task = asyncio.get_running_loop().create_task(run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "leaders": self.leaders,
+                "coalesced": self.coalesced,
+            }
@@ -0,0 +1,58 @@
+"""Token savings of TranscriptNormalizer on the caption fixtures in fixtures/."""
+import glob
+import os
+
+import pytest
+
+from transcript_normalizer import NON_SPEECH_PATTERN, TranscriptNormalizer, load_corpus
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "fixtures")
+
+# Minimum share of estimated tokens saved per fixture
+EXPECTED_SAVED_PERCENT = {
+    "auto_captions_lecture.json": 1.0,
+    "rolling_captions_interview.json": 45.0,
+    "manual_captions_talk.json": 0.0,
+    "clean_auto_captions.json": 0.0,
+}
+
+
+def load(name):
+    return next(load_corpus([os.path.join(FIXTURES, name)]))[1]
+
+
+def test_every_fixture_has_an_expectation():
+    names = {os.path.basename(path) for path in glob.glob(os.path.join(FIXTURES, "*.json"))}
+    assert names == set(EXPECTED_SAVED_PERCENT)
+
+
+@pytest.mark.parametrize("name, saved_percent", sorted(EXPECTED_SAVED_PERCENT.items()))
+def test_saves_tokens_and_never_lengthens(name, saved_percent):
+    transcript = load(name)
+    normalized, report = TranscriptNormalizer().normalize_with_report(transcript)
+
+    assert report["tokens_after"] <= report["tokens_before"]
+    assert report["saved_percent"] >= saved_percent
+    assert not NON_SPEECH_PATTERN.search(normalized.text)
+    # Segments keep their timestamps
+    starts = {start for start, _, _ in transcript.rows()}
+    assert all(start in starts for start, _, _ in normalized.rows())
+
+
+def test_clean_captions_get_no_periods_that_cost_tokens():
+    transcript = load("clean_auto_captions.json")
+    normalized, report = TranscriptNormalizer().normalize_with_report(transcript)
+
+    assert not report["punctuated"]
+    assert report["tokens_after"] == report["tokens_before"]
+    assert "." not in normalized.text
+
+
+def test_noisy_captions_are_cleaned():
+    normalized, report = TranscriptNormalizer().normalize_with_report(load("auto_captions_lecture.json"))
+
+    assert report["punctuated"]
+    assert report["non_speech_tags"] == 4
+    assert report["fillers"] >= 8
+    assert " uh " not in f" {normalized.text} "
+    assert "the the" not in normalized.text
@@ -0,0 +1,205 @@
+"""
+Compact, timestamp-preserving transcript representation.
+
+The transcript API returns one small dict per caption segment. Each dict costs
+a few hundred bytes, and the timing is lost once the text is joined for a
+prompt. A Transcript instead keeps the joined text in one string, and stores
+each segment's character offset, start and duration in parallel typed arrays.
+A time range is found by binary search over the start times. Slicing returns
+a view over the same buffers, so nothing is copied until its text is read.
+
+The same layout is the on-disk format of the transcript cache: a short header
+followed by the three arrays and the UTF-8 text.
+"""
+import array
+import bisect
+import hashlib
+import json
+import struct
+import sys
+
+FORMAT_MAGIC = b"CST1"
+HEADER = struct.Struct("<4sI")  # magic, segment count
+
+
+def format_timestamp(seconds):
+    """Formats seconds as m:ss or h:mm:ss."""
+    seconds = int(seconds)
+    hours, remainder = divmod(seconds, 3600)
+    minutes, seconds = divmod(remainder, 60)
+    if hours:
+        return f"{hours}:{minutes:02d}:{seconds:02d}"
+    return f"{minutes}:{seconds:02d}"
+
+
+def _little_endian(values):
+    if sys.byteorder == "big":
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+class Transcript:
+    """
+    Caption segments joined with single spaces into one text buffer. Segment i
+    spans text[offsets[i]:offsets[i + 1] - 1] and starts at starts[i] seconds.
+    Instances are immutable; slices share their parent's buffers.
+    """
+
+    __slots__ = ("_text", "_offsets", "_starts", "_durations", "_lo", "_hi")
+
+    def __init__(self, text, offsets, starts, durations, lo=0, hi=None):
+        self._text = text
+        self._offsets = offsets
+        self._starts = starts
+        self._durations = durations
+        self._lo = lo
+        self._hi = len(starts) if hi is None else hi
+
+    @classmethod
+    def from_segments(cls, segments):
+        """Builds a Transcript from [{"text", "start", "duration"}, ...], sorted by start."""
+        segments = sorted(segments, key=lambda segment: float(segment.get("start") or 0.0))
+        offsets = array.array("I")
+        starts = array.array("d")
+        durations = array.array("d")
+        texts = []
+        position = 0
+        for segment in segments:
+            text = segment.get("text") or ""
+            offsets.append(position)
+            starts.append(float(segment.get("start") or 0.0))
+            durations.append(float(segment.get("duration") or 0.0))
+            texts.append(text)
+            position += len(text) + 1
+        offsets.append(position)
+        return cls(" ".join(texts), offsets, starts, durations)
+
+    def to_bytes(self):
+        """Serializes the transcript (or this slice of it) in the cache format."""
+        if self._lo or self._hi != len(self._starts):
+            return Transcript.from_segments(self).to_bytes()
+        return b"".join((
+            HEADER.pack(FORMAT_MAGIC, len(self._starts)),
+            _little_endian(self._offsets),
+            _little_endian(self._starts),
+            _little_endian(self._durations),
+            self._text.encode("utf-8"),
+        ))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Loads a transcript written by to_bytes."""
+        view = memoryview(data)
+        magic, count = HEADER.unpack_from(view)
+        if magic != FORMAT_MAGIC:
+            raise ValueError("Not a serialized transcript")
+        position = HEADER.size
+        arrays = []
+        for typecode, length in (("I", count + 1), ("d", count), ("d", count)):
+            values = array.array(typecode)
+            end = position + length * values.itemsize
+            values.frombytes(view[position:end])
+            if sys.byteorder == "big":
+                values.byteswap()
+            arrays.append(values)
+            position = end
+        offsets, starts, durations = arrays
+        return cls(str(view[position:], "utf-8"), offsets, starts, durations)
+
+    def __len__(self):
+        return self._hi - self._lo
+
+    def __iter__(self):
+        """Yields segments as {"text", "start", "duration"} dicts."""
+        for start, duration, text in self.rows():
+            yield {"text": text, "start": start, "duration": duration}
+
+    def __getitem__(self, index):
+        """A slice returns a Transcript view over the same buffers; an int returns one segment dict."""
+        if isinstance(index, slice):
+            lo, hi, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("Transcript slices must be contiguous")
+            return Transcript(self._text, self._offsets, self._starts, self._durations,
+                              self._lo + lo, self._lo + max(lo, hi))
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Transcript segment index out of range")
+        i = self._lo + index
+        return {"text": self._segment_text(i), "start": self._starts[i], "duration": self._durations[i]}
+
+    def _segment_text(self, i):
+        return self._text[self._offsets[i]:self._offsets[i + 1] - 1]
+
+    @property
+    def text(self):
+        """The segments' text joined with spaces."""
+        if self._lo >= self._hi:
+            return ""
+        if self._lo == 0 and self._hi == len(self._starts):
+            return self._text
+        return self._text[self._offsets[self._lo]:self._offsets[self._hi] - 1]
+
+    @property
+    def start(self):
+        return self._starts[self._lo] if self._lo < self._hi else 0.0
+
+    @property
+    def end(self):
+        if self._lo >= self._hi:
+            return 0.0
+        return max(self._starts[i] + self._durations[i] for i in range(self._lo, self._hi))
+
+    def rows(self):
+        """Yields (start, duration, text) for every segment."""
+        for i in range(self._lo, self._hi):
+            yield self._starts[i], self._durations[i], self._segment_text(i)
+
+    def texts(self):
+        for i in range(self._lo, self._hi):
+            yield self._segment_text(i)
+
+    def fingerprint(self):
+        """SHA-256 of the segment texts, used to key indexes built from the transcript."""
+        return hashlib.sha256(json.dumps(list(self.texts())).encode("utf-8")).hexdigest()
+
+    def index_at(self, seconds):
+        """Returns the position of the segment playing at `seconds` (the first one before it starts)."""
+        i = bisect.bisect_right(self._starts, seconds, self._lo, self._hi) - 1
+        return max(i, self._lo) - self._lo
+
+    def start_at(self, char_index):
+        """Returns the start time of the segment that contains character `char_index` of `text`."""
+        if self._lo >= self._hi:
+            return 0.0
+        i = bisect.bisect_right(self._offsets, self._offsets[self._lo] + char_index, self._lo, self._hi) - 1
+        return self._starts[max(i, self._lo)]
+
+    def between(self, start_seconds, end_seconds):
+        """Returns a view of the segments that start before `end_seconds` and end after `start_seconds`."""
+        lo = bisect.bisect_right(self._starts, start_seconds, self._lo, self._hi)
+        # Captions overlap, so earlier segments may still be playing at start_seconds
+        while lo > self._lo and self._starts[lo - 1] + self._durations[lo - 1] > start_seconds:
+            lo -= 1
+        hi = max(lo, bisect.bisect_left(self._starts, end_seconds, lo, self._hi))
+        return Transcript(self._text, self._offsets, self._starts, self._durations, lo, hi)
+
+    def timestamped_text(self, interval=30):
+        """
+        Returns the text with a [m:ss] marker at the start of a new line every
+        `interval` seconds or so, so models can cite the moments they refer to.
+        With an interval of 0 or less, returns the plain text.
+        """
+        if interval <= 0:
+            return self.text
+        lines = []
+        i = self._lo
+        while i < self._hi:
+            # The next marker goes on the first segment at least `interval` seconds later
+            following = bisect.bisect_left(self._starts, self._starts[i] + interval, i + 1, self._hi)
+            text = self._text[self._offsets[i]:self._offsets[following] - 1]
+            lines.append(f"[{format_timestamp(self._starts[i])}] {text}")
+            i = following
+        return "\n".join(lines)
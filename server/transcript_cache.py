@@ -0,0 +1,149 @@
+"""
+Disk-backed cache for YouTube transcripts.
+
+Transcripts are stored in a small SQLite database keyed by video ID and
+language, so repeat requests for the same video never touch the network.
+Entries hold the compact Transcript format from transcript.py, compressed;
+entries written as JSON segment lists by older versions are still read.
+Entries expire after a TTL, and the least recently used entries are evicted
+once the cache grows past its byte or entry limits.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from transcript import FORMAT_MAGIC, Transcript
+
+
+class TranscriptCache:
+    """LRU + TTL transcript cache persisted to a SQLite file."""
+
+    def __init__(self, path, max_bytes=100 * 1024 * 1024, max_entries=5000, ttl_seconds=7 * 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # One connection shared across request threads, serialized by the lock
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS transcripts (
+                video_id TEXT NOT NULL,
+                language TEXT NOT NULL,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (video_id, language)
+            )""")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_transcripts_accessed ON transcripts (accessed_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def _encode(transcript):
+        return zlib.compress(transcript.to_bytes())
+
+    @staticmethod
+    def _decode(blob):
+        data = zlib.decompress(blob)
+        if data.startswith(FORMAT_MAGIC):
+            return Transcript.from_bytes(data)
+        return Transcript.from_segments(json.loads(data.decode('utf-8')))
+
+    def get(self, video_id, language):
+        """Return the cached Transcript, or None on a miss or expired entry."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, created_at FROM transcripts WHERE video_id = ? AND language = ?",
+                (video_id, language)).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            data, created_at = row
+            if self.ttl_seconds and now - created_at > self.ttl_seconds:
+                self._conn.execute(
+                    "DELETE FROM transcripts WHERE video_id = ? AND language = ?", (video_id, language))
+                self._conn.commit()
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                "UPDATE transcripts SET accessed_at = ? WHERE video_id = ? AND language = ?",
+                (now, video_id, language))
+            self._conn.commit()
+            self.hits += 1
+
+        return self._decode(data)
+
+    def put(self, video_id, language, transcript):
+        """Store a Transcript and evict old entries if the cache is over its limits."""
+        blob = self._encode(transcript)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO transcripts (video_id, language, data, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (video_id, language, blob, len(blob), now, now))
+            self._evict_locked()
+            self._conn.commit()
+
+    def _evict_locked(self):
+        count, total_bytes = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM transcripts").fetchone()
+        if count <= self.max_entries and total_bytes <= self.max_bytes:
+            return
+
+        # Walk entries from least to most recently used until we are back in bounds
+        victims = []
+        for video_id, language, size in self._conn.execute(
+                "SELECT video_id, language, size FROM transcripts ORDER BY accessed_at ASC"):
+            if count <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            victims.append((video_id, language))
+            count -= 1
+            total_bytes -= size
+
+        self._conn.executemany(
+            "DELETE FROM transcripts WHERE video_id = ? AND language = ?", victims)
+        self.evictions += len(victims)
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM transcripts")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            count, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM transcripts").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "entries": count,
+            "bytes": total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
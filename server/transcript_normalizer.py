@@ -0,0 +1,243 @@
+"""
+Normalization of caption text before it is sent to a model.
+
+Auto-generated YouTube captions carry a lot that costs prompt tokens without
+adding meaning. They contain non-speech tags such as [Music] or (applause),
+rolling captions that repeat the end of the previous line, and filler words
+and stutters. They also have no sentence punctuation. TranscriptNormalizer
+rewrites each segment of a Transcript while keeping its timestamps, and
+records how many estimated tokens it saved for each video.
+
+Measure it on a corpus of transcripts, either the transcript cache or JSON
+files in the transcript API's [{"text", "start", "duration"}, ...] format:
+    python transcript_normalizer.py cache/transcripts.sqlite3
+    python transcript_normalizer.py fixtures/*.json
+"""
+import json
+import re
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+
+from chunked_summarizer import estimate_tokens
+from transcript import Transcript
+from transcript_cache import TranscriptCache
+
+NON_SPEECH_PATTERN = re.compile(
+    r"\[[^\]]*\]"
+    r"|\((?:music|music playing|applause|laughter|laughs|laughing|cheering|cheers|"
+    r"inaudible|silence|crosstalk|noise|background noise)\)"
+    r"|[♪♫]+",
+    re.IGNORECASE)
+SPEAKER_CHANGE_PATTERN = re.compile(r"\s*>>\s*")
+# "hm" and "mm" are also units ("5 mm"), so they are only removed when not right after a number
+FILLER_PATTERN = re.compile(
+    r"\b(?:u+m+|u+h+|e+r+m+|a+h+|(?<![\d][\s-])(?:h+m+|mm+))\b[,.]?\s*", re.IGNORECASE)
+REPEATED_WORD_PATTERN = re.compile(r"\b(\w+)(?:,?\s+\1\b)+", re.IGNORECASE)
+COMPARE_PATTERN = re.compile(r"[^\w']+")
+# Doubled words that are often grammatical ("I know that that works")
+ALLOWED_REPEATS = {"that", "had"}
+SENTENCE_END = (".", "?", "!")
+# Stands in for a removed tag or speaker change, where one sentence ends and the next begins
+BREAK_MARKER = "\x00"
+# About 150 words a minute; auto-generated caption durations overlap, so speech ends are estimated
+SECONDS_PER_WORD = 0.4
+
+
+class TranscriptNormalizer:
+    """Cleans caption segments and keeps a per-video report of the tokens saved."""
+
+    def __init__(self, pause_seconds=1.0, max_overlap_words=20, min_overlap_words=2,
+                 report_entries=500, memory_entries=64):
+        self.pause_seconds = pause_seconds
+        self.max_overlap_words = max_overlap_words
+        self.min_overlap_words = min_overlap_words
+        self.report_entries = report_entries
+        self.memory_entries = memory_entries
+        self._lock = threading.Lock()
+        # Video ID -> report of its latest normalization
+        self._reports = OrderedDict()
+        # Recently normalized transcripts, so repeat requests skip the work
+        self._normalized = OrderedDict()
+        self.memory_hits = 0
+
+    def normalize(self, video_id, transcript):
+        """Returns a normalized copy of a Transcript and records its report under `video_id`."""
+        text = transcript.text
+        key = (video_id, len(text), hash(text))
+        with self._lock:
+            normalized = self._normalized.get(key)
+            if normalized is not None:
+                self._normalized.move_to_end(key)
+                self.memory_hits += 1
+                return normalized
+
+        normalized, report = self.normalize_with_report(transcript)
+        with self._lock:
+            self._normalized[key] = normalized
+            while len(self._normalized) > self.memory_entries:
+                self._normalized.popitem(last=False)
+            if video_id not in self._reports:
+                print(f"Normalized transcript of video {video_id}: {report['tokens_before']} -> "
+                      f"{report['tokens_after']} tokens ({report['saved_percent']}% saved)")
+            self._reports[video_id] = report
+            self._reports.move_to_end(video_id)
+            while len(self._reports) > self.report_entries:
+                self._reports.popitem(last=False)
+        return normalized
+
+    def normalize_with_report(self, transcript):
+        """
+        Returns (normalized Transcript, report) without recording the report.
+        Inferred sentence periods are left out when they would make an already
+        clean transcript longer than the original, and the original is
+        returned if it is still not shorter.
+        """
+        tokens_before = estimate_tokens(transcript.text)
+        for punctuate in (True, False):
+            segments, counts = self._clean_segments(transcript, punctuate)
+            normalized = Transcript.from_segments(segments)
+            if estimate_tokens(normalized.text) <= tokens_before:
+                break
+        else:
+            normalized = transcript
+        tokens_after = estimate_tokens(normalized.text)
+        report = {
+            "segments_before": len(transcript),
+            "segments_after": len(normalized),
+            "tokens_before": tokens_before,
+            "tokens_after": tokens_after,
+            "tokens_saved": tokens_before - tokens_after,
+            "saved_percent": round(100 * (tokens_before - tokens_after) / tokens_before, 1) if tokens_before else 0.0,
+            "punctuated": punctuate and normalized is not transcript,
+            **counts,
+        }
+        return normalized, report
+
+    def _clean_segments(self, transcript, punctuate):
+        """Returns (segments, counts); `punctuate` adds periods and capitals where sentences seem to end."""
+        counts = {"non_speech_tags": 0, "repeated_words": 0, "fillers": 0, "sentence_breaks": 0}
+        segments = []
+        tail = []  # Comparable forms of the last words kept, for rolling-caption overlap
+        previous_end = None
+        break_pending = False
+
+        for start, duration, text in transcript.rows():
+            text, tags = NON_SPEECH_PATTERN.subn(BREAK_MARKER, text)
+            counts["non_speech_tags"] += tags
+            text = SPEAKER_CHANGE_PATTERN.sub(BREAK_MARKER, text)
+            text, fillers = FILLER_PATTERN.subn("", text)
+            counts["fillers"] += fillers
+            text = REPEATED_WORD_PATTERN.sub(self._collapse_repeat, text)
+
+            # A pause before the segment also ends the sentence before it
+            if previous_end is not None and start - previous_end >= self.pause_seconds:
+                break_pending = True
+            words = []
+            ends = set()  # Positions of words followed by a break marker
+            for token in text.replace(BREAK_MARKER, f" {BREAK_MARKER} ").split():
+                if token != BREAK_MARKER:
+                    words.append(token)
+                elif words:
+                    ends.add(len(words) - 1)
+                else:
+                    break_pending = True
+
+            overlap = self._overlap(tail, words)
+            counts["repeated_words"] += overlap
+            words = words[overlap:]
+            if not words:
+                break_pending = break_pending or bool(ends)
+                continue
+            ends = {position - overlap for position in ends if position >= overlap}
+            previous_end = start + min(duration, len(words) * SECONDS_PER_WORD)
+
+            if punctuate:
+                if segments and break_pending and not segments[-1]["text"].endswith(SENTENCE_END):
+                    segments[-1]["text"] += "."
+                    counts["sentence_breaks"] += 1
+                if not segments or break_pending or segments[-1]["text"].endswith(SENTENCE_END):
+                    words[0] = words[0][:1].upper() + words[0][1:]
+                for position in sorted(ends):
+                    if position == len(words) - 1:
+                        continue
+                    if not words[position].endswith(SENTENCE_END):
+                        words[position] += "."
+                        counts["sentence_breaks"] += 1
+                    words[position + 1] = words[position + 1][:1].upper() + words[position + 1][1:]
+            break_pending = len(words) - 1 in ends
+
+            words = ["I" if word == "i" else word for word in words]
+            segments.append({"text": " ".join(words), "start": start, "duration": duration})
+            tail = (tail + [self._comparable(word) for word in words])[-self.max_overlap_words:]
+
+        if punctuate and segments and not segments[-1]["text"].endswith(SENTENCE_END):
+            segments[-1]["text"] += "."
+        return segments, counts
+
+    @staticmethod
+    def _collapse_repeat(match):
+        word = match.group(1)
+        return match.group(0) if word.lower() in ALLOWED_REPEATS else word
+
+    @staticmethod
+    def _comparable(word):
+        return COMPARE_PATTERN.sub("", word.lower())
+
+    def _overlap(self, tail, words):
+        """Number of leading `words` that repeat the end of `tail` (rolling captions)."""
+        longest = min(len(tail), len(words), self.max_overlap_words)
+        if not longest:
+            return 0
+        head = [self._comparable(word) for word in words[:longest]]
+        for size in range(longest, self.min_overlap_words - 1, -1):
+            if tail[-size:] == head[:size]:
+                return size
+        # A stutter split across two segments
+        if head[0] == tail[-1] and head[0] not in ALLOWED_REPEATS:
+            return 1
+        return 0
+
+    def stats(self):
+        with self._lock:
+            reports = list(self._reports.items())
+        tokens_before = sum(report["tokens_before"] for _, report in reports)
+        tokens_after = sum(report["tokens_after"] for _, report in reports)
+        return {
+            "videos": len(reports),
+            "tokens_before": tokens_before,
+            "tokens_after": tokens_after,
+            "tokens_saved": tokens_before - tokens_after,
+            "saved_percent": round(100 * (tokens_before - tokens_after) / tokens_before, 1) if tokens_before else 0.0,
+            "memory_hits": self.memory_hits,
+            "recent": [{"video_id": video_id, **report} for video_id, report in reports[-10:]],
+        }
+
+
+def load_corpus(paths):
+    """Yields (name, Transcript) for JSON segment files or transcript cache databases."""
+    for path in paths:
+        if path.endswith(".json"):
+            with open(path, encoding="utf-8") as f:
+                yield path, Transcript.from_segments(json.load(f))
+            continue
+        conn = sqlite3.connect(path)
+        for video_id, language, blob in conn.execute("SELECT video_id, language, data FROM transcripts"):
+            yield f"{video_id} ({language})", TranscriptCache._decode(blob)
+        conn.close()
+
+
+if __name__ == "__main__":
+    normalizer = TranscriptNormalizer()
+    total_before = total_after = 0
+    for name, transcript in load_corpus(sys.argv[1:]):
+        _, report = normalizer.normalize_with_report(transcript)
+        total_before += report["tokens_before"]
+        total_after += report["tokens_after"]
+        print(f"{name}: {report['tokens_before']} -> {report['tokens_after']} tokens "
+              f"({report['saved_percent']}% saved, {report['non_speech_tags']} tags, "
+              f"{report['repeated_words']} repeated words, {report['fillers']} fillers)")
+    if total_before:
+        print(f"Total: {total_before} -> {total_after} tokens "
+              f"({round(100 * (total_before - total_after) / total_before, 1)}% saved)")
@@ -0,0 +1,313 @@
+"""
+Per-video retrieval index for "chat with this video".
+
+A cached transcript is grouped into timestamped chunks of a few hundred
+tokens, and every chunk is embedded once, with Ollama's embedding endpoint
+when an embedding model is installed or a local feature-hashing embedder
+otherwise. A question is embedded the same way and answered from the top-k
+chunks by cosine similarity, computed as one matrix-vector product over the
+normalized chunk vectors. Prompts therefore stay the same size however long
+the video is.
+
+Indexes are kept in memory for recently used videos and persisted to SQLite,
+keyed by video, language, embedder and a hash of the transcript, so a
+refetched transcript that changed is indexed again.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from chunked_summarizer import estimate_tokens
+from single_flight import SingleFlight
+
+WORD_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)?")
+
+
+def chunk_transcript(transcript, max_tokens=200):
+    """
+    Groups the segments of a Transcript into chunks of about `max_tokens` estimated tokens.
+    Returns [{"start": seconds, "end": seconds, "text": str}, ...] in order.
+    """
+    chunks = []
+    parts = []
+    tokens = 0
+    start = end = 0.0
+    for segment_start, duration, text in transcript.rows():
+        text = text.replace("\n", " ").strip()
+        if not text:
+            continue
+        if not parts:
+            start = segment_start
+        parts.append(text)
+        tokens += estimate_tokens(text) + 1
+        end = segment_start + duration
+        if tokens >= max_tokens:
+            chunks.append({"start": start, "end": end, "text": " ".join(parts)})
+            parts, tokens = [], 0
+    if parts:
+        chunks.append({"start": start, "end": end, "text": " ".join(parts)})
+    return chunks
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32)
+
+
+class HashingEmbedder:
+    """
+    Local fallback embedder: word unigrams and bigrams hashed into a fixed
+    number of dimensions with sublinear term frequencies. Needs no model, and
+    matches questions to chunks that share their wording.
+    """
+
+    def __init__(self, dimensions=1024):
+        self.dimensions = dimensions
+        self.name = f"hashing-{dimensions}"
+
+    def available(self):
+        return True
+
+    def _bucket(self, feature):
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "little") % self.dimensions
+
+    def embed(self, texts):
+        matrix = np.zeros((len(texts), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = WORD_PATTERN.findall(text.lower())
+            features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+            for feature in features:
+                matrix[row, self._bucket(feature)] += 1.0
+        np.log1p(matrix, out=matrix)
+        return normalize_rows(matrix)
+
+
+class OllamaEmbedder:
+    """Embeds texts with an Ollama embedding model through /api/embed, in batches."""
+
+    def __init__(self, client, model, is_installed, batch_size=32, deadline=120):
+        self.client = client
+        self.model = model
+        self.name = f"ollama:{model}"
+        self._is_installed = is_installed
+        self.batch_size = batch_size
+        self.deadline = deadline
+
+    def available(self):
+        return self._is_installed(self.model)
+
+    def embed(self, texts):
+        vectors = []
+        for offset in range(0, len(texts), self.batch_size):
+            response = self.client.post("/api/embed", {
+                "model": self.model,
+                "input": texts[offset:offset + self.batch_size],
+            }, deadline=self.deadline)
+            response.raise_for_status()
+            vectors.extend(response.json()["embeddings"])
+        return normalize_rows(np.asarray(vectors, dtype=np.float32))
+
+
+class VideoIndex:
+    """Timestamped chunks of one transcript and their normalized embedding matrix."""
+
+    def __init__(self, video_id, embedder, chunks, vectors):
+        self.video_id = video_id
+        self.embedder = embedder
+        self.chunks = chunks
+        self.vectors = vectors
+
+    def top_k(self, query_vector, k):
+        """Returns [(chunk, score), ...] for the `k` most similar chunks, in transcript order."""
+        if not self.chunks:
+            return []
+        scores = self.vectors @ query_vector
+        k = min(k, len(self.chunks))
+        best = np.argpartition(-scores, k - 1)[:k]
+        return [(self.chunks[i], float(scores[i])) for i in sorted(best)]
+
+
+class VideoIndexStore:
+    """Builds, caches and searches per-video indexes."""
+
+    def __init__(self, path, embedders, chunk_tokens=200, max_entries=1000, memory_entries=32):
+        # Embedders in order of preference; the last one should always be available
+        self.embedders = list(embedders)
+        self._embedders_by_name = {embedder.name: embedder for embedder in self.embedders}
+        self.chunk_tokens = chunk_tokens
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._flights = SingleFlight("video-index")
+
+        self.built = 0
+        self.build_seconds = 0.0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.embedder_failures = 0
+        self.searches = 0
+        self.search_ms = 0.0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS video_indexes (
+                video_id TEXT NOT NULL,
+                language TEXT NOT NULL,
+                embedder TEXT NOT NULL,
+                transcript_hash TEXT NOT NULL,
+                chunks BLOB NOT NULL,
+                vectors BLOB NOT NULL,
+                dimensions INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (video_id, language, embedder, transcript_hash)
+            )""")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_video_indexes_accessed ON video_indexes (accessed_at)")
+        self._conn.commit()
+
+    def _preferred_embedder(self):
+        for embedder in self.embedders:
+            if embedder.available():
+                return embedder
+        return self.embedders[-1]
+
+    def get(self, video_id, language, transcript):
+        """Returns the index for a Transcript, loading or building it as needed."""
+        transcript_hash = transcript.fingerprint()
+        embedder = self._preferred_embedder()
+        key = (video_id, language, embedder.name, transcript_hash)
+
+        with self._lock:
+            index = self._memory.get(key)
+            if index is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return index
+
+        # Concurrent first questions about the same video share one build
+        index, _ = self._flights.do(key, lambda: self._load_or_build(key, transcript))
+        with self._lock:
+            self._memory[key] = index
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+        return index
+
+    def _load_or_build(self, key, transcript):
+        video_id, language, embedder_name, transcript_hash = key
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT chunks, vectors, dimensions FROM video_indexes "
+                "WHERE video_id = ? AND language = ? AND embedder = ? AND transcript_hash = ?",
+                key).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    "UPDATE video_indexes SET accessed_at = ? "
+                    "WHERE video_id = ? AND language = ? AND embedder = ? AND transcript_hash = ?",
+                    (time.time(),) + key)
+                self._conn.commit()
+                self.disk_hits += 1
+        if row is not None:
+            chunks = json.loads(zlib.decompress(row[0]).decode("utf-8"))
+            vectors = np.frombuffer(row[1], dtype=np.float32).reshape(len(chunks), row[2])
+            return VideoIndex(video_id, embedder_name, chunks, vectors)
+
+        started = time.perf_counter()
+        chunks = chunk_transcript(transcript, self.chunk_tokens)
+        embedder, vectors = self._embed_with_fallback(
+            self._embedders_by_name[embedder_name], [chunk["text"] for chunk in chunks])
+        elapsed = time.perf_counter() - started
+        print(f"Indexed {len(chunks)} transcript chunks of video {video_id} with {embedder.name} "
+              f"in {elapsed:.2f}s", flush=True)
+
+        now = time.time()
+        with self._lock:
+            self.built += 1
+            self.build_seconds += elapsed
+            self._conn.execute(
+                "INSERT OR REPLACE INTO video_indexes (video_id, language, embedder, transcript_hash, "
+                "chunks, vectors, dimensions, created_at, accessed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (video_id, language, embedder.name, transcript_hash,
+                 zlib.compress(json.dumps(chunks).encode("utf-8")),
+                 vectors.tobytes(), vectors.shape[1], now, now))
+            self._evict_locked()
+            self._conn.commit()
+        return VideoIndex(video_id, embedder.name, chunks, vectors)
+
+    def _embed_with_fallback(self, embedder, texts):
+        """Returns (embedder, vectors), moving down the embedder list when one fails."""
+        if not texts:
+            return embedder, np.zeros((0, 1), dtype=np.float32)
+        candidates = self.embedders[self.embedders.index(embedder):]
+        for candidate in candidates:
+            try:
+                return candidate, candidate.embed(texts)
+            except Exception as e:
+                if candidate is candidates[-1]:
+                    raise
+                print(f"Embedding with {candidate.name} failed, falling back: {e}", flush=True)
+                with self._lock:
+                    self.embedder_failures += 1
+
+    def search(self, index, query, k=5):
+        """Returns [(chunk, score), ...] for the `k` chunks most relevant to `query`, in transcript order."""
+        started = time.perf_counter()
+        embedder = self._embedders_by_name[index.embedder]
+        try:
+            query_vector = embedder.embed([query])[0]
+            results = index.top_k(query_vector, k)
+        except Exception as e:
+            # The embedding model went away; rank this video by the local embedder instead
+            print(f"Embedding the question with {embedder.name} failed: {e}", flush=True)
+            with self._lock:
+                self.embedder_failures += 1
+            fallback = self.embedders[-1]
+            texts = [chunk["text"] for chunk in index.chunks]
+            results = VideoIndex(index.video_id, fallback.name, index.chunks,
+                                 fallback.embed(texts)).top_k(fallback.embed([query])[0], k)
+        with self._lock:
+            self.searches += 1
+            self.search_ms += (time.perf_counter() - started) * 1000
+        return results
+
+    def _evict_locked(self):
+        count = self._conn.execute("SELECT COUNT(*) FROM video_indexes").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        self._conn.execute(
+            "DELETE FROM video_indexes WHERE rowid IN "
+            "(SELECT rowid FROM video_indexes ORDER BY accessed_at ASC LIMIT ?)",
+            (count - self.max_entries,))
+
+    def stats(self):
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM video_indexes").fetchone()[0]
+            return {
+                "entries": count,
+                "in_memory": len(self._memory),
+                "max_entries": self.max_entries,
+                "chunk_tokens": self.chunk_tokens,
+                "embedder": self._preferred_embedder().name,
+                "built": self.built,
+                "avg_build_seconds": round(self.build_seconds / self.built, 3) if self.built else None,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "embedder_failures": self.embedder_failures,
+                "searches": self.searches,
+                "avg_search_ms": round(self.search_ms / self.searches, 2) if self.searches else None,
+            }
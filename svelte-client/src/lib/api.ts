@@ -6,8 +6,112 @@ export interface ApiResponse<T> {
     error?: string;
 }
 
-export async function summarizeVideo(url: string): Promise<ApiResponse<{ summary: string; }>> {
+export interface StreamMetadata {
+    done: true;
+    action: 'summary' | 'explanation';
+    model: string;
+    cached: boolean;
+    first_token_seconds?: number | null;
+    total_seconds?: number;
+    prompt_eval_count?: number | null;
+    eval_count?: number | null;
+    total_duration?: number | null;
+    load_duration?: number | null;
+    prompt_eval_duration?: number | null;
+    eval_duration?: number | null;
+}
+
+type ServerEvent = { chunk?: string; done?: boolean; error?: string; [key: string]: unknown };
+
+// Reads a Server-Sent Events body ("data: {...}" blocks) and calls onEvent for each parsed event
+async function readServerEvents(response: Response, onEvent: (event: ServerEvent) => void): Promise<void> {
+    if (!response.body) {
+        return;
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) {
+            break;
+        }
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary = buffer.indexOf('\n\n');
+        while (boundary !== -1) {
+            const block = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            for (const line of block.split('\n')) {
+                if (line.startsWith('data: ')) {
+                    try {
+                        onEvent(JSON.parse(line.slice(6)));
+                    } catch {
+                        // Ignore malformed event lines
+                    }
+                }
+            }
+            boundary = buffer.indexOf('\n\n');
+        }
+    }
+}
+
+// Streams a summary or explanation, forwarding tokens to onChunk as they are generated
+async function streamTranscriptResult(
+    endpoint: 'summarize' | 'explain',
+    url: string,
+    onChunk: (chunk: string) => void
+): Promise<ApiResponse<{ content: string; metadata?: StreamMetadata; }>> {
+    const response = await fetch(`${API_BASE}/${endpoint}`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ youtube_url: url, stream: true }),
+    });
+
+    // Validation and transcript errors are returned as JSON before streaming starts
+    if (!response.ok) {
+        const data = await response.json();
+        return { success: false, error: data.error };
+    }
+
+    let content = '';
+    let metadata: StreamMetadata | undefined;
+    let error: string | undefined;
+
+    await readServerEvents(response, (event) => {
+        if (event.chunk) {
+            content += event.chunk;
+            onChunk(event.chunk);
+        } else if (event.done) {
+            metadata = event as unknown as StreamMetadata;
+        } else if (event.error) {
+            error = event.error;
+        }
+    });
+
+    if (error || !metadata) {
+        return { success: false, error: error || 'Stream ended unexpectedly' };
+    }
+    return { success: true, data: { content, metadata } };
+}
+
+export async function summarizeVideo(
+    url: string,
+    onChunk?: (chunk: string) => void
+): Promise<ApiResponse<{ summary: string; metadata?: StreamMetadata; }>> {
     try {
+        if (onChunk) {
+            const streamed = await streamTranscriptResult('summarize', url, onChunk);
+            if (!streamed.success || !streamed.data) {
+                return { success: false, error: streamed.error || 'Failed to get summary' };
+            }
+            return { success: true, data: { summary: streamed.data.content, metadata: streamed.data.metadata } };
+        }
+
         const response = await fetch(`${API_BASE}/summarize`, {
             method: 'POST',
             headers: {
@@ -31,8 +135,19 @@ export async function summarizeVideo(url: string): Promise<ApiResponse<{ summary
     }
 }
 
-export async function explainVideo(url: string): Promise<ApiResponse<{ explanation: string; }>> {
+export async function explainVideo(
+    url: string,
+    onChunk?: (chunk: string) => void
+): Promise<ApiResponse<{ explanation: string; metadata?: StreamMetadata; }>> {
     try {
+        if (onChunk) {
+            const streamed = await streamTranscriptResult('explain', url, onChunk);
+            if (!streamed.success || !streamed.data) {
+                return { success: false, error: streamed.error || 'Failed to get explanation' };
+            }
+            return { success: true, data: { explanation: streamed.data.content, metadata: streamed.data.metadata } };
+        }
+
         const response = await fetch(`${API_BASE}/explain`, {
             method: 'POST',
             headers: {
@@ -54,35 +169,85 @@ export async function explainVideo(url: string): Promise<ApiResponse<{ explanati
     }
 }
 
+export type ChatHistoryMessage = { type: string; content: string; };
+
+// Server-side chat session IDs, keyed by the client's chat ID
+const chatSessionIds = new Map<string, string>();
+
+async function createChatSession(conversationHistory?: ChatHistoryMessage[]): Promise<string> {
+    const response = await fetch(`${API_BASE}/chat/sessions`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ conversation_history: conversationHistory ?? [] }),
+    });
+    const data = await response.json();
+    if (!response.ok) {
+        throw new Error(data.error || 'Failed to create chat session');
+    }
+    return data.session_id;
+}
+
+export function forgetChatSession(chatId: string): void {
+    const sessionId = chatSessionIds.get(chatId);
+    chatSessionIds.delete(chatId);
+    if (sessionId) {
+        fetch(`${API_BASE}/chat/sessions/${sessionId}`, { method: 'DELETE' }).catch(() => undefined);
+    }
+}
+
+export type UploadedImage = { image_id: string; size: number; mime_type: string; sha256: string; };
+
+// Uploads images as binary multipart parts instead of base64 JSON; accepts files, blobs or data URLs
+export async function uploadImages(images: (Blob | string)[]): Promise<ApiResponse<UploadedImage[]>> {
+    const form = new FormData();
+    for (const image of images) {
+        // Data URLs are decoded locally; only the raw bytes are sent
+        const blob = typeof image === 'string' ? await (await fetch(image)).blob() : image;
+        form.append('images', blob);
+    }
+
+    const response = await fetch(`${API_BASE}/images`, { method: 'POST', body: form });
+    if (!response.ok) {
+        const data = await response.json().catch(() => ({}));
+        return { success: false, error: data.error || 'Failed to upload images' };
+    }
+    const data = await response.json();
+    return { success: true, data: data.images };
+}
+
 export async function sendChatMessage(
     message: string,
     images?: string[],
     onChunk?: (chunk: string) => void,
-    conversationHistory?: Array<{ type: string; content: string; }>
+    conversationHistory?: ChatHistoryMessage[],
+    chatId?: string
 ): Promise<ApiResponse<{ reply: string; }>> {
     try {
         const requestBody: {
             message: string;
             images?: string[];
+            image_ids?: string[];
             stream?: boolean;
-            conversation_history?: Array<{ type: string; content: string; }>;
+            session_id?: string;
+            conversation_history?: ChatHistoryMessage[];
         } = {
             message,
             stream: !!onChunk  // Enable streaming if onChunk callback is provided
         };
 
-        // If images are provided, include them in the request
+        // Images are uploaded as binary and referenced by ID; base64 JSON is the fallback
         if (images && images.length > 0) {
-            requestBody.images = images;
-        }
-
-        // If conversation history is provided, include it in the request
-        if (conversationHistory && conversationHistory.length > 0) {
-            requestBody.conversation_history = conversationHistory;
+            const uploaded = await uploadImages(images).catch(() => undefined);
+            if (uploaded?.success && uploaded.data) {
+                requestBody.image_ids = uploaded.data.map((image) => image.image_id);
+            } else {
+                requestBody.images = images;
+            }
         }
 
-
-        const response = await fetch(`${API_BASE}/chat`, {
+        const post = () => fetch(`${API_BASE}/chat`, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -90,12 +255,60 @@ export async function sendChatMessage(
             body: JSON.stringify(requestBody),
         });
 
+        let response: Response;
+        if (chatId) {
+            // The server keeps the history; the full conversation is only uploaded when a session is (re)created
+            let sessionId = chatSessionIds.get(chatId);
+            if (!sessionId) {
+                sessionId = await createChatSession(conversationHistory);
+                chatSessionIds.set(chatId, sessionId);
+            }
+            requestBody.session_id = sessionId;
+            response = await post();
+
+            if (response.status === 404) {
+                // Session expired on the server; recreate it from the local history and retry once
+                sessionId = await createChatSession(conversationHistory);
+                chatSessionIds.set(chatId, sessionId);
+                requestBody.session_id = sessionId;
+                response = await post();
+            }
+        } else {
+            // If conversation history is provided, include it in the request
+            if (conversationHistory && conversationHistory.length > 0) {
+                requestBody.conversation_history = conversationHistory;
+            }
+            response = await post();
+        }
+
 
         if (!response.ok) {
             const errorData = await response.json();
             return { success: false, error: errorData.error || 'Failed to get response' };
-        }        // Handle streaming response (but server doesn't actually support it yet)
-        // For now, always handle as non-streaming and simulate typewriter effect if needed
+        }
+
+        // Image messages are streamed as Server-Sent Events; text replies still arrive as JSON
+        if (response.headers.get('Content-Type')?.startsWith('text/event-stream')) {
+            let reply = '';
+            let finished = false;
+            let error: string | undefined;
+            await readServerEvents(response, (event) => {
+                if (event.chunk) {
+                    reply += event.chunk;
+                    onChunk?.(event.chunk);
+                } else if (event.done) {
+                    finished = true;
+                } else if (event.error) {
+                    error = event.error;
+                }
+            });
+            if (error || !finished) {
+                return { success: false, error: error || 'Stream ended unexpectedly' };
+            }
+            return { success: true, data: { reply } };
+        }
+
+        // For JSON replies, simulate a typewriter effect if needed
         const data = await response.json();
 
         if (onChunk && data.reply) {